@@ -0,0 +1,74 @@
+"""Background purge of deleted accounts.
+
+Account deletion marks the user deleted straight away and then removes their
+rows here in small batches, each in its own short transaction, so a heavy
+user's purge never holds the SQLite writer lock for long. Failed purges are
+retried at startup and by the "purge" maintenance task (db_maintenance.py).
+"""
+import os
+import threading
+import time
+
+from database import AccountPurgeDatabase
+
+PURGE_BATCH_SIZE = int(os.getenv("PURGE_BATCH_SIZE", "500"))
+# Pause between batches so queued writers get the lock
+PURGE_PAUSE_SECONDS = float(os.getenv("PURGE_PAUSE_SECONDS", "0.02"))
+VACUUM_PAGES_PER_STEP = 1000
+
+_running = set()
+_running_lock = threading.Lock()
+
+
+def run_purge(user_id: str):
+    """Delete all of a user's data batch by batch, then vacuum the freed pages"""
+    try:
+        # The second pass sweeps rows written by requests authenticated just before the deletion
+        for _ in range(2):
+            for table, statement in AccountPurgeDatabase.PURGE_STEPS:
+                while AccountPurgeDatabase.delete_batch(user_id, table, statement, PURGE_BATCH_SIZE) > 0:
+                    time.sleep(PURGE_PAUSE_SECONDS)
+        AccountPurgeDatabase.finish_purge(user_id)
+    except Exception as e:
+        print(f"Account purge failed for {user_id}: {e}")
+        AccountPurgeDatabase.mark_failed(user_id)
+        return
+    finally:
+        with _running_lock:
+            _running.discard(user_id)
+
+    # Hand freed pages back in steps; a no-op unless the file uses auto_vacuum=INCREMENTAL
+    try:
+        remaining = AccountPurgeDatabase.incremental_vacuum(VACUUM_PAGES_PER_STEP, user_id)
+        while remaining:
+            time.sleep(PURGE_PAUSE_SECONDS)
+            still_free = AccountPurgeDatabase.incremental_vacuum(VACUUM_PAGES_PER_STEP, user_id)
+            if still_free >= remaining:
+                break
+            remaining = still_free
+    except Exception as e:
+        # The purge itself is done; the maintenance vacuum task reclaims the pages later
+        print(f"Vacuum after account purge failed for {user_id}: {e}")
+
+
+def start_purge(user_id: str):
+    """Run the purge for a user on a background thread unless one is already running"""
+    with _running_lock:
+        if user_id in _running:
+            return
+        _running.add(user_id)
+    threading.Thread(target=run_purge, args=(user_id,), name=f"purge-{user_id}", daemon=True).start()
+
+
+def resume_unfinished_purges():
+    """Restart purges interrupted by a shutdown or that failed"""
+    for user_id in AccountPurgeDatabase.get_unfinished_purges():
+        start_purge(user_id)
+
+
+def retry_failed_purges() -> list:
+    """Restart failed purges; returns their user ids"""
+    user_ids = AccountPurgeDatabase.get_unfinished_purges(("failed",))
+    for user_id in user_ids:
+        start_purge(user_id)
+    return user_ids
@@ -0,0 +1,332 @@
+"""Incremental export of user data to Parquet files for analytics.
+
+Copies messages, conversations, mood_entries, journal_entries and goals into
+a Hive-partitioned dataset, so analytics queries never touch the live
+database:
+
+    analytics/<table>/month=YYYY-MM/<run>-<database>-<n>.parquet
+
+`month` is the row's created_at month. Each run writes only what changed
+since the previous one:
+
+  * new rows: ids above the high-water mark recorded for each table
+  * edited rows: from analytics_changes, which triggers fill while
+    ANALYTICS_EXPORT_ENABLED=1 (see init_db)
+  * messages of conversations frozen since (cold_storage.py): all of them,
+    decoded from conversation_archive
+
+An edited row is written again, as is a conversation's history when it is
+frozen, so a table can hold several versions of a row. Keep the one with
+the latest exported_at. Rows deleted since the previous run (single rows,
+deleted conversations' messages, and every row of users whose account
+purge completed) are removed from the files of earlier runs. Pages of
+ANALYTICS_CHUNK_ROWS rows are streamed from SQLite into the files, so
+memory does not grow with the tables. With sharded storage every shard is
+exported; the shard is part of the file name.
+
+    python analytics_export.py              # export what changed
+    python analytics_export.py --full       # start over, e.g. after shard_migrate.py
+
+Query it with any Parquet reader, e.g.
+
+    pyarrow.dataset.dataset("analytics/messages", partitioning="hive")
+"""
+import argparse
+import contextvars
+import glob
+import json
+import os
+import shutil
+import time
+from datetime import datetime, timedelta, timezone
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from database import ANALYTICS_EXPORT_ENABLED, AnalyticsExportDatabase, database_path, each_database, get_storage_layout
+
+ANALYTICS_EXPORT_DIR = os.getenv("ANALYTICS_EXPORT_DIR", os.path.join(os.path.dirname(__file__), "analytics"))
+ANALYTICS_CHUNK_ROWS = int(os.getenv("ANALYTICS_CHUNK_ROWS", "5000"))
+ANALYTICS_ROWS_PER_FILE = int(os.getenv("ANALYTICS_ROWS_PER_FILE", "500000"))
+# Conversations frozen this recently wait for the next run, so none committing late is skipped
+ARCHIVE_LAG_SECONDS = 60
+TRIM_BATCH_SIZE = 1000
+STATE_FILE = "_state.json"
+
+TIMESTAMP = pa.timestamp("ms")
+# Arrow type of each exported column; the rest are strings
+COLUMN_TYPES = {
+    "id": pa.int64(),
+    "conversation_id": pa.int64(),
+    "mood_level": pa.int64(),
+    "target_value": pa.int64(),
+    "current_value": pa.int64(),
+    "is_archived": pa.bool_(),
+    "created_at": TIMESTAMP,
+    "updated_at": TIMESTAMP,
+    "completed_at": TIMESTAMP,
+    "crisis_flagged_at": TIMESTAMP,
+    "start_date": pa.date32(),
+    "target_date": pa.date32(),
+}
+PARTITIONING = ds.partitioning(pa.schema([("month", pa.string())]), flavor="hive")
+
+
+def table_schema(table: str) -> pa.Schema:
+    _, columns = AnalyticsExportDatabase.COLUMNS[table]
+    fields = [pa.field(name, COLUMN_TYPES.get(name, pa.string())) for name, _ in columns]
+    return pa.schema(fields + [pa.field("month", pa.string()), pa.field("exported_at", TIMESTAMP)])
+
+
+def to_batch(schema: pa.Schema, rows: list, exported_at: datetime) -> pa.RecordBatch:
+    """Rows of (columns..., month) from AnalyticsExportDatabase as a record batch"""
+    arrays = []
+    for field, values in zip(schema, zip(*rows)):
+        if pa.types.is_timestamp(field.type) or pa.types.is_date(field.type):
+            arrays.append(pa.array(values, pa.string()).cast(field.type))
+        elif pa.types.is_boolean(field.type):
+            arrays.append(pa.array(values, pa.int64()).cast(field.type))
+        else:
+            arrays.append(pa.array(values, field.type))
+    arrays.append(pa.repeat(pa.scalar(exported_at, TIMESTAMP), len(rows)))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def normalize_timestamp(value):
+    """A stored timestamp in the form SQLite's strftime gives the other columns, and its month"""
+    try:
+        parsed = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None, None
+    if parsed.tzinfo:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed.isoformat(" ", "milliseconds"), parsed.strftime("%Y-%m")
+
+
+def archived_message_rows(mark: dict, plan: dict):
+    """Rows of every message in conversations frozen since the last run.
+
+    Some were written before, but a run may have missed others: frozen before
+    it read the hot table, or edited (intents) in between.
+    """
+    after = tuple(mark.get("archived", ("", 0)))
+    while True:
+        archives = AnalyticsExportDatabase.get_archived_messages(after, plan["archived_before"], ANALYTICS_CHUNK_ROWS)
+        rows = [
+            (message_id, conversation_id, user_id, role, content, intent, *normalize_timestamp(created_at))
+            for conversation_id, user_id, _, messages in archives if user_id is not None
+            for message_id, role, content, intent, created_at in messages
+        ]
+        if rows:
+            yield rows
+        if archives:
+            after = (archives[-1][2], archives[-1][0])
+            plan["archived"] = after
+        if len(archives) < ANALYTICS_CHUNK_ROWS:
+            return
+
+
+def in_context(context: contextvars.Context, batches):
+    """Pull batches in `context`: Arrow reads the iterator on its own threads, which
+    would otherwise lose the shard each_database picked"""
+    while True:
+        try:
+            yield context.run(next, batches)
+        except StopIteration:
+            return
+
+
+def table_batches(table: str, schema: pa.Schema, mark: dict, plan: dict, deleted: dict, exported_at: datetime):
+    """Record batches of one table's new and edited rows in the current database"""
+    # Messages of a deleted conversation stay in the table without an owner; they are not exported
+    owner = schema.get_field_index("user_id")
+    after = mark.get("id", 0)
+    while True:
+        rows = AnalyticsExportDatabase.get_new_rows(table, after, plan["until_id"], ANALYTICS_CHUNK_ROWS)
+        owned = [row for row in rows if row[owner] is not None]
+        if owned:
+            plan["rows"] += len(owned)
+            yield to_batch(schema, owned, exported_at)
+        if len(rows) < ANALYTICS_CHUNK_ROWS:
+            break
+        after = rows[-1][0]
+
+    after = plan["after_change"]
+    while after is not None:
+        changes = AnalyticsExportDatabase.get_changed_rows(table, after, plan["until_change"], ANALYTICS_CHUNK_ROWS)
+        edited = {}
+        for _, row_id, is_delete, *row in changes:
+            if is_delete:
+                deleted.setdefault(table, set()).add(row_id)
+            elif row[owner] is not None and row_id <= mark.get("id", 0):
+                # Newer rows went out with the new rows above; one version per row and page
+                edited[row_id] = row
+        if edited:
+            plan["rows"] += len(edited)
+            yield to_batch(schema, list(edited.values()), exported_at)
+        after = changes[-1][0] if len(changes) == ANALYTICS_CHUNK_ROWS else None
+
+    if table == "messages":
+        for rows in archived_message_rows(mark, plan):
+            plan["rows"] += len(rows)
+            yield to_batch(schema, rows, exported_at)
+
+
+def export_database(export_dir: str, run: str, marks: dict, deleted: dict, exported_at: datetime) -> dict:
+    """Export the current database (see each_database); returns its new marks and rows written per table"""
+    name = os.path.splitext(os.path.basename(database_path()))[0]
+    first_run = not marks
+    # The log position is read before the ids, so every edit it misses is on a row read after it
+    until_change = AnalyticsExportDatabase.get_high_water("analytics_changes")
+    archived_before = (datetime.utcnow() - timedelta(seconds=ARCHIVE_LAG_SECONDS)).strftime("%Y-%m-%d %H:%M:%S")
+    new_marks = {"changes": until_change}
+    counts = {}
+    for table in AnalyticsExportDatabase.COLUMNS:
+        mark = marks.get(table, {})
+        plan = {
+            "until_id": AnalyticsExportDatabase.get_high_water(table),
+            "after_change": None if first_run else marks["changes"],
+            "until_change": until_change,
+            "archived_before": archived_before,
+            "rows": 0,
+        }
+        schema = table_schema(table)
+        ds.write_dataset(
+            in_context(contextvars.copy_context(), table_batches(table, schema, mark, plan, deleted, exported_at)),
+            os.path.join(export_dir, table),
+            schema=schema, format="parquet", partitioning=PARTITIONING,
+            basename_template=f"{run}-{name}-{{i}}.parquet", existing_data_behavior="overwrite_or_ignore",
+            max_rows_per_file=ANALYTICS_ROWS_PER_FILE, max_rows_per_group=ANALYTICS_CHUNK_ROWS,
+            min_rows_per_group=0, max_open_files=64,
+        )
+        new_marks[table] = {"id": plan["until_id"]}
+        if table == "messages":
+            new_marks[table]["archived"] = plan.get("archived", mark.get("archived", ("", 0)))
+        counts[table] = plan["rows"]
+        print(f"Analytics export: {plan['rows']} {table} rows from {name}")
+    return {"marks": new_marks, "rows": counts}
+
+
+def prune(export_dir: str, run: str, deleted: dict, purged_users: list) -> int:
+    """Rewrite files of earlier runs without deleted rows and purged users; returns rows removed"""
+    removed = 0
+    purged = pa.array(purged_users, pa.string())
+    for table in AnalyticsExportDatabase.COLUMNS:
+        ids = pa.array(sorted(deleted.get(table, ())), pa.int64())
+        conversations = pa.array(sorted(deleted.get("conversations", ())) if table == "messages" else [], pa.int64())
+        if not (len(ids) or len(conversations) or len(purged)):
+            continue
+        for path in glob.glob(os.path.join(export_dir, table, "*", "*.parquet")):
+            if os.path.basename(path).startswith(f"{run}-"):
+                # Written after the deletes and purges were read
+                continue
+            source = pq.ParquetFile(path)
+            keys = source.read(columns=["id", "user_id", "conversation_id"] if table == "messages" else ["id", "user_id"])
+            drop = pc.or_(pc.is_in(keys["id"], ids), pc.is_in(keys["user_id"], purged))
+            if table == "messages":
+                drop = pc.or_(drop, pc.is_in(keys["conversation_id"], conversations))
+            dropped = pc.sum(drop.cast(pa.int64())).as_py() or 0
+            if not dropped:
+                continue
+            removed += dropped
+            if dropped == len(keys):
+                os.remove(path)
+                continue
+            partial = path + ".partial"
+            with pq.ParquetWriter(partial, source.schema_arrow) as writer:
+                for batch in source.iter_batches(batch_size=ANALYTICS_CHUNK_ROWS):
+                    keep = pc.invert(pc.or_(pc.is_in(batch["id"], ids), pc.is_in(batch["user_id"], purged)))
+                    if table == "messages":
+                        keep = pc.and_(keep, pc.invert(pc.is_in(batch["conversation_id"], conversations)))
+                    writer.write_batch(batch.filter(keep))
+            os.replace(partial, path)
+    return removed
+
+
+def load_state(export_dir: str) -> dict:
+    path = os.path.join(export_dir, STATE_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_state(export_dir: str, state: dict):
+    path = os.path.join(export_dir, STATE_FILE)
+    with open(path + ".partial", "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(path + ".partial", path)
+
+
+def export_all(export_dir: str = ANALYTICS_EXPORT_DIR, full: bool = False) -> dict:
+    """Export what changed since the last run, or everything with full"""
+    if not ANALYTICS_EXPORT_ENABLED:
+        raise SystemExit("Edits are not being logged; set ANALYTICS_EXPORT_ENABLED=1 for the API and the export")
+    started = time.perf_counter()
+    layout = get_storage_layout()
+    if full:
+        for table in AnalyticsExportDatabase.COLUMNS:
+            shutil.rmtree(os.path.join(export_dir, table), ignore_errors=True)
+        if os.path.exists(os.path.join(export_dir, STATE_FILE)):
+            os.remove(os.path.join(export_dir, STATE_FILE))
+    os.makedirs(export_dir, exist_ok=True)
+    state = load_state(export_dir)
+    if not state and glob.glob(os.path.join(export_dir, "*", "*", "*.parquet")):
+        raise SystemExit(f"{export_dir} holds files but no {STATE_FILE}; run with --full to start over")
+    if state and state["layout"] != layout:
+        # Ids and high-water marks belong to the old files, or edits went unlogged
+        raise SystemExit(
+            "The storage layout or the edit log changed since the last export "
+            "(shard_migrate.py, ANALYTICS_EXPORT_ENABLED); run with --full"
+        )
+
+    exported_at = datetime.utcnow()
+    run = exported_at.strftime("%Y%m%dT%H%M%S")
+    # Read in the directory, before the loop moves calls to the shards
+    purges = AnalyticsExportDatabase.get_purged_users(state.get("purged_through", ""))
+    purged_through = max([finished for _, finished in purges] + [state.get("purged_through", "")])
+
+    deleted = {}
+    databases = {}
+    rows = {}
+    for _ in each_database():
+        name = os.path.basename(database_path())
+        result = export_database(export_dir, run, state.get("databases", {}).get(name, {}), deleted, exported_at)
+        databases[name] = result["marks"]
+        for table, count in result["rows"].items():
+            rows[table] = rows.get(table, 0) + count
+
+    # Nothing to remove from a fresh export, which was read after the purges
+    removed = prune(export_dir, run, deleted, [user_id for user_id, _ in purges]) if state else 0
+    save_state(export_dir, {"layout": layout, "databases": databases, "purged_through": purged_through, "last_run": run})
+
+    # Only once the state is saved: a failed run reads the same changes again
+    for _ in each_database():
+        while AnalyticsExportDatabase.trim_changes(databases[os.path.basename(database_path())]["changes"], TRIM_BATCH_SIZE):
+            pass
+    return {
+        "run": run,
+        "rows": rows,
+        "rows_removed": removed,
+        "purged_users": len(purges),
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export user data to Parquet files for analytics")
+    parser.add_argument("--dir", default=ANALYTICS_EXPORT_DIR, help="Dataset directory")
+    parser.add_argument("--full", action="store_true", help="Delete the dataset and export everything again")
+    args = parser.parse_args()
+
+    result = export_all(args.dir, args.full)
+    print(f"exported {sum(result['rows'].values())} rows in {result['seconds']}s, "
+          f"removed {result['rows_removed']} deleted or purged rows")
+    for table, count in result["rows"].items():
+        print(f"  {table:<18}{count:>12,}")
+
+
+if __name__ == "__main__":
+    main()
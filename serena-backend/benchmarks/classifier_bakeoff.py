@@ -0,0 +1,166 @@
+"""Intent classifier bake-off: accuracy against serving cost.
+
+Trains every backend in intent_classifiers on the same stratified splits of
+models/dataset.json (one split per --seeds value, made by train.split_examples)
+and reports, per backend:
+
+  * validation accuracy, mean and min over the splits
+  * load time and resident memory added by loading the saved model
+  * single-item latency (p50/p95 of classify) and batched throughput
+
+The Keras model is trained with train.py's pipeline; the quantized one is
+that model after quantize.py's int8 conversion. With --export-dir the linear
+models are refit on all examples and saved there, ready for
+INTENT_MODEL_BACKEND=tfidf|hashed.
+
+Run from the serena-backend directory:
+
+    python -m benchmarks.classifier_bakeoff
+    python -m benchmarks.classifier_bakeoff --seeds 1 2 3 --export-dir models
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+from benchmarks.load_test import RESULTS_DIR, git_revision, percentile
+from intent_classifiers import BACKENDS, KerasIntentClassifier, LinearIntentClassifier, QuantizedIntentClassifier
+from train import load_examples, split_examples, train
+
+SINGLE_CALLS = 200
+BATCH_SIZE = 256
+BATCH_ROUNDS = 5
+
+
+def rss_bytes() -> int:
+    """Resident set size of this process; 0 where /proc is unavailable"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+def fit_and_save(backend: str, dataset: str, texts, labels, class_names, seed: int, directory: str):
+    if backend == KerasIntentClassifier.name:
+        train(dataset, [], directory, seed=seed, verbose=0)
+    elif backend == QuantizedIntentClassifier.name:
+        # Post-training quantization: there is nothing to fit, only a Keras model to convert
+        train(dataset, [], directory, seed=seed, verbose=0)
+        keras_classifier = KerasIntentClassifier.load(directory)
+        QuantizedIntentClassifier.from_keras(keras_classifier.model, keras_classifier.class_names).save(directory)
+    else:
+        BACKENDS[backend]().fit(list(texts), labels, class_names, seed=seed).save(directory)
+
+
+def measure_load(backend: str, directory: str) -> tuple:
+    before = rss_bytes()
+    started = time.perf_counter()
+    classifier = BACKENDS[backend].load(directory)
+    load_seconds = time.perf_counter() - started
+    return classifier, load_seconds, max(rss_bytes() - before, 0)
+
+
+def measure_latency(classifier, texts) -> dict:
+    # Warm up lazily built state (graph tracing, caches) before timing
+    classifier.classify_batch(list(texts[:8]))
+    classifier.classify(texts[0])
+
+    single = []
+    for i in range(SINGLE_CALLS):
+        started = time.perf_counter()
+        classifier.classify(texts[i % len(texts)])
+        single.append((time.perf_counter() - started) * 1000)
+    single.sort()
+
+    batch = [texts[i % len(texts)] for i in range(BATCH_SIZE)]
+    batch_seconds = []
+    for _ in range(BATCH_ROUNDS):
+        started = time.perf_counter()
+        classifier.classify_batch(batch)
+        batch_seconds.append(time.perf_counter() - started)
+    best = min(batch_seconds)
+    return {
+        "single_p50_ms": round(percentile(single, 50), 3),
+        "single_p95_ms": round(percentile(single, 95), 3),
+        "batch_items_per_second": round(BATCH_SIZE / best),
+    }
+
+
+def run_backend(backend: str, dataset: str, texts, tags, seeds) -> dict:
+    accuracies = []
+    result = {}
+    for seed in seeds:
+        (train_texts, train_labels), (val_texts, val_labels), class_names = split_examples(texts, tags, seed, 0.2)
+        directory = tempfile.mkdtemp(prefix=f"bakeoff-{backend}-")
+        fit_and_save(backend, dataset, train_texts, train_labels, class_names, seed, directory)
+
+        classifier, load_seconds, load_rss = measure_load(backend, directory)
+        predicted = np.array(classifier.classify_batch(list(val_texts)))
+        accuracies.append(float((predicted == class_names[val_labels].astype(str)).mean()))
+
+        if not result:
+            # Cost figures come from the first split; they do not depend on it
+            result = {
+                "load_seconds": round(load_seconds, 4),
+                "load_rss_mb": round(load_rss / 2**20, 1),
+                "weights_mb": round(classifier.weights_bytes() / 2**20, 2),
+                **measure_latency(classifier, list(val_texts) + list(train_texts)),
+            }
+    result["accuracy_mean"] = round(statistics.mean(accuracies), 4)
+    result["accuracy_min"] = round(min(accuracies), 4)
+    return result
+
+
+def print_report(results: dict):
+    columns = [
+        ("accuracy_mean", "acc"), ("accuracy_min", "acc min"), ("single_p50_ms", "p50 ms"),
+        ("single_p95_ms", "p95 ms"), ("batch_items_per_second", "batch/s"), ("load_seconds", "load s"),
+        ("load_rss_mb", "load MB"), ("weights_mb", "weights MB"),
+    ]
+    print(f"{'backend':<8}" + "".join(f"{label:>12}" for _, label in columns))
+    for backend, row in results.items():
+        print(f"{backend:<8}" + "".join(f"{row[key]:>12}" for key, _ in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare intent classifiers on accuracy, latency, memory and load time")
+    parser.add_argument("--dataset", default="./models/dataset.json")
+    parser.add_argument("--seeds", type=int, nargs="+", default=[42, 1, 2, 3, 4], help="One stratified split per seed")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=list(BACKENDS))
+    parser.add_argument("--export-dir", help="Refit the linear models on all examples and save them here")
+    parser.add_argument("--output", help="Where to write the JSON results")
+    args = parser.parse_args()
+
+    texts, tags, _ = load_examples(args.dataset, [])
+    results = {}
+    for backend in args.backends:
+        print(f"{backend}: training on {len(args.seeds)} split(s)...")
+        results[backend] = run_backend(backend, args.dataset, texts, tags, args.seeds)
+    print_report(results)
+
+    if args.export_dir:
+        (train_texts, train_labels), (val_texts, val_labels), class_names = split_examples(texts, tags, args.seeds[0], 0.2)
+        all_texts = list(train_texts) + list(val_texts)
+        all_labels = np.concatenate([train_labels, val_labels])
+        for backend in args.backends:
+            if issubclass(BACKENDS[backend], LinearIntentClassifier):
+                path = BACKENDS[backend]().fit(all_texts, all_labels, class_names).save(args.export_dir)
+                print(f"saved {path}")
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"bakeoff-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{git_revision()}.json"
+    )
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({"dataset": args.dataset, "seeds": args.seeds, "results": results}, f, indent=2)
+    print(f"results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
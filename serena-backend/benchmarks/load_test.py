@@ -0,0 +1,356 @@
+"""End-to-end load test for the Serene API.
+
+Boots the FastAPI app in-process against a scratch database, swaps the intent
+model and the Gemini client for deterministic stubs and replays a weighted mix
+of realistic traffic. Per-route throughput and latency percentiles are written
+to a JSON file so runs can be compared between commits.
+
+Run from the serena-backend directory:
+
+    python -m benchmarks.load_test --users 20 --requests 5000 --concurrency 16
+    python -m benchmarks.load_test --compare benchmarks/results/<old>.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import numpy as np
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+SAMPLE_MESSAGES = [
+    "I feel anxious all the time",
+    "I can't sleep at night",
+    "Work has been really stressful lately",
+    "I had a good day today",
+    "I feel lonely",
+    "How can I calm down?",
+    "Everything feels overwhelming",
+    "Thank you for listening",
+]
+
+# (weight, route label) - roughly what the web and mobile clients send
+TRAFFIC_MIX = [
+    (20, "POST /predict"),
+    (15, "GET /conversations"),
+    (10, "GET /conversations/{id}"),
+    (8, "POST /mood"),
+    (8, "GET /mood/history"),
+    (4, "GET /mood/analytics"),
+    (6, "POST /journal"),
+    (8, "GET /journal"),
+    (3, "POST /goals"),
+    (6, "GET /goals"),
+    (4, "PUT /goals/{id}/progress"),
+    (3, "GET /goals/statistics"),
+    (5, "GET /search"),
+]
+
+
+class FakeIntentModel:
+    """Deterministic stand-in for the Keras intent classifier"""
+
+    def __init__(self, num_classes: int):
+        self.num_classes = num_classes
+
+    def predict(self, texts, **kwargs):
+        preds = np.full((len(texts), self.num_classes), 0.01, dtype=np.float32)
+        for i, text in enumerate(texts):
+            preds[i, zlib.crc32(str(text).encode()) % self.num_classes] = 0.9
+        return preds
+
+
+class FakeGeminiModels:
+    REPLY = "I hear you. Let's take a slow breath together."
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def generate_content(self, model: str, contents: str):
+        if self.latency:
+            time.sleep(self.latency)
+        return SimpleNamespace(text=self.REPLY)
+
+    def generate_content_stream(self, model: str, contents: str):
+        if self.latency:
+            time.sleep(self.latency)
+        for word in self.REPLY.split(" "):
+            yield SimpleNamespace(text=word + " ")
+
+
+class FakeGeminiClient:
+    """Deterministic stand-in for google.genai.Client"""
+
+    def __init__(self, latency: float = 0.0):
+        self.models = FakeGeminiModels(latency)
+
+
+def percentile(sorted_values, pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def boot_app(upstream_latency: float):
+    """Import the app and install the stubs in place of the startup hook"""
+    import main
+
+    class_names = np.load("./models/classes.npy", allow_pickle=True)
+    with open("./models/dataset.json", "r") as f:
+        data = json.load(f)
+
+    main.app.router.on_startup.clear()
+    main.model = FakeIntentModel(len(class_names))
+    main.class_names = class_names
+    main.intent_classifier = main.KerasIntentClassifier(main.model, class_names)
+    main.model_ready = True
+    main.crisis_detector = main.CrisisDetector.load()
+    main.responses = {
+        intent["tag"]: intent.get("responses", [])
+        for intent in data.get("intents", [])
+    }
+    main.gemini_client = FakeGeminiClient(upstream_latency)
+    return main
+
+
+class VirtualUser:
+    def __init__(self, user_id: str, token: str):
+        self.user_id = user_id
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.conversation_ids = []
+        self.goal_ids = []
+
+
+async def seed_users(main, client, count: int):
+    users = []
+    for i in range(count):
+        user_id = f"bench-user-{i}@example.com"
+        main.Database.create_user(user_id, f"Bench User {i}", user_id, None, None)
+        user = VirtualUser(user_id, main.create_access_token(data={"sub": user_id}))
+        resp = await client.post("/predict", json={"text": SAMPLE_MESSAGES[0]}, headers=user.headers)
+        resp.raise_for_status()
+        user.conversation_ids.append(resp.json()["conversation_id"])
+        users.append(user)
+    return users
+
+
+def build_request(route: str, user: VirtualUser, rng: random.Random):
+    """Translate a route label into (method, url, json body)"""
+    if route == "POST /predict":
+        conversation_id = rng.choice(user.conversation_ids) if rng.random() < 0.8 else None
+        return "POST", "/predict", {"text": rng.choice(SAMPLE_MESSAGES), "conversation_id": conversation_id}
+    if route == "GET /conversations":
+        return "GET", "/conversations", None
+    if route == "GET /conversations/{id}":
+        return "GET", f"/conversations/{rng.choice(user.conversation_ids)}", None
+    if route == "POST /mood":
+        level = rng.randint(1, 5)
+        return "POST", "/mood", {"mood_level": level, "mood_emoji": "😐", "notes": rng.choice([None, "ok"])}
+    if route == "GET /mood/history":
+        return "GET", "/mood/history?days=30", None
+    if route == "GET /mood/analytics":
+        return "GET", "/mood/analytics?days=30", None
+    if route == "POST /journal":
+        return "POST", "/journal", {
+            "title": "Evening reflection",
+            "content": " ".join(rng.choices(SAMPLE_MESSAGES, k=4)),
+            "mood_level": rng.randint(1, 5),
+        }
+    if route == "GET /journal":
+        return "GET", "/journal?limit=50", None
+    if route == "POST /goals":
+        target_date = (datetime.now() + timedelta(days=30)).date().isoformat()
+        return "POST", "/goals", {
+            "title": "Meditate daily",
+            "description": "Practice mindfulness",
+            "category": "Meditation",
+            "target_value": 30,
+            "unit": "days",
+            "target_date": target_date,
+        }
+    if route == "GET /goals":
+        return "GET", "/goals", None
+    if route == "PUT /goals/{id}/progress":
+        if not user.goal_ids:
+            return build_request("POST /goals", user, rng)
+        return "PUT", f"/goals/{rng.choice(user.goal_ids)}/progress", {"current_value": rng.randint(0, 30)}
+    if route == "GET /goals/statistics":
+        return "GET", "/goals/statistics", None
+    if route == "GET /search":
+        return "GET", f"/search?q={rng.choice(['sleep', 'anxious', 'stress', 'day'])}", None
+    raise ValueError(f"Unknown route {route}")
+
+
+async def run_load(client, users, total_requests: int, concurrency: int, seed: int):
+    routes = [route for _, route in TRAFFIC_MIX]
+    weights = [weight for weight, _ in TRAFFIC_MIX]
+    latencies = {route: [] for route in routes}
+    errors = {route: 0 for route in routes}
+    remaining = [total_requests]
+
+    async def worker(worker_id: int):
+        rng = random.Random(seed * 1000 + worker_id)
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            user = rng.choice(users)
+            route = rng.choices(routes, weights)[0]
+            method, url, body = build_request(route, user, rng)
+
+            start = time.perf_counter()
+            resp = await client.request(method, url, json=body, headers=user.headers)
+            elapsed = time.perf_counter() - start
+
+            latencies[route].append(elapsed)
+            if resp.status_code >= 400:
+                errors[route] += 1
+                continue
+            if url == "/predict":
+                conversation_id = resp.json()["conversation_id"]
+                if conversation_id not in user.conversation_ids:
+                    user.conversation_ids.append(conversation_id)
+            elif method == "POST" and url == "/goals":
+                user.goal_ids.append(resp.json()["id"])
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    wall_time = time.perf_counter() - start
+    return latencies, errors, wall_time
+
+
+def summarize(latencies, errors, wall_time: float) -> dict:
+    routes = {}
+    for route, samples in latencies.items():
+        if not samples:
+            continue
+        ordered = sorted(samples)
+        routes[route] = {
+            "requests": len(ordered),
+            "errors": errors[route],
+            "rps": round(len(ordered) / wall_time, 2),
+            "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3),
+            "p50_ms": round(percentile(ordered, 50) * 1000, 3),
+            "p95_ms": round(percentile(ordered, 95) * 1000, 3),
+            "p99_ms": round(percentile(ordered, 99) * 1000, 3),
+        }
+    total = sum(r["requests"] for r in routes.values())
+    return {
+        "total_requests": total,
+        "total_errors": sum(r["errors"] for r in routes.values()),
+        "wall_time_s": round(wall_time, 3),
+        "rps": round(total / wall_time, 2) if wall_time else 0,
+        "routes": routes,
+    }
+
+
+def print_report(summary: dict, baseline: dict = None):
+    print(f"{'route':<28}{'reqs':>7}{'err':>5}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for route, stats in summary["routes"].items():
+        line = (
+            f"{route:<28}{stats['requests']:>7}{stats['errors']:>5}{stats['rps']:>10.1f}"
+            f"{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}"
+        )
+        old = (baseline or {}).get("routes", {}).get(route)
+        if old and old["p95_ms"]:
+            change = (stats["p95_ms"] - old["p95_ms"]) / old["p95_ms"] * 100
+            line += f"   p95 {change:+.1f}% vs {baseline['revision']}"
+        print(line)
+    print(
+        f"total: {summary['total_requests']} requests, {summary['total_errors']} errors, "
+        f"{summary['rps']:.1f} req/s over {summary['wall_time_s']:.2f}s"
+    )
+
+
+async def benchmark(args) -> dict:
+    import httpx
+
+    main = boot_app(args.upstream_latency_ms / 1000.0)
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        users = await seed_users(main, client, args.users)
+        if args.warmup:
+            await run_load(client, users, args.warmup, args.concurrency, args.seed + 1)
+        latencies, errors, wall_time = await run_load(
+            client, users, args.requests, args.concurrency, args.seed
+        )
+    return summarize(latencies, errors, wall_time)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay mixed traffic against the Serene API")
+    parser.add_argument("--users", type=int, default=20, help="Number of virtual users")
+    parser.add_argument("--requests", type=int, default=5000, help="Measured requests to send")
+    parser.add_argument("--warmup", type=int, default=200, help="Unmeasured requests sent first")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent in-flight requests")
+    parser.add_argument("--upstream-latency-ms", type=float, default=0.0, help="Simulated Gemini latency")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--db", help="Database file to run against (default: fresh temporary file)")
+    parser.add_argument("--output", help="Where to write the JSON results")
+    parser.add_argument("--compare", help="Previous results file to diff against")
+    args = parser.parse_args()
+
+    # Must be set before the app (and with it database.py) is imported
+    scratch_dir = None
+    if args.db:
+        os.environ["SERENE_DB_PATH"] = os.path.abspath(args.db)
+    else:
+        scratch_dir = tempfile.TemporaryDirectory()
+        os.environ["SERENE_DB_PATH"] = os.path.join(scratch_dir.name, "bench.db")
+
+    summary = asyncio.run(benchmark(args))
+
+    result = {
+        "revision": git_revision(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "python": sys.version.split()[0],
+        "config": {
+            "users": args.users,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "upstream_latency_ms": args.upstream_latency_ms,
+            "seed": args.seed,
+            "db": args.db,
+        },
+        **summary,
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+        output = os.path.join(RESULTS_DIR, f"{stamp}-{result['revision']}.json")
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"results written to {output}")
+
+    if scratch_dir:
+        scratch_dir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+"""Query-plan regression check for every statement issued by database.py.
+
+Calls each public method of the database classes against a scratch copy of
+the schema, captures the SQL they execute through a trace callback, and runs
+EXPLAIN QUERY PLAN on every statement. Exits non-zero if a plan contains a
+full table/index scan or a temp B-tree sort, or if a public method is not
+exercised here (so new queries cannot slip past the check).
+
+Run from the serena-backend directory:
+
+    python -m benchmarks.query_plans
+    python -m benchmarks.query_plans --db /tmp/serene-bench.db   # plans with real statistics
+"""
+import argparse
+import inspect
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+# Plans that are expected to sort and why. Keep this list short.
+ALLOWED_TEMP_BTREE = {
+    # Substring search must visit every message of the user anyway; the
+    # matches are sorted, which is bounded by that per-user set
+    "Database.search_messages",
+}
+
+# Whole-table reads that are intentional: offline/admin reports only
+ALLOWED_FULL_SCAN = {
+    "ColdStorageDatabase.get_storage_stats",
+    # One row per maintenance task
+    "MaintenanceDatabase.get_runs",
+}
+
+USER_ID = "plan-check@example.com"
+
+
+def on_copy(database, call):
+    """Run call against a copy of the scratch database, for calls that rewrite the planner statistics"""
+    original = database.DB_PATH
+    database.DB_PATH = original + ".copy"
+    shutil.copyfile(original, database.DB_PATH)
+    try:
+        return call()
+    finally:
+        database.DB_PATH = original
+
+
+def exercise(database):
+    """Map of "Class.method" -> zero-argument call covering that method"""
+    Database = database.Database
+    MoodDatabase = database.MoodDatabase
+    JournalDatabase = database.JournalDatabase
+    GoalsDatabase = database.GoalsDatabase
+    AccountPurgeDatabase = database.AccountPurgeDatabase
+    ColdStorageDatabase = database.ColdStorageDatabase
+    UserDataDatabase = database.UserDataDatabase
+    ResourceVersionDatabase = database.ResourceVersionDatabase
+    SyncDatabase = database.SyncDatabase
+    EmbeddingDatabase = database.EmbeddingDatabase
+    BackfillDatabase = database.BackfillDatabase
+    JournalInsightsDatabase = database.JournalInsightsDatabase
+    CorrelationDatabase = database.CorrelationDatabase
+    MaintenanceDatabase = database.MaintenanceDatabase
+    AnalyticsExportDatabase = database.AnalyticsExportDatabase
+
+    fixture = {}
+    insight_state = dict.fromkeys(JournalInsightsDatabase.STATE_COLUMNS, b"")
+    insight_state.update(last_change_id=1, entry_count=0, word_count=0)
+
+    def with_cursor(method, *args):
+        """For helpers that take the caller's cursor"""
+        conn = Database.get_connection()
+        result = method(conn.cursor(), *args)
+        conn.commit()
+        conn.close()
+        return result
+
+    def freeze_empty_conversation():
+        """Regression check: a conversation without messages must stop being a candidate once frozen"""
+        conversation_id = Database.create_conversation(USER_ID, "Empty")
+        with_cursor(lambda cursor: cursor.execute(
+            "UPDATE conversations SET updated_at = datetime('now', '-1 year') WHERE id = ?", (conversation_id,)
+        ))
+        ColdStorageDatabase.freeze_conversation(conversation_id)
+        if conversation_id in ColdStorageDatabase.get_freeze_candidates(30, 180, 1000):
+            raise SystemExit("An empty conversation is still a freeze candidate after freezing it")
+
+    def setup():
+        Database.create_user(USER_ID, "Plan Check", USER_ID, None, None)
+        fixture["conversation_id"] = Database.create_conversation(USER_ID, "Plans")
+        fixture["message_id"] = Database.add_message(fixture["conversation_id"], "user", "I can't sleep", user_id=USER_ID)
+        fixture["journal_id"] = JournalDatabase.create_journal_entry(USER_ID, "Today", "Slept badly", 2)
+        fixture["goal_id"] = GoalsDatabase.create_goal(USER_ID, "Sleep early", "", "Sleep", 10, "nights", "2030-01-01")
+
+    sync_batch = [
+        {"op_id": "mood", "type": "mood.create", "values": (4, "🙂", None, None)},
+        {"op_id": "journal", "type": "journal.create", "values": (None, "Offline entry", 3, None, None)},
+        {"op_id": "edit", "type": "journal.update", "ref": "journal", "values": (None, "Edited", 3)},
+        {"op_id": "goal", "type": "goal.create", "values": ("Read", "", "Growth", 5, "books", "2030-01-01")},
+        {"op_id": "progress", "type": "goal.progress", "ref": "goal", "values": (2, "2030-01-01")},
+        {"op_id": "goal-delete", "type": "goal.delete", "id": 1, "values": ()},
+        {"op_id": "journal-delete", "type": "journal.delete", "ref": "journal", "values": ()},
+    ]
+
+    calls = {
+        "Database.create_user": lambda: Database.create_user("other@example.com", "Other", "other@example.com", None, None),
+        "Database.get_user": lambda: Database.get_user(USER_ID),
+        "Database.update_last_active": lambda: Database.update_last_active(USER_ID),
+        "Database.create_conversation": lambda: Database.create_conversation(USER_ID),
+        "Database.get_user_conversations": lambda: (
+            Database.get_user_conversations(USER_ID),
+            Database.get_user_conversations(USER_ID, include_archived=True),
+        ),
+        "Database.get_conversation": lambda: Database.get_conversation(fixture["conversation_id"], USER_ID),
+        "Database.update_conversation_title": lambda: Database.update_conversation_title(fixture["conversation_id"], USER_ID, "Renamed"),
+        "Database.flag_conversation_crisis": lambda: Database.flag_conversation_crisis(fixture["conversation_id"], USER_ID),
+        "Database.archive_conversation": lambda: Database.archive_conversation(fixture["conversation_id"], USER_ID, False),
+        "Database.add_message": lambda: Database.add_message(fixture["conversation_id"], "assistant", "I hear you", "sleep", user_id=USER_ID),
+        "Database.get_conversation_messages": lambda: (
+            Database.get_conversation_messages(fixture["conversation_id"], USER_ID),
+            Database.get_conversation_messages(fixture["conversation_id"], USER_ID, limit=10),
+        ),
+        "Database.get_recent_messages": lambda: Database.get_recent_messages(fixture["conversation_id"], 5, USER_ID),
+        "Database.search_messages": lambda: Database.search_messages(USER_ID, "sleep"),
+        "ColdStorageDatabase.get_freeze_candidates": lambda: ColdStorageDatabase.get_freeze_candidates(30, 180, 100),
+        "ColdStorageDatabase.freeze_conversation": lambda: (
+            freeze_empty_conversation(),
+            ColdStorageDatabase.freeze_conversation(fixture["conversation_id"]),
+            # Frozen branches of the readers
+            Database.get_conversation_messages(fixture["conversation_id"], USER_ID),
+            Database.get_user_conversations(USER_ID),
+        ),
+        "ColdStorageDatabase.load_frozen_messages": lambda: with_cursor(
+            ColdStorageDatabase.load_frozen_messages, fixture["conversation_id"]
+        ),
+        "ColdStorageDatabase.get_storage_stats": ColdStorageDatabase.get_storage_stats,
+        "UserDataDatabase.get_frozen_messages": lambda: UserDataDatabase.get_frozen_messages(fixture["conversation_id"]),
+        "ColdStorageDatabase.thaw_if_frozen": lambda: with_cursor(
+            ColdStorageDatabase.thaw_if_frozen, fixture["conversation_id"]
+        ),
+        "UserDataDatabase.get_export_page": lambda: [
+            UserDataDatabase.get_export_page(
+                kind, fixture["conversation_id"] if kind == "message" else USER_ID, ("2020-01-01", 1), 100
+            )
+            for kind in UserDataDatabase.EXPORT_QUERIES
+        ],
+        "UserDataDatabase.import_batch": lambda: UserDataDatabase.import_batch(USER_ID, [
+            {"type": "conversation", "id": 1, "title": "Imported"},
+            {"type": "message", "conversation_id": 1, "role": "user", "content": "hi"},
+            {"type": "mood", "mood_level": 3, "mood_emoji": "😐"},
+            {"type": "journal", "content": "Imported entry"},
+            {"type": "goal", "title": "Imported goal", "target_value": 5},
+        ], {}),
+        "Database.delete_message": lambda: Database.delete_message(fixture["message_id"], fixture["conversation_id"], USER_ID),
+        "Database.delete_conversation": lambda: Database.delete_conversation(fixture["conversation_id"], USER_ID),
+        "MoodDatabase.add_mood_entry": lambda: MoodDatabase.add_mood_entry(USER_ID, 3, "😐"),
+        "MoodDatabase.get_user_moods": lambda: MoodDatabase.get_user_moods(USER_ID, 30),
+        "MoodDatabase.get_mood_analytics": lambda: MoodDatabase.get_mood_analytics(USER_ID, 30),
+        "JournalDatabase.create_journal_entry": lambda: JournalDatabase.create_journal_entry(USER_ID, None, "Better day", 4),
+        "JournalDatabase.get_user_journals": lambda: JournalDatabase.get_user_journals(USER_ID),
+        "JournalDatabase.update_journal_entry": lambda: JournalDatabase.update_journal_entry(fixture["journal_id"], USER_ID, "Today", "Slept well", 4),
+        "JournalDatabase.delete_journal_entry": lambda: JournalDatabase.delete_journal_entry(fixture["journal_id"], USER_ID),
+        "JournalInsightsDatabase.get_changes": lambda: JournalInsightsDatabase.get_changes(USER_ID, 0, 100),
+        "JournalInsightsDatabase.save_state": lambda: (
+            JournalInsightsDatabase.save_state(USER_ID, 0, insight_state),
+            JournalInsightsDatabase.save_state(USER_ID, 1, insight_state),
+        ),
+        "JournalInsightsDatabase.get_state": lambda: JournalInsightsDatabase.get_state(USER_ID),
+        "CorrelationDatabase.get_moods": lambda: CorrelationDatabase.get_moods(USER_ID, "2000-01-01"),
+        "CorrelationDatabase.get_journal_times": lambda: CorrelationDatabase.get_journal_times(USER_ID, "2000-01-01"),
+        "CorrelationDatabase.get_intents": lambda: CorrelationDatabase.get_intents(USER_ID, "2000-01-01"),
+        "MaintenanceDatabase.get_file_stats": MaintenanceDatabase.get_file_stats,
+        "MaintenanceDatabase.optimize": lambda: on_copy(database, lambda: MaintenanceDatabase.optimize(100)),
+        "MaintenanceDatabase.analyze": lambda: on_copy(database, lambda: MaintenanceDatabase.analyze(100)),
+        "MaintenanceDatabase.checkpoint": lambda: MaintenanceDatabase.checkpoint("PASSIVE"),
+        "MaintenanceDatabase.backup": lambda: MaintenanceDatabase.backup(
+            os.path.join(os.path.dirname(database.DB_PATH), "backup.db"), 64, 0, 3
+        ),
+        "MaintenanceDatabase.claim_task": lambda: MaintenanceDatabase.claim_task("plans", 60),
+        "MaintenanceDatabase.finish_task": lambda: MaintenanceDatabase.finish_task("plans", "ran", 0.1, 1, {}),
+        "MaintenanceDatabase.get_runs": MaintenanceDatabase.get_runs,
+        "GoalsDatabase.create_goal": lambda: GoalsDatabase.create_goal(USER_ID, "Walk", "", "Exercise", 5, "km", "2030-01-01"),
+        "GoalsDatabase.get_user_goals": lambda: (
+            GoalsDatabase.get_user_goals(USER_ID),
+            GoalsDatabase.get_user_goals(USER_ID, "active"),
+        ),
+        "GoalsDatabase.update_goal_progress": lambda: GoalsDatabase.update_goal_progress(fixture["goal_id"], USER_ID, 10),
+        "GoalsDatabase.update_goal": lambda: GoalsDatabase.update_goal(fixture["goal_id"], USER_ID, title="Sleep by 11", target_value=12),
+        "GoalsDatabase.get_goal_progress_history": lambda: GoalsDatabase.get_goal_progress_history(fixture["goal_id"], USER_ID),
+        "GoalsDatabase.get_goal_statistics": lambda: GoalsDatabase.get_goal_statistics(USER_ID),
+        "GoalsDatabase.delete_goal": lambda: GoalsDatabase.delete_goal(fixture["goal_id"], USER_ID),
+        "AccountPurgeDatabase.request_purge": lambda: AccountPurgeDatabase.request_purge("other@example.com"),
+        "AccountPurgeDatabase.delete_batch": lambda: [
+            AccountPurgeDatabase.delete_batch("other@example.com", table, statement, 100)
+            for table, statement in AccountPurgeDatabase.PURGE_STEPS
+        ],
+        "AccountPurgeDatabase.get_purge_status": lambda: AccountPurgeDatabase.get_purge_status("other@example.com"),
+        "AccountPurgeDatabase.get_unfinished_purges": lambda: (
+            AccountPurgeDatabase.get_unfinished_purges(), AccountPurgeDatabase.get_unfinished_purges(("failed",))
+        ),
+        "AccountPurgeDatabase.mark_failed": lambda: AccountPurgeDatabase.mark_failed("other@example.com"),
+        "AccountPurgeDatabase.finish_purge": lambda: AccountPurgeDatabase.finish_purge("other@example.com"),
+        "AccountPurgeDatabase.incremental_vacuum": lambda: AccountPurgeDatabase.incremental_vacuum(100),
+        "SyncDatabase.apply_operations": lambda: [
+            # The second pass is answered from the ledger
+            SyncDatabase.apply_operations(USER_ID, sync_batch) for _ in range(2)
+        ],
+        "ResourceVersionDatabase.get_version": lambda: ResourceVersionDatabase.get_version(USER_ID, "goals"),
+        "EmbeddingDatabase.get_pending": lambda: EmbeddingDatabase.get_pending(USER_ID, "plans", 100),
+        "EmbeddingDatabase.save_vectors": lambda: EmbeddingDatabase.save_vectors(USER_ID, "plans", [
+            ("message", fixture["message_id"], fixture["conversation_id"], bytes(8)),
+            ("journal", fixture["journal_id"], None, bytes(8)),
+        ]),
+        "EmbeddingDatabase.delete_orphans": lambda: EmbeddingDatabase.delete_orphans(USER_ID),
+        "EmbeddingDatabase.get_vectors": lambda: EmbeddingDatabase.get_vectors(USER_ID, "plans"),
+        "EmbeddingDatabase.get_search_items": lambda: EmbeddingDatabase.get_search_items(
+            USER_ID, [(fixture["message_id"], fixture["conversation_id"])], [fixture["journal_id"]]
+        ),
+        "BackfillDatabase.get_message_chunk": lambda: BackfillDatabase.get_message_chunk(0, 100),
+        "BackfillDatabase.get_prompting_messages": lambda: BackfillDatabase.get_prompting_messages(
+            [(fixture["message_id"] + 1, fixture["conversation_id"])]
+        ),
+        "BackfillDatabase.save_intents": lambda: BackfillDatabase.save_intents(
+            "plans", "plans", [("sleep", fixture["message_id"])], fixture["message_id"], 1
+        ),
+        "BackfillDatabase.get_checkpoint": lambda: BackfillDatabase.get_checkpoint("plans"),
+        "JournalInsightsDatabase.get_next_queued_user": lambda: JournalInsightsDatabase.get_next_queued_user(""),
+        "AnalyticsExportDatabase.get_high_water": lambda: [
+            AnalyticsExportDatabase.get_high_water(table)
+            for table in ["analytics_changes", *AnalyticsExportDatabase.COLUMNS]
+        ],
+        "AnalyticsExportDatabase.get_new_rows": lambda: [
+            AnalyticsExportDatabase.get_new_rows(table, 0, 1 << 62, 100) for table in AnalyticsExportDatabase.COLUMNS
+        ],
+        "AnalyticsExportDatabase.get_changed_rows": lambda: [
+            AnalyticsExportDatabase.get_changed_rows(table, 0, 1 << 62, 100) for table in AnalyticsExportDatabase.COLUMNS
+        ],
+        "AnalyticsExportDatabase.get_archived_messages": lambda: AnalyticsExportDatabase.get_archived_messages(("", 0), "9999-12-31", 100),
+        "AnalyticsExportDatabase.get_purged_users": lambda: AnalyticsExportDatabase.get_purged_users(""),
+        "AnalyticsExportDatabase.trim_changes": lambda: AnalyticsExportDatabase.trim_changes(1 << 62, 100),
+    }
+    classes = [
+        Database, MoodDatabase, JournalDatabase, GoalsDatabase,
+        AccountPurgeDatabase, ColdStorageDatabase, UserDataDatabase, ResourceVersionDatabase,
+        SyncDatabase, EmbeddingDatabase, BackfillDatabase, JournalInsightsDatabase, CorrelationDatabase,
+        MaintenanceDatabase, AnalyticsExportDatabase,
+    ]
+    return setup, calls, classes
+
+
+def public_methods(classes):
+    names = set()
+    for cls in classes:
+        for name, _ in inspect.getmembers(cls, predicate=inspect.isfunction):
+            if not name.startswith("_") and name != "get_connection":
+                names.add(f"{cls.__name__}.{name}")
+    return names
+
+
+def capture_statements(database, setup, calls):
+    """Run every call with tracing on; returns [(method, sql)]"""
+    captured = []
+    current = [None]
+    original = database.Database.get_connection
+
+    def traced_connection(*args, **kwargs):
+        conn = original(*args, **kwargs)
+        conn.set_trace_callback(lambda sql: captured.append((current[0], sql)) if current[0] else None)
+        return conn
+
+    database.Database.get_connection = staticmethod(traced_connection)
+    try:
+        setup()
+        for method, call in calls.items():
+            current[0] = method
+            call()
+    finally:
+        database.Database.get_connection = staticmethod(original)
+    return captured
+
+
+def violations_for(conn: sqlite3.Connection, sql: str):
+    plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+    details = [row[3] for row in plan]
+    bad = [
+        detail for detail in details
+        # sqlite_sequence holds one row per AUTOINCREMENT table
+        if (detail.startswith("SCAN ") and detail not in ("SCAN CONSTANT ROW", "SCAN sqlite_sequence"))
+        or "TEMP B-TREE" in detail
+    ]
+    return details, bad
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fail on full scans or temp B-trees in database.py queries")
+    parser.add_argument("--db", help="Check plans against a copy of this database (uses its ANALYZE statistics)")
+    parser.add_argument("--verbose", action="store_true", help="Print every plan")
+    args = parser.parse_args()
+
+    scratch_dir = tempfile.TemporaryDirectory()
+    db_path = os.path.join(scratch_dir.name, "plans.db")
+    if args.db:
+        shutil.copyfile(args.db, db_path)
+    os.environ["SERENE_DB_PATH"] = db_path
+    # Full schema, including the analytics_changes triggers
+    os.environ["ANALYTICS_EXPORT_ENABLED"] = "1"
+    import database
+
+    setup, calls, classes = exercise(database)
+    missing = public_methods(classes) - set(calls)
+    captured = capture_statements(database, setup, calls)
+
+    conn = sqlite3.connect(db_path)
+    failures = 0
+    checked = set()
+    for method, sql in captured:
+        keyword = sql.lstrip().split(None, 1)[0].upper()
+        if keyword not in ("SELECT", "UPDATE", "DELETE", "INSERT", "WITH") or (method, sql) in checked:
+            continue
+        checked.add((method, sql))
+        details, bad = violations_for(conn, sql)
+        allowed = (method in ALLOWED_TEMP_BTREE and all("TEMP B-TREE" in d for d in bad)) or method in ALLOWED_FULL_SCAN
+        if bad and not allowed:
+            failures += 1
+            print(f"FAIL {method}: {' '.join(sql.split())}")
+            for detail in details:
+                print(f"    {detail}")
+        elif args.verbose:
+            print(f"ok   {method}: {' | '.join(details) or '(no table access)'}")
+    conn.close()
+    scratch_dir.cleanup()
+
+    for method in sorted(missing):
+        failures += 1
+        print(f"FAIL {method}: not exercised by benchmarks/query_plans.py")
+
+    print(f"{len(checked)} statements checked, {failures} problem(s)")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
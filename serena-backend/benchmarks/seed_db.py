@@ -0,0 +1,230 @@
+"""Synthetic dataset generator for benchmarking database.py at scale.
+
+Bulk-loads N users with conversations, messages, mood entries, journal entries
+and goals drawn from heavy-tailed distributions, so a handful of power users
+dominate the row counts the way they do in production. Output is fully
+determined by --seed.
+
+Run from the serena-backend directory into a fresh file:
+
+    python -m benchmarks.seed_db --db /tmp/serene-bench.db --users 20000 --seed 7
+    python -m benchmarks.load_test --db /tmp/serene-bench.db
+"""
+import argparse
+import json
+import math
+import os
+import random
+import sqlite3
+import time
+
+DATASET_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "models", "dataset.json")
+
+MOOD_EMOJIS = {1: "😢", 2: "😕", 3: "😐", 4: "🙂", 5: "😊"}
+GOAL_TEMPLATES = [
+    ("Meditate daily", "Meditation", 30, "days"),
+    ("Journal every evening", "Journaling", 21, "entries"),
+    ("Walk outside", "Exercise", 50, "km"),
+    ("Sleep before midnight", "Sleep", 14, "nights"),
+    ("Practice breathing exercises", "Breathing", 20, "sessions"),
+    ("Call a friend", "Social", 8, "calls"),
+]
+JOURNAL_TITLES = [None, "Evening reflection", "Today", "Gratitude", "Rough day", "Small wins"]
+JOURNAL_SENTENCES = [
+    "Work was stressful but I managed to take a break.",
+    "I went for a walk and felt a little lighter afterwards.",
+    "I couldn't sleep well last night and felt tired all day.",
+    "Talked to my sister and it helped a lot.",
+    "I felt anxious before the meeting.",
+    "I'm grateful for the quiet morning.",
+    "Everything felt overwhelming in the afternoon.",
+    "I practiced breathing exercises when I felt tense.",
+]
+
+# Bulk-load settings: durability is irrelevant for a throwaway benchmark file
+FAST_LOAD_PRAGMAS = [
+    "PRAGMA journal_mode = OFF",
+    "PRAGMA synchronous = OFF",
+    "PRAGMA locking_mode = EXCLUSIVE",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -262144",
+]
+
+
+def load_intents():
+    with open(DATASET_PATH, "r") as f:
+        data = json.load(f)
+    return [
+        (intent["tag"], intent.get("patterns") or ["Hello"], intent.get("responses") or ["I'm here for you."])
+        for intent in data.get("intents", [])
+    ]
+
+
+def timestamp(epoch: float) -> str:
+    """Format like SQLite's CURRENT_TIMESTAMP"""
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(epoch))
+
+
+def heavy_tailed(rng: random.Random, mean: float, sigma: float = 1.0) -> int:
+    """Lognormal count whose expected value is roughly `mean`"""
+    if mean <= 0:
+        return 0
+    mu = max(0.0, math.log(mean) - sigma * sigma / 2)
+    return int(rng.lognormvariate(mu, sigma))
+
+
+class BulkWriter:
+    """Buffers rows per table and flushes them with executemany"""
+
+    STATEMENTS = {
+        "users": "INSERT INTO users (id, name, email, phone, hashed_password, created_at, last_active) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        "conversations": "INSERT INTO conversations (id, user_id, title, created_at, updated_at, is_archived) VALUES (?, ?, ?, ?, ?, ?)",
+        "messages": "INSERT INTO messages (conversation_id, role, content, intent, created_at) VALUES (?, ?, ?, ?, ?)",
+        "mood_entries": "INSERT INTO mood_entries (user_id, mood_level, mood_emoji, notes, created_at) VALUES (?, ?, ?, ?, ?)",
+        "journal_entries": "INSERT INTO journal_entries (user_id, title, content, mood_level, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+        "goals": """INSERT INTO goals (user_id, title, description, category, target_value, current_value, unit,
+                                       start_date, target_date, status, created_at, updated_at, completed_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+    }
+
+    def __init__(self, conn: sqlite3.Connection, batch_size: int):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.buffers = {table: [] for table in self.STATEMENTS}
+        self.counts = {table: 0 for table in self.STATEMENTS}
+        self.pending = 0
+
+    def add(self, table: str, row: tuple):
+        self.buffers[table].append(row)
+        self.pending += 1
+        if self.pending >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        cursor = self.conn.cursor()
+        cursor.execute("BEGIN")
+        for table, rows in self.buffers.items():
+            if rows:
+                cursor.executemany(self.STATEMENTS[table], rows)
+                self.counts[table] += len(rows)
+                rows.clear()
+        cursor.execute("COMMIT")
+        self.pending = 0
+
+
+def generate_user(writer: BulkWriter, rng: random.Random, args, intents, user_index: int,
+                  next_conversation_id: int, now: float) -> int:
+    span = args.days * 86400
+    user_id = f"synthetic-{args.seed}-{user_index}@example.com"
+    joined = now - rng.random() * span
+    writer.add("users", (user_id, f"User {user_index}", user_id, None, None, timestamp(joined), timestamp(now)))
+    active_span = now - joined
+
+    for _ in range(heavy_tailed(rng, args.conversations_per_user)):
+        conversation_id = next_conversation_id
+        next_conversation_id += 1
+        started = joined + rng.random() * active_span
+        turns = max(1, heavy_tailed(rng, args.messages_per_conversation / 2))
+        first_message = rng.choice(rng.choice(intents)[1])
+        at = started
+        for _ in range(turns):
+            tag, patterns, replies = rng.choice(intents)
+            writer.add("messages", (conversation_id, "user", rng.choice(patterns), None, timestamp(at)))
+            at += rng.uniform(5, 120)
+            writer.add("messages", (conversation_id, "assistant", rng.choice(replies), tag, timestamp(at)))
+            at += rng.uniform(10, 600)
+        archived = 1 if rng.random() < args.archived_ratio else 0
+        writer.add("conversations", (conversation_id, user_id, first_message[:50], timestamp(started), timestamp(at), archived))
+
+    # Users drift around a personal baseline mood
+    baseline = rng.choice([2, 3, 3, 4, 4])
+    for _ in range(heavy_tailed(rng, args.moods_per_user)):
+        level = min(5, max(1, baseline + rng.choice([-2, -1, 0, 0, 0, 1, 1])))
+        notes = rng.choice(JOURNAL_SENTENCES) if rng.random() < 0.3 else None
+        writer.add("mood_entries", (user_id, level, MOOD_EMOJIS[level], notes, timestamp(joined + rng.random() * active_span)))
+
+    for _ in range(heavy_tailed(rng, args.journals_per_user)):
+        written = joined + rng.random() * active_span
+        content = " ".join(rng.choices(JOURNAL_SENTENCES, k=rng.randint(2, 8)))
+        mood = rng.randint(1, 5) if rng.random() < 0.7 else None
+        writer.add("journal_entries", (user_id, rng.choice(JOURNAL_TITLES), content, mood, timestamp(written), timestamp(written)))
+
+    for _ in range(min(len(GOAL_TEMPLATES), heavy_tailed(rng, args.goals_per_user, 0.6))):
+        title, category, target, unit = rng.choice(GOAL_TEMPLATES)
+        created = joined + rng.random() * active_span
+        current = rng.randint(0, target)
+        completed = current >= target
+        start_date = timestamp(created)[:10]
+        target_date = timestamp(created + 30 * 86400)[:10]
+        writer.add("goals", (
+            user_id, title, "", category, target, current, unit, start_date, target_date,
+            "completed" if completed else "active", timestamp(created), timestamp(created),
+            timestamp(created + 86400) if completed else None,
+        ))
+
+    return next_conversation_id
+
+
+def drop_secondary_objects(conn: sqlite3.Connection):
+    """Drop indexes and triggers so the load only appends to table b-trees; init_db recreates them
+    and rebuild_derived_tables fills in what the triggers would have written"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT type, name FROM sqlite_master WHERE type IN ('index', 'trigger') AND sql IS NOT NULL")
+    for kind, name in cursor.fetchall():
+        cursor.execute(f"DROP {kind.upper()} IF EXISTS {name}")
+    conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-load synthetic users into a Serene database")
+    parser.add_argument("--db", required=True, help="Target database file (created if missing)")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--days", type=int, default=365, help="History window to spread activity over")
+    parser.add_argument("--conversations-per-user", type=float, default=8)
+    parser.add_argument("--messages-per-conversation", type=float, default=12)
+    parser.add_argument("--moods-per-user", type=float, default=40)
+    parser.add_argument("--journals-per-user", type=float, default=15)
+    parser.add_argument("--goals-per-user", type=float, default=2)
+    parser.add_argument("--archived-ratio", type=float, default=0.15)
+    parser.add_argument("--batch-size", type=int, default=200000, help="Rows per transaction")
+    args = parser.parse_args()
+
+    db_path = os.path.abspath(args.db)
+    os.environ["SERENE_DB_PATH"] = db_path
+    from database import init_db, rebuild_derived_tables  # creates the schema in the target file on import
+
+    started = time.perf_counter()
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    for pragma in FAST_LOAD_PRAGMAS:
+        conn.execute(pragma)
+    drop_secondary_objects(conn)
+
+    next_conversation_id = (conn.execute("SELECT MAX(id) FROM conversations").fetchone()[0] or 0) + 1
+    rng = random.Random(args.seed)
+    intents = load_intents()
+    now = time.time()
+    writer = BulkWriter(conn, args.batch_size)
+    for user_index in range(args.users):
+        next_conversation_id = generate_user(writer, rng, args, intents, user_index, next_conversation_id, now)
+    writer.flush()
+    loaded = time.perf_counter()
+    conn.close()
+
+    init_db(db_path)
+    # The triggers that keep goal statistics and journal insights were dropped during the load
+    rebuild_derived_tables(db_path)
+    conn = sqlite3.connect(db_path)
+    conn.execute("ANALYZE")
+    conn.close()
+    finished = time.perf_counter()
+
+    total = sum(writer.counts.values())
+    for table, count in writer.counts.items():
+        print(f"{table:<16}{count:>12,}")
+    print(f"{'total':<16}{total:>12,} rows loaded in {loaded - started:.1f}s "
+          f"({total / (loaded - started):,.0f} rows/s), indexes + ANALYZE {finished - loaded:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""Serialization benchmark for large listing responses.
+
+Loads one conversation with 5,000 messages (and as many journal entries) into
+a scratch database and times:
+
+  * the row fetch: row-factory dicts vs. building each dict by hand from tuples
+  * the whole request: SERENE_DEBUG validation through response_model vs. the
+    fast path that serializes the row dicts directly
+
+Run from the serena-backend directory:
+
+    python -m benchmarks.serialization
+    python -m benchmarks.serialization --messages 20000 --iterations 20
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+
+USER_ID = "serialization@example.com"
+
+
+def seed(database, count: int) -> int:
+    database.Database.create_user(USER_ID, "Serialization", USER_ID, None, None)
+    conversation_id = database.Database.create_conversation(USER_ID, "Long conversation")
+    conn = database.Database.get_connection()
+    conn.executemany(
+        "INSERT INTO messages (conversation_id, role, content, intent, created_at) VALUES (?, ?, ?, ?, datetime('now', ?))",
+        [
+            (conversation_id, "user" if i % 2 == 0 else "assistant",
+             f"Message {i}: I have been feeling a bit overwhelmed at work this week.",
+             None if i % 2 == 0 else "stress", f"-{count - i} seconds")
+            for i in range(count)
+        ],
+    )
+    conn.executemany(
+        "INSERT INTO journal_entries (user_id, title, content, mood_level) VALUES (?, ?, ?, ?)",
+        [(USER_ID, f"Entry {i}", "Went for a walk and felt calmer afterwards. " * 4, i % 5 + 1) for i in range(count)],
+    )
+    conn.commit()
+    conn.close()
+    return conversation_id
+
+
+def legacy_fetch(conversation_id: int):
+    """The tuple-to-dict loop database.py used before the row factories"""
+    conn = sqlite3.connect(os.environ["SERENE_DB_PATH"])
+    rows = conn.execute(
+        "SELECT id, role, content, intent, created_at FROM messages WHERE conversation_id = ? ORDER BY created_at ASC",
+        (conversation_id,),
+    ).fetchall()
+    conn.close()
+    return [
+        {"id": row[0], "role": row[1], "content": row[2], "intent": row[3], "created_at": row[4]}
+        for row in rows
+    ]
+
+
+def timed(func, iterations: int):
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+async def timed_requests(client, url: str, headers: dict, iterations: int):
+    samples = []
+    size = 0
+    for _ in range(iterations):
+        started = time.perf_counter()
+        response = await client.get(url, headers=headers)
+        samples.append((time.perf_counter() - started) * 1000)
+        response.raise_for_status()
+        size = len(response.content)
+    return samples, size
+
+
+def report(label: str, samples, baseline=None, extra: str = ""):
+    samples = sorted(samples)
+    median = statistics.median(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    speedup = f"  {baseline / median:5.2f}x" if baseline else ""
+    print(f"{label:<44}{median:>9.2f} ms{p95:>10.2f} ms{speedup}{extra}")
+    return median
+
+
+async def run_http(main, conversation_id: int, iterations: int, limit: int):
+    import httpx
+
+    headers = {"Authorization": f"Bearer {main.create_access_token({'sub': USER_ID})}"}
+    routes = [
+        ("GET /conversations/{id}", f"/conversations/{conversation_id}"),
+        ("GET /journal", f"/journal?limit={limit}"),
+    ]
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for label, url in routes:
+            results = {}
+            for mode, debug in (("validated", True), ("fast", False)):
+                main.SERENE_DEBUG = debug
+                await timed_requests(client, url, headers, 3)  # warm up
+                results[mode] = await timed_requests(client, url, headers, iterations)
+            baseline = report(f"{label} validated", results["validated"][0], extra=f"  ({results['validated'][1]:,} bytes)")
+            report(f"{label} fast", results["fast"][0], baseline, extra=f"  ({results['fast'][1]:,} bytes)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time large listing responses with and without validation")
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    scratch_dir = tempfile.TemporaryDirectory()
+    os.environ["SERENE_DB_PATH"] = os.path.join(scratch_dir.name, "serialization.db")
+    import database
+    from benchmarks.load_test import boot_app
+
+    conversation_id = seed(database, args.messages)
+    main_module = boot_app(0.0)
+    print(f"{args.messages:,} rows, {args.iterations} iterations"
+          f" (orjson {'on' if main_module.orjson else 'not installed'})")
+    print(f"{'':<44}{'median':>12}{'p95':>13}")
+
+    baseline = report("fetch: tuples + hand-built dicts", timed(lambda: legacy_fetch(conversation_id), args.iterations))
+    report("fetch: row factory", timed(
+        lambda: database.Database.get_conversation_messages(conversation_id, USER_ID), args.iterations
+    ), baseline)
+
+    asyncio.run(run_http(main_module, conversation_id, args.iterations, args.messages))
+    scratch_dir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""Write throughput as the number of database shards grows.
+
+For each shard count, starts --processes writer processes against a fresh
+scratch directory (SERENE_DB_SHARDS set; 0 is the single serene.db). Every
+writer owns --users users, opens a conversation for each, waits for the
+others, and then stores messages round-robin over its users through
+Database.add_message, one commit per message, as the chat endpoints do.
+Reported per shard count: commits per second over all writers, commit
+latency percentiles, and writes that failed with "database is locked" after
+SQLite's busy timeout. One shard still has a single writer but goes through
+the pooled connections, so it separates the pool's share of the gain from
+the shards'.
+
+Run from the serena-backend directory:
+
+    python -m benchmarks.shard_writes
+    python -m benchmarks.shard_writes --shards 0,4,16 --processes 16 --writes 1000
+"""
+import argparse
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks.load_test import RESULTS_DIR, SAMPLE_MESSAGES, git_revision, percentile
+
+
+def run_worker(index: int, users: int, writes: int):
+    """One writer process: set up its users, report ready, write once told to go"""
+    from database import Database
+
+    user_ids = [f"shard-bench-{index}-{n}@example.com" for n in range(users)]
+    conversations = []
+    for user_id in user_ids:
+        Database.create_user(user_id, f"Writer {index}", user_id, None, None)
+        conversations.append((Database.create_conversation(user_id, "Shard benchmark"), user_id))
+    print("ready", flush=True)
+    sys.stdin.readline()
+
+    latencies = []
+    locked = 0
+    started = time.perf_counter()
+    for n in range(writes):
+        conversation_id, user_id = conversations[n % len(conversations)]
+        begin = time.perf_counter()
+        try:
+            Database.add_message(conversation_id, "user", SAMPLE_MESSAGES[n % len(SAMPLE_MESSAGES)], user_id=user_id)
+        except sqlite3.OperationalError as e:
+            if "locked" not in str(e):
+                raise
+            locked += 1
+            continue
+        latencies.append((time.perf_counter() - begin) * 1000)
+    print(json.dumps({"seconds": time.perf_counter() - started, "latencies_ms": latencies, "locked": locked}), flush=True)
+
+
+def run_shard_count(shards: int, processes: int, users: int, writes: int) -> dict:
+    with tempfile.TemporaryDirectory(prefix="serene-shards-") as scratch:
+        env = {**os.environ, "SERENE_DB_PATH": os.path.join(scratch, "serene.db"), "SERENE_DB_SHARDS": str(shards),
+               "MAINTENANCE_ENABLED": "0"}
+        # Create the files once, so the writers do not race to lay them out
+        subprocess.run([sys.executable, "-c", "import database"], env=env, check=True)
+
+        command = [sys.executable, "-m", "benchmarks.shard_writes", "--worker", "--users", str(users), "--writes", str(writes)]
+        workers = [
+            subprocess.Popen(command + ["--index", str(index)], env=env, text=True,
+                             stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            for index in range(processes)
+        ]
+        for worker in workers:
+            if worker.stdout.readline().strip() != "ready":
+                raise SystemExit(f"A writer for {shards} shards failed to start")
+        started = time.perf_counter()
+        for worker in workers:
+            worker.stdin.write("go\n")
+            worker.stdin.flush()
+        reports = []
+        for worker in workers:
+            reports.append(json.loads(worker.stdout.readline()))
+            worker.wait()
+        wall_time = time.perf_counter() - started
+
+    latencies = sorted(latency for report in reports for latency in report["latencies_ms"])
+    return {
+        "shards": shards,
+        "commits": len(latencies),
+        "locked": sum(report["locked"] for report in reports),
+        "seconds": round(wall_time, 3),
+        "commits_per_second": round(len(latencies) / wall_time, 1),
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "max_ms": round(latencies[-1], 2) if latencies else 0.0,
+    }
+
+
+def print_report(runs: list):
+    columns = [("commits_per_second", "commits/s"), ("p50_ms", "p50 ms"), ("p95_ms", "p95 ms"),
+               ("p99_ms", "p99 ms"), ("max_ms", "max ms"), ("locked", "locked")]
+    print(f"{'shards':<10}" + "".join(f"{label:>12}" for _, label in columns))
+    for run in runs:
+        print(f"{run['shards'] or 'single':<10}" + "".join(f"{run[key]:>12}" for key, _ in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure write throughput for growing shard counts")
+    parser.add_argument("--shards", default="0,1,2,4,8", help="Comma-separated shard counts; 0 is the single file")
+    parser.add_argument("--processes", type=int, default=8, help="Concurrent writer processes")
+    parser.add_argument("--users", type=int, default=16, help="Users per writer")
+    parser.add_argument("--writes", type=int, default=500, help="Messages stored per writer")
+    parser.add_argument("--output", help="Where to write the JSON results")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--index", type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.index, args.users, args.writes)
+        return
+
+    runs = []
+    for shards in (int(count) for count in args.shards.split(",")):
+        runs.append(run_shard_count(shards, args.processes, args.users, args.writes))
+        print(f"{shards or 'single file'}: {runs[-1]['commits_per_second']} commits/s")
+    print_report(runs)
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"shard-writes-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{git_revision()}.json"
+    )
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({
+            "revision": git_revision(),
+            "cpus": os.cpu_count(),
+            "processes": args.processes,
+            "users": args.users,
+            "writes": args.writes,
+            "runs": runs,
+        }, f, indent=2)
+    print(f"results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
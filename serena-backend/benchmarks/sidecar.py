@@ -0,0 +1,144 @@
+"""Intent inference in-process against the inference sidecar.
+
+Starts inference_sidecar.py on a temporary socket and measures, for the
+sidecar client and then for the same backend loaded in this process:
+
+  * end-to-end latency of single classify calls, one at a time and from
+    --threads concurrent callers (as the FastAPI threadpool makes them)
+  * CPU time spent per call in this process (the API worker) and in the
+    sidecar
+
+Run from the serena-backend directory:
+
+    python -m benchmarks.sidecar
+    python -m benchmarks.sidecar --backend quantized --threads 16 --calls 2000
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from benchmarks.load_test import RESULTS_DIR, SAMPLE_MESSAGES, git_revision, percentile
+from inference_sidecar import SidecarClient, SidecarIntentClassifier, load_serving_models
+from intent_classifiers import INTENT_MODEL_BACKEND
+
+STARTUP_TIMEOUT = 300
+
+
+def process_cpu_seconds(pid: int) -> float:
+    """User + system CPU time of another process, from /proc"""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def start_sidecar(socket_path: str, backend: str, models_dir: str) -> subprocess.Popen:
+    sidecar = subprocess.Popen(
+        [sys.executable, "inference_sidecar.py", "--socket", socket_path, "--backend", backend, "--models-dir", models_dir]
+    )
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while not os.path.exists(socket_path):
+        if sidecar.poll() is not None or time.monotonic() > deadline:
+            sidecar.kill()
+            raise SystemExit("The sidecar did not start")
+        time.sleep(0.2)
+    return sidecar
+
+
+def run_calls(classifier, calls: int, threads: int) -> dict:
+    """Spread `calls` single-text classify calls over `threads` callers"""
+    latencies = []
+    lock = threading.Lock()
+
+    def caller(index: int):
+        mine = []
+        for i in range(index, calls, threads):
+            started = time.perf_counter()
+            classifier.classify(SAMPLE_MESSAGES[i % len(SAMPLE_MESSAGES)])
+            mine.append((time.perf_counter() - started) * 1000)
+        with lock:
+            latencies.extend(mine)
+
+    workers = [threading.Thread(target=caller, args=(index,)) for index in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    seconds = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "calls_per_second": round(calls / seconds),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+    }
+
+
+def measure(classifier, calls: int, threads: int, sidecar_pid: int = None) -> dict:
+    classifier.warmup()
+    result = {}
+    for label, callers in (("sequential", 1), ("concurrent", threads)):
+        worker_cpu = time.process_time()
+        sidecar_cpu = process_cpu_seconds(sidecar_pid) if sidecar_pid else 0.0
+        result[label] = run_calls(classifier, calls, callers)
+        result[label]["worker_cpu_ms_per_call"] = round((time.process_time() - worker_cpu) * 1000 / calls, 3)
+        if sidecar_pid:
+            result[label]["sidecar_cpu_ms_per_call"] = round(
+                (process_cpu_seconds(sidecar_pid) - sidecar_cpu) * 1000 / calls, 3
+            )
+    return result
+
+
+def print_report(results: dict):
+    columns = [
+        ("calls_per_second", "calls/s"), ("p50_ms", "p50 ms"), ("p95_ms", "p95 ms"), ("p99_ms", "p99 ms"),
+        ("worker_cpu_ms_per_call", "worker cpu"), ("sidecar_cpu_ms_per_call", "sidecar cpu"),
+    ]
+    print(f"{'path':<24}" + "".join(f"{label:>12}" for _, label in columns))
+    for path, runs in results.items():
+        for label, row in runs.items():
+            print(f"{path + ' ' + label:<24}" + "".join(f"{row.get(key, '-'):>12}" for key, _ in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare in-process intent inference with the inference sidecar")
+    parser.add_argument("--backend", default=INTENT_MODEL_BACKEND)
+    parser.add_argument("--models-dir", default="./models")
+    parser.add_argument("--calls", type=int, default=1000)
+    parser.add_argument("--threads", type=int, default=8, help="Concurrent callers in the concurrent run")
+    parser.add_argument("--output", help="Where to write the JSON results")
+    args = parser.parse_args()
+
+    results = {}
+    socket_path = os.path.join(tempfile.mkdtemp(prefix="serene-sidecar-"), "intent.sock")
+    sidecar = start_sidecar(socket_path, args.backend, args.models_dir)
+    try:
+        client = SidecarClient(socket_path, pool_size=args.threads, timeout=5.0)
+        results["sidecar"] = measure(SidecarIntentClassifier(client, args.backend, args.models_dir),
+                                     args.calls, args.threads, sidecar.pid)
+        client.close()
+    finally:
+        sidecar.terminate()
+        sidecar.wait()
+
+    classifier, _ = load_serving_models(args.backend, args.models_dir)
+    results["in-process"] = measure(classifier, args.calls, args.threads)
+    print_report(results)
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"sidecar-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{git_revision()}.json"
+    )
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({"backend": args.backend, "calls": args.calls, "threads": args.threads, "results": results}, f, indent=2)
+    print(f"results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
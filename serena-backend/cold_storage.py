@@ -0,0 +1,74 @@
+"""Cold-storage sweep for old conversations.
+
+Moves the messages of conversations that have been archived for a while, or
+left idle for much longer, out of the hot `messages` table into compressed
+per-conversation blobs (see ColdStorageDatabase). Frozen conversations are
+decoded on read and thawed back automatically on the next write.
+
+    python cold_storage.py --archived-days 30 --idle-days 180
+"""
+import argparse
+import os
+import time
+
+from database import ColdStorageDatabase, each_database
+
+COLD_STORAGE_ARCHIVED_DAYS = int(os.getenv("COLD_STORAGE_ARCHIVED_DAYS", "30"))
+COLD_STORAGE_IDLE_DAYS = int(os.getenv("COLD_STORAGE_IDLE_DAYS", "180"))
+
+
+def freeze_cold_conversations(archived_days: int = COLD_STORAGE_ARCHIVED_DAYS,
+                              idle_days: int = COLD_STORAGE_IDLE_DAYS,
+                              batch_size: int = 200, max_conversations: int = None) -> dict:
+    """Freeze every eligible conversation, one short transaction each (shard by shard when sharded)"""
+    started = time.perf_counter()
+    conversations = messages = 0
+    for _ in each_database():
+        frozen = set()
+        while max_conversations is None or conversations < max_conversations:
+            limit = batch_size if max_conversations is None else min(batch_size, max_conversations - conversations)
+            candidates = ColdStorageDatabase.get_freeze_candidates(archived_days, idle_days, limit)
+            if not candidates:
+                break
+            for conversation_id in candidates:
+                # A conversation that stays a candidate once frozen would keep the sweep going forever
+                if conversation_id in frozen:
+                    raise RuntimeError(f"Conversation {conversation_id} is still a freeze candidate after freezing")
+                frozen.add(conversation_id)
+                messages += ColdStorageDatabase.freeze_conversation(conversation_id)
+                conversations += 1
+    return {
+        "conversations_frozen": conversations,
+        "messages_moved": messages,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def storage_stats() -> dict:
+    """ColdStorageDatabase.get_storage_stats summed over every shard"""
+    totals = {}
+    for _ in each_database():
+        for key, value in ColdStorageDatabase.get_storage_stats().items():
+            totals[key] = totals.get(key, 0) + value
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move old conversations into compressed cold storage")
+    parser.add_argument("--archived-days", type=int, default=COLD_STORAGE_ARCHIVED_DAYS,
+                        help="Freeze archived conversations untouched for this many days")
+    parser.add_argument("--idle-days", type=int, default=COLD_STORAGE_IDLE_DAYS,
+                        help="Freeze any conversation untouched for this many days")
+    parser.add_argument("--max-conversations", type=int, help="Stop after freezing this many")
+    args = parser.parse_args()
+
+    result = freeze_cold_conversations(args.archived_days, args.idle_days, max_conversations=args.max_conversations)
+    print(f"froze {result['conversations_frozen']} conversations "
+          f"({result['messages_moved']} messages) in {result['seconds']}s")
+    stats = storage_stats()
+    print(f"cold storage: {stats['frozen_conversations']} conversations, "
+          f"{stats['frozen_messages']} messages, {stats['archive_bytes'] / 1024:.0f} KiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""Cross-signal correlations between mood, journaling and chat intents.
+
+A user's signals over the last `days` days are loaded in three bulk
+queries. They are then binned into per-day NumPy arrays on one shared
+calendar:
+
+  * mood     mean mood_level per day, NaN on days without a mood entry
+  * journal  journal entries per day
+  * intents  (intents x days) counts of classified chat turns
+
+For each lag L (0..max_lag days), every signal on day t is correlated
+(Pearson) with mood on day t + L, all signals at once. A positive journal
+correlation at lag 1 means days with journaling tend to be followed by
+better moods. An intent with a negative lag-1 correlation tends to come
+before low moods.
+
+Results are cached per user. They are recomputed only when the user's
+moods, journal or conversations version counter moves (see
+ResourceVersionDatabase), the same way semantic_search.py caches.
+"""
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+import numpy as np
+
+from database import CorrelationDatabase, ResourceVersionDatabase
+
+CORRELATION_CACHE_MAX_USERS = int(os.getenv("CORRELATION_CACHE_MAX_USERS", "1000"))
+# Fewer overlapping days than this and a correlation is reported as null
+MIN_OVERLAP_DAYS = 5
+
+
+def to_days(timestamps: List[str]) -> np.ndarray:
+    """Day numbers (days since 1970-01-01) of SQLite timestamps"""
+    return np.array([timestamp[:10] for timestamp in timestamps], dtype="datetime64[D]").astype(np.int64)
+
+
+def lagged_correlations(signals: np.ndarray, mood: np.ndarray, lag: int) -> tuple:
+    """Pearson r of each row of `signals` on day t with mood on day t + lag; (r, overlapping days)"""
+    if lag:
+        signals, mood = signals[:, :-lag], mood[lag:]
+    observed = ~np.isnan(mood)
+    x = signals[:, observed].astype(np.float64)
+    y = mood[observed]
+    n = len(y)
+    if n < MIN_OVERLAP_DAYS:
+        return np.full(len(signals), np.nan), n
+    x = x - x.mean(axis=1, keepdims=True)
+    y = y - y.mean()
+    denominator = np.sqrt((x * x).sum(axis=1) * (y @ y))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        r = (x @ y) / denominator
+    # A signal that never varies (or mood that never changes) has no correlation
+    r[denominator == 0] = np.nan
+    return r, n
+
+
+def rounded(value: float):
+    return None if np.isnan(value) else round(float(value), 3)
+
+
+def compute(user_id: str, days: int, max_lag: int) -> Dict:
+    today = np.datetime64(datetime.utcnow().date(), "D").astype(np.int64)
+    start = today - days + 1
+    since = (datetime.utcnow().date() - timedelta(days=days - 1)).isoformat()
+
+    moods = CorrelationDatabase.get_moods(user_id, since)
+    journal_days = to_days(CorrelationDatabase.get_journal_times(user_id, since)) - start
+    intent_rows = CorrelationDatabase.get_intents(user_id, since)
+
+    mood_days = to_days([row[0] for row in moods]) - start
+    mood_sum = np.bincount(mood_days, weights=[row[1] for row in moods], minlength=days)[:days]
+    mood_count = np.bincount(mood_days, minlength=days)[:days]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mood = np.where(mood_count > 0, mood_sum / np.maximum(mood_count, 1), np.nan)
+    journal = np.bincount(journal_days, minlength=days)[:days]
+
+    intent_names, intent_index = np.unique([row[1] for row in intent_rows], return_inverse=True)
+    intent_days = to_days([row[0] for row in intent_rows]) - start
+    # Rows stamped after today (clock skew) fall outside the calendar
+    in_window = intent_days < days
+    intents = np.zeros((len(intent_names), days), dtype=np.int64)
+    np.add.at(intents, (intent_index[in_window], intent_days[in_window]), 1)
+
+    signals = np.vstack([journal[None, :], intents])
+    by_lag = [lagged_correlations(signals, mood, lag) for lag in range(max_lag + 1)]
+
+    observed = ~np.isnan(mood)
+    journaled = journal > 0
+    next_day_observed = observed[1:]
+    return {
+        "days": days,
+        "since": since,
+        "summary": {
+            "mood_days": int(observed.sum()),
+            "journal_days": int(journaled.sum()),
+            "chat_days": int((intents.sum(axis=0) > 0).sum()),
+            "average_mood": rounded(np.nanmean(mood)) if observed.any() else None,
+            "mood_on_journal_days": rounded(np.nanmean(mood[journaled & observed])) if (journaled & observed).any() else None,
+            "mood_on_other_days": rounded(np.nanmean(mood[~journaled & observed])) if (~journaled & observed).any() else None,
+            "mood_after_journal_days": rounded(np.nanmean(mood[1:][journaled[:-1] & next_day_observed]))
+            if (journaled[:-1] & next_day_observed).any() else None,
+        },
+        "journal": [
+            {"lag_days": lag, "correlation": rounded(r[0]), "overlap_days": n}
+            for lag, (r, n) in enumerate(by_lag)
+        ],
+        "intents": sorted(
+            (
+                {
+                    "intent": str(name),
+                    "turns": int(intents[i].sum()),
+                    "correlations": [
+                        {"lag_days": lag, "correlation": rounded(r[i + 1]), "overlap_days": n}
+                        for lag, (r, n) in enumerate(by_lag)
+                    ],
+                }
+                for i, name in enumerate(intent_names)
+            ),
+            key=lambda item: -item["turns"],
+        ),
+    }
+
+
+class CorrelationCache:
+    """Computed correlations per user, dropped when the user's data changes"""
+
+    def __init__(self, max_users: int = CORRELATION_CACHE_MAX_USERS):
+        self.max_users = max_users
+        self._results: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: str, days: int = 90, max_lag: int = 3) -> Dict:
+        versions = (
+            ResourceVersionDatabase.get_version(user_id, "moods"),
+            ResourceVersionDatabase.get_version(user_id, "journal"),
+            ResourceVersionDatabase.get_version(user_id, "conversations"),
+            # The window moves with the calendar, so results expire at midnight too
+            datetime.utcnow().date(),
+            days,
+            max_lag,
+        )
+        with self._lock:
+            cached = self._results.get(user_id)
+            if cached is not None and cached[0] == versions:
+                self._results.move_to_end(user_id)
+                return cached[1]
+
+        result = compute(user_id, days, max_lag)
+        with self._lock:
+            self._results[user_id] = (versions, result)
+            self._results.move_to_end(user_id)
+            while len(self._results) > self.max_users:
+                self._results.popitem(last=False)
+        return result
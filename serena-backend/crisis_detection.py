@@ -0,0 +1,94 @@
+"""Crisis-phrase fast path for chat messages.
+
+Messages that mention suicide or self-harm must not wait on the classifier
+and a Gemini round trip that can take seconds or fail. The phrase list in
+models/crisis_phrases.json (versioned, next to dataset.json) is compiled at
+startup into a word-level Aho-Corasick automaton. Each message is scanned
+once, in time linear in its length, however many phrases there are. On a
+match the API replies with the vetted response from the same file and flags
+the conversation.
+
+Text is normalized the same way for phrases and messages: lowercase,
+apostrophes dropped ("can't" -> "cant"), other punctuation turned into
+spaces. Phrases only match whole words, so "suicide" never fires inside
+another word.
+"""
+import json
+import re
+from typing import List, Optional
+
+CRISIS_PHRASES_PATH = "./models/crisis_phrases.json"
+
+APOSTROPHES = re.compile(r"['’`]")
+NON_WORD = re.compile(r"[^a-z0-9]+")
+
+
+def normalize(text: str) -> List[str]:
+    return NON_WORD.sub(" ", APOSTROPHES.sub("", text.lower())).split()
+
+
+class PhraseMatcher:
+    """Aho-Corasick over words: a trie of the phrases plus failure links, walked once per message"""
+
+    def __init__(self, phrases: List[str]):
+        # Node 0 is the root; each node has word -> child edges, a failure link and the phrase it ends, if any
+        self.edges = [{}]
+        self.fail = [0]
+        self.output = [None]
+        for phrase in phrases:
+            words = normalize(phrase)
+            if not words:
+                continue
+            node = 0
+            for word in words:
+                if word not in self.edges[node]:
+                    self.edges.append({})
+                    self.fail.append(0)
+                    self.output.append(None)
+                    self.edges[node][word] = len(self.edges) - 1
+                node = self.edges[node][word]
+            self.output[node] = " ".join(words)
+        self._link()
+
+    def _link(self):
+        """Breadth-first failure links; a node inherits the output of its failure target"""
+        # The root's children fail back to the root, as initialized
+        queue = list(self.edges[0].values())
+        for node in queue:
+            for word, child in self.edges[node].items():
+                target = self.fail[node]
+                while target and word not in self.edges[target]:
+                    target = self.fail[target]
+                self.fail[child] = self.edges[target].get(word, 0)
+                if self.output[child] is None:
+                    self.output[child] = self.output[self.fail[child]]
+                queue.append(child)
+
+    def find(self, text: str) -> Optional[str]:
+        """The first phrase that occurs in `text`, or None"""
+        node = 0
+        for word in normalize(text):
+            while node and word not in self.edges[node]:
+                node = self.fail[node]
+            node = self.edges[node].get(word, 0)
+            if self.output[node] is not None:
+                return self.output[node]
+        return None
+
+
+class CrisisDetector:
+    def __init__(self, phrases: List[str], response: str, intent: str = "crisis", version: int = 0):
+        self.matcher = PhraseMatcher(phrases)
+        self.phrase_count = len(phrases)
+        self.response = response
+        self.intent = intent
+        self.version = version
+
+    @classmethod
+    def load(cls, path: str = CRISIS_PHRASES_PATH) -> "CrisisDetector":
+        with open(path, "r") as f:
+            data = json.load(f)
+        return cls(data["phrases"], data["response"], data.get("intent", "crisis"), data.get("version", 0))
+
+    def match(self, text: str) -> Optional[str]:
+        return self.matcher.find(text)
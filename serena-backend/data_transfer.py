@@ -0,0 +1,160 @@
+"""Streaming NDJSON export and import of a user's data.
+
+Export walks every table with keyset-paged queries (see UserDataDatabase) and
+yields one JSON object per line, optionally gzip-compressed on the fly, so
+memory stays flat no matter how large the account is. Import parses the same
+format from the request stream and writes it in batched transactions. Lines
+that are not valid JSON, or not a record import can store, are counted under
+"skipped" rather than failing the import halfway.
+"""
+import json
+import zlib
+
+from starlette.concurrency import run_in_threadpool
+
+from database import Database, UserDataDatabase
+
+EXPORT_FORMAT_VERSION = 1
+EXPORT_PAGE_SIZE = 500
+EXPORT_CHUNK_BYTES = 64 * 1024
+IMPORT_BATCH_SIZE = 1000
+
+# type -> field -> accepted JSON types, for the fields UserDataDatabase.import_batch reads
+IMPORT_FIELDS = {
+    "user": {},
+    "conversation": {"id": int, "title": str, "created_at": str, "updated_at": str, "is_archived": int},
+    "message": {"conversation_id": int, "role": str, "content": str, "intent": str, "created_at": str},
+    "mood": {"mood_level": int, "mood_emoji": str, "notes": str, "created_at": str},
+    "journal": {"title": str, "content": str, "mood_level": int, "created_at": str, "updated_at": str},
+    "goal": {"title": str, "description": str, "category": str, "target_value": int, "current_value": int,
+             "unit": str, "start_date": str, "target_date": str, "status": str, "created_at": str,
+             "updated_at": str, "completed_at": str},
+}
+# Fields that must be present and not null (NOT NULL columns)
+IMPORT_REQUIRED = {
+    "message": ("conversation_id", "role", "content"),
+    "mood": ("mood_level", "mood_emoji"),
+    "journal": ("content",),
+    "goal": ("title",),
+}
+
+
+def _paged(kind: str, owner, user_id: str):
+    after = ("", 0)
+    while after is not None:
+        records, after = UserDataDatabase.get_export_page(kind, owner, after, EXPORT_PAGE_SIZE, user_id)
+        yield from records
+
+
+def iter_export_records(user_id: str):
+    """Yield every record belonging to the user, one dict at a time"""
+    user = Database.get_user(user_id) or {}
+    yield {
+        "type": "user",
+        "format_version": EXPORT_FORMAT_VERSION,
+        "id": user_id,
+        "name": user.get("name"),
+        "email": user.get("email"),
+        "phone": user.get("phone"),
+        "created_at": user.get("created_at"),
+    }
+    
+    # Only (id, is_frozen) pairs are kept to walk the messages afterwards
+    conversations = []
+    for record in _paged("conversation", user_id, user_id):
+        conversations.append((record["id"], record.pop("is_frozen")))
+        record["is_archived"] = bool(record["is_archived"])
+        yield {"type": "conversation", **record}
+    
+    for conversation_id, is_frozen in conversations:
+        if is_frozen:
+            messages = UserDataDatabase.get_frozen_messages(conversation_id, user_id)
+        else:
+            messages = _paged("message", conversation_id, user_id)
+        for message in messages:
+            yield {"type": "message", **message, "conversation_id": conversation_id}
+    
+    for kind in ("mood", "journal", "goal"):
+        for record in _paged(kind, user_id, user_id):
+            yield {"type": kind, **record}
+
+
+def iter_ndjson(user_id: str, compress: bool = False):
+    """NDJSON export as byte chunks, gzip-compressed if requested"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    buffer = []
+    size = 0
+    for record in iter_export_records(user_id):
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":"), default=str) + "\n"
+        buffer.append(line)
+        size += len(line)
+        if size >= EXPORT_CHUNK_BYTES:
+            chunk = "".join(buffer).encode("utf-8")
+            buffer, size = [], 0
+            chunk = compressor.compress(chunk) if compressor else chunk
+            if chunk:
+                yield chunk
+    
+    chunk = "".join(buffer).encode("utf-8")
+    if compressor:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    if chunk:
+        yield chunk
+
+
+def parse_record(line: bytes):
+    """The record on one NDJSON line, or None if import cannot store it"""
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(record, dict) or record.get("type") not in IMPORT_FIELDS:
+        return None
+    if any(record.get(field) is None for field in IMPORT_REQUIRED.get(record["type"], ())):
+        return None
+    for field, kind in IMPORT_FIELDS[record["type"]].items():
+        value = record.get(field)
+        if value is not None and not isinstance(value, kind):
+            return None
+    return record
+
+
+async def import_ndjson(user_id: str, stream, gzipped: bool = False) -> dict:
+    """Read NDJSON records from an async byte stream and store them for user_id"""
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 32) if gzipped else None
+    counts = {}
+    conversation_ids = {}
+    batch = []
+    pending = b""
+    
+    def add(line: bytes):
+        record = parse_record(line)
+        if record is None:
+            counts["skipped"] = counts.get("skipped", 0) + 1
+        else:
+            batch.append(record)
+    
+    async def flush():
+        stored = await run_in_threadpool(UserDataDatabase.import_batch, user_id, batch, conversation_ids)
+        for kind, count in stored.items():
+            counts[kind] = counts.get(kind, 0) + count
+        batch.clear()
+    
+    async for chunk in stream:
+        if decompressor:
+            chunk = decompressor.decompress(chunk)
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            if line.strip():
+                add(line)
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            await flush()
+    
+    if decompressor:
+        pending += decompressor.flush()
+    if pending.strip():
+        add(pending)
+    if batch:
+        await flush()
+    return counts
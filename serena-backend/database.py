@@ -1,16 +1,38 @@
 import sqlite3
+from contextlib import contextmanager
+from contextvars import ContextVar
 from datetime import datetime
 from typing import List, Optional, Dict
 import json
 import os
+import threading
+import time
+import zlib
 
-DB_PATH = os.path.join(os.path.dirname(__file__), "serene.db")
+from sharding import ConnectionPool, id_range_start, shard_for, shard_path
 
-def init_db():
+DB_PATH = os.getenv("SERENE_DB_PATH", os.path.join(os.path.dirname(__file__), "serene.db"))
+
+# Sharded storage (see sharding.py): 0 keeps everything in DB_PATH
+SHARD_COUNT = int(os.getenv("SERENE_DB_SHARDS", "0"))
+SHARD_DIR = os.getenv("SERENE_SHARD_DIR", os.path.join(os.path.dirname(DB_PATH), "shards"))
+# Idle connections kept open per database file
+SHARD_POOL_SIZE = int(os.getenv("SERENE_SHARD_POOL_SIZE", "8"))
+# Record edits in analytics_changes for analytics_export.py; 0 skips the logging
+ANALYTICS_EXPORT_ENABLED = os.getenv("ANALYTICS_EXPORT_ENABLED", "0") == "1"
+
+def init_db(db_path: Optional[str] = None):
     """Initialize the database with required tables"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(db_path or DB_PATH)
     cursor = conn.cursor()
     
+    # Lets PRAGMA incremental_vacuum return freed pages to the OS.
+    # Only takes effect when the file is first created.
+    cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    # Readers and online backups work from a snapshot and never block the writer.
+    # Persistent; db_maintenance.py checkpoints the -wal file.
+    cursor.execute("PRAGMA journal_mode = WAL")
+    
     # Users table (enhanced)
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS users (
@@ -20,9 +42,11 @@ def init_db():
             phone TEXT UNIQUE,
             hashed_password TEXT,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            last_active TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            last_active TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            deleted_at TIMESTAMP
         )
     """)
+    add_column_if_missing(cursor, "users", "deleted_at", "TIMESTAMP")
     
     # Conversations table
     cursor.execute("""
@@ -33,9 +57,13 @@ def init_db():
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             is_archived BOOLEAN DEFAULT 0,
+            is_frozen BOOLEAN DEFAULT 0,
             FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
         )
     """)
+    add_column_if_missing(cursor, "conversations", "is_frozen", "BOOLEAN DEFAULT 0")
+    # Set by the crisis-phrase fast path in /predict the first time a message matches
+    add_column_if_missing(cursor, "conversations", "crisis_flagged_at", "TIMESTAMP")
     
     # Messages table
     cursor.execute("""
@@ -77,13 +105,12 @@ def init_db():
         )
     """)
     
-    # Create indexes for better performance
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_conversations_user_id ON conversations(user_id)")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_conversation_id ON messages(conversation_id)")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_conversations_updated_at ON conversations(updated_at)")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_mood_entries_user_id ON mood_entries(user_id)")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_mood_entries_created_at ON mood_entries(created_at)")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_journal_entries_user_id ON journal_entries(user_id)")
+    # Composite indexes: equality filter first, then the column each query sorts or ranges on,
+    # so listings are served in index order without a temp B-tree sort
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_conversations_user_updated ON conversations(user_id, updated_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_conversation_created ON messages(conversation_id, created_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_mood_entries_user_created ON mood_entries(user_id, created_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_journal_entries_user_created ON journal_entries(user_id, created_at)")
     
     # Goals table for progress tracking
     cursor.execute("""
@@ -105,16 +132,540 @@ def init_db():
             FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
         )
     """)
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_goals_user_id ON goals(user_id)")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_goals_status ON goals(status)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_goals_user_created ON goals(user_id, created_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_goals_user_status_created ON goals(user_id, status, created_at)")
+    
+    # Single-column indexes superseded by the composite ones above
+    for index in ("idx_conversations_user_id", "idx_messages_conversation_id", "idx_conversations_updated_at",
+                  "idx_mood_entries_user_id", "idx_mood_entries_created_at", "idx_journal_entries_user_id",
+                  "idx_goals_user_id", "idx_goals_status"):
+        cursor.execute(f"DROP INDEX IF EXISTS {index}")
+    
+    # Account deletions queued for the background purge job
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS account_purge_jobs (
+            user_id TEXT PRIMARY KEY,
+            status TEXT NOT NULL DEFAULT 'pending',
+            current_table TEXT,
+            rows_deleted INTEGER DEFAULT 0,
+            requested_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_account_purge_jobs_status ON account_purge_jobs(status)")
+    
+    # Cold storage: messages of long-idle conversations, one compressed blob per conversation
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS conversation_archive (
+            conversation_id INTEGER PRIMARY KEY,
+            codec TEXT NOT NULL,
+            message_count INTEGER NOT NULL,
+            last_message TEXT,
+            payload BLOB NOT NULL,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    # Newly frozen conversations, for the analytics export
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_conversation_archive_archived ON conversation_archive(archived_at)")
+    # Only conversations still in the hot table are sweep candidates
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_conversations_thawed_updated
+        ON conversations(updated_at) WHERE is_frozen = 0
+    """)
+    
+    # Per-user change counters behind the listing ETags, bumped by triggers on every write
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS resource_versions (
+            user_id TEXT NOT NULL,
+            resource TEXT NOT NULL,
+            version INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, resource)
+        ) WITHOUT ROWID
+    """)
+    # Ledger of applied offline-sync operations, keyed by the client's idempotency id
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sync_operations (
+            user_id TEXT NOT NULL,
+            op_id TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            status TEXT NOT NULL,
+            result_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, op_id)
+        ) WITHOUT ROWID
+    """)
+    
+    # Semantic search vectors (float16 bytes) for messages and journal entries
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS embeddings (
+            kind TEXT NOT NULL,
+            item_id INTEGER NOT NULL,
+            user_id TEXT NOT NULL,
+            conversation_id INTEGER,
+            model_key TEXT NOT NULL,
+            vector BLOB NOT NULL,
+            PRIMARY KEY (kind, item_id)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_user ON embeddings(user_id)")
+    # An edited journal entry is embedded again on the next search
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_journal_entries_stale_embedding
+        AFTER UPDATE OF title, content ON journal_entries
+        BEGIN
+            DELETE FROM embeddings WHERE kind = 'journal' AND item_id = NEW.id;
+        END
+    """)
+    
+    # Resume points for offline batch jobs such as intent_backfill.py
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS backfill_checkpoints (
+            job TEXT PRIMARY KEY,
+            model_key TEXT NOT NULL,
+            last_id INTEGER NOT NULL,
+            processed INTEGER NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID
+    """)
+    
+    # How user data is laid out; only the directory (DB_PATH) holds rows, see init_storage
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS storage_layout (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        ) WITHOUT ROWID
+    """)
+    
+    # Last run of each db_maintenance.py task; claiming a row keeps workers from running it twice
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS maintenance_runs (
+            task TEXT PRIMARY KEY,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP,
+            status TEXT,
+            seconds REAL,
+            pages INTEGER,
+            details TEXT
+        ) WITHOUT ROWID
+    """)
+    
+    # Goal progress history, appended by trigger whenever a goal's current_value changes
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'goal_progress_events'")
+    backfill_goal_progress = cursor.fetchone() is None
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS goal_progress_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            goal_id INTEGER NOT NULL,
+            previous_value INTEGER,
+            current_value INTEGER,
+            recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_goal_progress_events_goal ON goal_progress_events(goal_id)")
+    if backfill_goal_progress:
+        cursor.execute(GOAL_PROGRESS_BACKFILL)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_goals_insert_progress
+        AFTER INSERT ON goals
+        BEGIN
+            INSERT INTO goal_progress_events (goal_id, previous_value, current_value) VALUES (NEW.id, NULL, NEW.current_value);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_goals_update_progress
+        AFTER UPDATE OF current_value ON goals
+        WHEN NEW.current_value IS NOT OLD.current_value
+        BEGIN
+            INSERT INTO goal_progress_events (goal_id, previous_value, current_value) VALUES (NEW.id, OLD.current_value, NEW.current_value);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_goals_delete_progress
+        AFTER DELETE ON goals
+        BEGIN
+            DELETE FROM goal_progress_events WHERE goal_id = OLD.id;
+        END
+    """)
+    
+    # Journal insights (journal_insights.py): triggers queue every change to an entry, and the
+    # queue is folded into one packed row per user the next time their insights are read
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'journal_insight_changes'")
+    backfill_journal_insights = cursor.fetchone() is None
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS journal_insight_changes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            sign INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            mood_level INTEGER,
+            weekday INTEGER,
+            hour INTEGER
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_journal_insight_changes_user ON journal_insight_changes(user_id, id)")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS journal_insights (
+            user_id TEXT PRIMARY KEY,
+            last_change_id INTEGER NOT NULL,
+            entry_count INTEGER NOT NULL,
+            word_count INTEGER NOT NULL,
+            terms BLOB NOT NULL,
+            term_counts BLOB NOT NULL,
+            slot_entries BLOB NOT NULL,
+            slot_mood_sum BLOB NOT NULL,
+            slot_mood_count BLOB NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID
+    """)
+    journal_change = """
+        INSERT INTO journal_insight_changes (user_id, sign, text, mood_level, weekday, hour)
+        VALUES ({row}.user_id, {sign}, COALESCE({row}.title, '') || ' ' || {row}.content, {row}.mood_level,
+                CAST(strftime('%w', {row}.created_at) AS INTEGER), CAST(strftime('%H', {row}.created_at) AS INTEGER));
+    """
+    for event, of, changes in (
+        ("INSERT", "", [("NEW", 1)]),
+        ("UPDATE", " OF title, content, mood_level", [("OLD", -1), ("NEW", 1)]),
+        ("DELETE", "", [("OLD", -1)]),
+    ):
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_journal_entries_{event.lower()}_insights
+            AFTER {event}{of} ON journal_entries
+            BEGIN
+                {"".join(journal_change.format(row=row, sign=sign) for row, sign in changes)}
+            END
+        """)
+    if backfill_journal_insights:
+        cursor.execute(JOURNAL_INSIGHTS_BACKFILL)
+    
+    # Per-user goal counters behind /goals/statistics, kept current by triggers on goals
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'goal_stats'")
+    backfill_goal_stats = cursor.fetchone() is None
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS goal_stats (
+            user_id TEXT PRIMARY KEY,
+            total_goals INTEGER NOT NULL DEFAULT 0,
+            active_goals INTEGER NOT NULL DEFAULT 0,
+            completed_goals INTEGER NOT NULL DEFAULT 0,
+            -- Sum and count of progress percentages over active goals with a target
+            progress_sum REAL NOT NULL DEFAULT 0,
+            progress_count INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    """)
+    for event, terms in (("INSERT", [("NEW", 1)]), ("DELETE", [("OLD", -1)]), ("UPDATE", [("NEW", 1), ("OLD", -1)])):
+        of = " OF status, current_value, target_value" if event == "UPDATE" else ""
+        deltas = [" + ".join(f"{sign} * ({expression.format(row=row)})" for row, sign in terms) for expression in GOAL_STATS_TERMS]
+        owner = terms[0][0]
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_goals_{event.lower()}_stats
+            AFTER {event}{of} ON goals
+            BEGIN
+                INSERT INTO goal_stats (user_id, total_goals, active_goals, completed_goals, progress_sum, progress_count)
+                VALUES ({owner}.user_id, {", ".join(deltas)})
+                ON CONFLICT(user_id) DO UPDATE SET
+                    total_goals = total_goals + excluded.total_goals,
+                    active_goals = active_goals + excluded.active_goals,
+                    completed_goals = completed_goals + excluded.completed_goals,
+                    progress_sum = progress_sum + excluded.progress_sum,
+                    progress_count = progress_count + excluded.progress_count;
+            END
+        """)
+    if backfill_goal_stats:
+        cursor.execute(GOAL_STATS_BACKFILL)
+    
+    for table, resource, owner, source in VERSIONED_TABLES:
+        for event, row in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_version
+                AFTER {event} ON {table}
+                BEGIN
+                    INSERT INTO resource_versions (user_id, resource, version)
+                    SELECT {owner.format(row=row)}, '{resource}', 1 {source.format(row=row)}
+                    ON CONFLICT(user_id, resource) DO UPDATE SET version = version + 1;
+                END
+            """)
+    
+    # Updates and deletes of rows the analytics export has already written (analytics_export.py).
+    # New rows are found by id; the export deletes the entries it has consumed.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS analytics_changes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            source TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            deleted INTEGER NOT NULL
+        )
+    """)
+    # Only logged while the export is enabled. Edits made while it was off are lost, so
+    # turning it back on bumps analytics_log in storage_layout and the export asks for --full.
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'trg\\_%\\_analytics' ESCAPE '\\'")
+    logging_triggers = [row[0] for row in cursor.fetchall()]
+    if ANALYTICS_EXPORT_ENABLED:
+        if not logging_triggers:
+            cursor.execute("""
+                INSERT INTO storage_layout (key, value) VALUES ('analytics_log', 1)
+                ON CONFLICT(key) DO UPDATE SET value = value + 1
+            """)
+        for table, event, when in ANALYTICS_CHANGE_EVENTS:
+            row, deleted = ("OLD", 1) if event == "DELETE" else ("NEW", 0)
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.split()[0].lower()}_analytics
+                AFTER {event} ON {table}
+                {when}
+                BEGIN
+                    INSERT INTO analytics_changes (source, row_id, deleted) VALUES ('{table}', {row}.id, {deleted});
+                END
+            """)
+    elif logging_triggers:
+        for name in logging_triggers:
+            cursor.execute(f"DROP TRIGGER {name}")
+        cursor.execute("DELETE FROM analytics_changes")
+    
+    conn.commit()
+    conn.close()
+
+# One goal's contribution to each goal_stats counter, in column order
+GOAL_STATS_TERMS = [
+    "1",
+    "{row}.status IS 'active'",
+    "{row}.status IS 'completed'",
+    "CASE WHEN {row}.status IS 'active' AND {row}.target_value <> 0 THEN COALESCE({row}.current_value, 0) * 100.0 / {row}.target_value ELSE 0 END",
+    "{row}.status IS 'active' AND COALESCE({row}.target_value, 0) <> 0",
+]
+
+# Derived rows for data that was written while the triggers did not exist (see rebuild_derived_tables)
+GOAL_STATS_BACKFILL = f"""
+    INSERT INTO goal_stats (user_id, total_goals, active_goals, completed_goals, progress_sum, progress_count)
+    SELECT user_id, {", ".join(f"SUM({expression.format(row='goals')})" for expression in GOAL_STATS_TERMS)}
+    FROM goals WHERE true GROUP BY user_id
+    ON CONFLICT(user_id) DO NOTHING
+"""
+# Goals without a logged change start their history at their current value
+GOAL_PROGRESS_BACKFILL = """
+    INSERT INTO goal_progress_events (goal_id, previous_value, current_value, recorded_at)
+    SELECT g.id, NULL, g.current_value, COALESCE(g.updated_at, g.created_at) FROM goals g
+    WHERE NOT EXISTS (SELECT 1 FROM goal_progress_events e WHERE e.goal_id = g.id)
+    ORDER BY g.id
+"""
+JOURNAL_INSIGHTS_BACKFILL = """
+    INSERT INTO journal_insight_changes (user_id, sign, text, mood_level, weekday, hour)
+    SELECT user_id, 1, COALESCE(title, '') || ' ' || content, mood_level,
+           CAST(strftime('%w', created_at) AS INTEGER), CAST(strftime('%H', created_at) AS INTEGER)
+    FROM journal_entries ORDER BY id
+"""
+
+def rebuild_derived_tables(db_path: Optional[str] = None):
+    """Recompute what the triggers maintain, after rows were loaded with them dropped (benchmarks/seed_db.py)"""
+    conn = sqlite3.connect(db_path or DB_PATH)
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM goal_stats")
+    cursor.execute(GOAL_STATS_BACKFILL)
+    cursor.execute(GOAL_PROGRESS_BACKFILL)
+    # Journal insights are folded again from scratch on the next read
+    cursor.execute("DELETE FROM journal_insights")
+    cursor.execute("DELETE FROM journal_insight_changes")
+    cursor.execute(JOURNAL_INSIGHTS_BACKFILL)
+    conn.commit()
+    conn.close()
+
+# (table, resource version it bumps, owning user of the changed row, FROM/WHERE it is selected with).
+# The WHERE is required: it keeps SQLite from parsing ON CONFLICT as part of the SELECT.
+VERSIONED_TABLES = [
+    ("conversations", "conversations", "{row}.user_id", "WHERE true"),
+    # Message counts and last_message are part of the conversation listing
+    ("messages", "conversations", "c.user_id", "FROM conversations c WHERE c.id = {row}.conversation_id"),
+    ("mood_entries", "moods", "{row}.user_id", "WHERE true"),
+    ("journal_entries", "journal", "{row}.user_id", "WHERE true"),
+    ("goals", "goals", "{row}.user_id", "WHERE true"),
+]
+
+# (table, event, WHEN) logged to analytics_changes. mood_entries are never edited.
+ANALYTICS_CHANGE_EVENTS = [
+    # Not updated_at, which every new message bumps; the messages carry that activity
+    ("conversations", "UPDATE OF title, is_archived, crisis_flagged_at", ""),
+    ("conversations", "DELETE", ""),
+    ("messages", "UPDATE OF intent", ""),
+    # Freezing moves messages into conversation_archive first; that is not a delete
+    ("messages", "DELETE", "WHEN NOT EXISTS (SELECT 1 FROM conversation_archive WHERE conversation_id = OLD.conversation_id)"),
+    ("journal_entries", "UPDATE", ""),
+    ("journal_entries", "DELETE", ""),
+    ("goals", "UPDATE", ""),
+    ("goals", "DELETE", ""),
+]
+
+_current_shard: ContextVar[Optional[int]] = ContextVar("current_shard", default=None)
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+def database_path(user_id: Optional[str] = None) -> str:
+    """File holding user_id's rows. Without a user: the shard selected by
+    use_shard, else the directory (account-level tables)."""
+    if not SHARD_COUNT:
+        return DB_PATH
+    if user_id is not None:
+        return shard_path(SHARD_DIR, shard_for(user_id, SHARD_COUNT), SHARD_COUNT)
+    shard = _current_shard.get()
+    return DB_PATH if shard is None else shard_path(SHARD_DIR, shard, SHARD_COUNT)
+
+@contextmanager
+def use_shard(shard: int):
+    """Send connections opened without a user_id to this shard, for jobs that walk every shard"""
+    token = _current_shard.set(shard)
+    try:
+        yield
+    finally:
+        _current_shard.reset(token)
+
+def each_database(include_directory: bool = False):
+    """Yield a label per file holding user data, with calls in the loop body going to that file.
     
+    Just DB_PATH unless sharded; include_directory adds the directory to the shards.
+    """
+    if not SHARD_COUNT:
+        yield "serene.db"
+        return
+    if include_directory:
+        yield "directory"
+    for shard in range(SHARD_COUNT):
+        with use_shard(shard):
+            yield f"shard {shard}"
+
+def _pool_for(path: str) -> ConnectionPool:
+    pool = _pools.get(path)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.setdefault(path, ConnectionPool(path, SHARD_POOL_SIZE))
+    return pool
+
+def reserve_id_range(db_path: str, start: int):
+    """Make every AUTOINCREMENT table in the file allocate ids above `start`"""
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND sql LIKE '%AUTOINCREMENT%'")
+    for (table,) in cursor.fetchall():
+        cursor.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = ? AND seq < ?", (start, table, start))
+        cursor.execute(
+            "INSERT INTO sqlite_sequence (name, seq) SELECT ?, ? WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = ?)",
+            (table, start, table)
+        )
     conn.commit()
     conn.close()
 
+def get_storage_layout(db_path: Optional[str] = None) -> Dict[str, int]:
+    conn = sqlite3.connect(db_path or DB_PATH)
+    rows = conn.execute("SELECT key, value FROM storage_layout").fetchall()
+    conn.close()
+    return dict(rows)
+
+def set_storage_layout(layout: Dict[str, int], db_path: Optional[str] = None):
+    conn = sqlite3.connect(db_path or DB_PATH)
+    conn.executemany(
+        "INSERT INTO storage_layout (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+        list(layout.items())
+    )
+    conn.commit()
+    conn.close()
+
+def has_user_data(db_path: str) -> bool:
+    conn = sqlite3.connect(db_path)
+    row = conn.execute("""
+        SELECT EXISTS (SELECT 1 FROM conversations) OR EXISTS (SELECT 1 FROM mood_entries)
+            OR EXISTS (SELECT 1 FROM journal_entries) OR EXISTS (SELECT 1 FROM goals)
+    """).fetchone()
+    conn.close()
+    return bool(row[0])
+
+def init_storage():
+    """Create the schema in the directory and every shard, and check they match SERENE_DB_SHARDS"""
+    init_db(DB_PATH)
+    layout = get_storage_layout()
+    recorded = layout.get("shards", 0)
+    if recorded != SHARD_COUNT:
+        if recorded == 0 and not has_user_data(DB_PATH):
+            # A new sharded deployment; an existing one is laid out by shard_migrate.py
+            layout = {"shards": SHARD_COUNT, "id_base": 0}
+            set_storage_layout(layout)
+        else:
+            raise RuntimeError(
+                f"{DB_PATH} holds data for {recorded or 'no'} shards but SERENE_DB_SHARDS={SHARD_COUNT}; "
+                f"move it with: python shard_migrate.py --shards {SHARD_COUNT}"
+            )
+    if not SHARD_COUNT:
+        return
+    os.makedirs(SHARD_DIR, exist_ok=True)
+    for shard in range(SHARD_COUNT):
+        path = shard_path(SHARD_DIR, shard, SHARD_COUNT)
+        init_db(path)
+        reserve_id_range(path, id_range_start(layout.get("id_base", 0), shard))
+
+def add_column_if_missing(cursor, table: str, column: str, definition: str):
+    """Add a column to an existing table created by an older version of init_db"""
+    cursor.execute(f"PRAGMA table_info({table})")
+    if column not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+# Row factories: build each API response dict as the row is fetched, so listings
+# never hold the tuples and the dicts at the same time
+def conversation_row(cursor, row) -> Dict:
+    return {
+        "id": row[0],
+        "title": row[1],
+        "created_at": row[2],
+        "updated_at": row[3],
+        "is_archived": bool(row[4]),
+        "message_count": row[5],
+        "last_message": row[6]
+    }
+
+def message_row(cursor, row) -> Dict:
+    return {"id": row[0], "role": row[1], "content": row[2], "intent": row[3], "created_at": row[4]}
+
+def search_result_row(cursor, row) -> Dict:
+    return {
+        "id": row[0],
+        "content": row[1],
+        "role": row[2],
+        "created_at": row[3],
+        "conversation_title": row[4],
+        "conversation_id": row[5]
+    }
+
+def mood_row(cursor, row) -> Dict:
+    return {"id": row[0], "mood_level": row[1], "mood_emoji": row[2], "notes": row[3], "created_at": row[4]}
+
+def journal_row(cursor, row) -> Dict:
+    return {
+        "id": row[0],
+        "title": row[1],
+        "content": row[2],
+        "mood_level": row[3],
+        "created_at": row[4],
+        "updated_at": row[5]
+    }
+
+def goal_row(cursor, row) -> Dict:
+    return {
+        "id": row[0],
+        "title": row[1],
+        "description": row[2],
+        "category": row[3],
+        "target_value": row[4],
+        "current_value": row[5],
+        "unit": row[6],
+        "start_date": row[7],
+        "target_date": row[8],
+        "status": row[9],
+        "created_at": row[10],
+        "updated_at": row[11],
+        "completed_at": row[12],
+        "progress_percentage": row[13]
+    }
+
 class Database:
     @staticmethod
-    def get_connection():
-        return sqlite3.connect(DB_PATH)
+    def get_connection(user_id: Optional[str] = None):
+        """A connection to the file holding user_id's rows (see database_path).
+        Pooled: opening a WAL database per call, and checkpointing it on close, costs more than most queries."""
+        return _pool_for(database_path(user_id)).acquire()
     
     # User operations
     @staticmethod
@@ -132,7 +683,10 @@ class Database:
     def get_user(user_id: str) -> Optional[Dict]:
         conn = Database.get_connection()
         cursor = conn.cursor()
-        cursor.execute("SELECT id, name, email, phone, hashed_password, created_at FROM users WHERE id = ?", (user_id,))
+        cursor.execute(
+            "SELECT id, name, email, phone, hashed_password, created_at FROM users WHERE id = ? AND deleted_at IS NULL",
+            (user_id,)
+        )
         row = cursor.fetchone()
         conn.close()
         
@@ -158,7 +712,7 @@ class Database:
     # Conversation operations
     @staticmethod
     def create_conversation(user_id: str, title: str = "New Conversation") -> int:
-        conn = Database.get_connection()
+        conn = Database.get_connection(user_id)
         cursor = conn.cursor()
         cursor.execute(
             "INSERT INTO conversations (user_id, title) VALUES (?, ?)",
@@ -171,46 +725,42 @@ class Database:
     
     @staticmethod
     def get_user_conversations(user_id: str, include_archived: bool = False) -> List[Dict]:
-        conn = Database.get_connection()
+        conn = Database.get_connection(user_id)
         cursor = conn.cursor()
+        cursor.row_factory = conversation_row
         
+        # Correlated subqueries instead of JOIN + GROUP BY keep the scan in
+        # idx_conversations_user_updated order, so no temp B-tree is needed
         query = """
             SELECT c.id, c.title, c.created_at, c.updated_at, c.is_archived,
-                   COUNT(m.id) as message_count,
-                   (SELECT content FROM messages WHERE conversation_id = c.id ORDER BY created_at DESC LIMIT 1) as last_message
+                   CASE WHEN c.is_frozen
+                        THEN (SELECT message_count FROM conversation_archive WHERE conversation_id = c.id)
+                        ELSE (SELECT COUNT(*) FROM messages WHERE conversation_id = c.id)
+                   END as message_count,
+                   CASE WHEN c.is_frozen
+                        THEN (SELECT last_message FROM conversation_archive WHERE conversation_id = c.id)
+                        ELSE (SELECT content FROM messages WHERE conversation_id = c.id ORDER BY created_at DESC LIMIT 1)
+                   END as last_message
             FROM conversations c
-            LEFT JOIN messages m ON c.id = m.conversation_id
             WHERE c.user_id = ?
         """
         
         if not include_archived:
             query += " AND c.is_archived = 0"
         
-        query += " GROUP BY c.id ORDER BY c.updated_at DESC"
+        query += " ORDER BY c.updated_at DESC"
         
         cursor.execute(query, (user_id,))
-        rows = cursor.fetchall()
+        conversations = cursor.fetchall()
         conn.close()
-        
-        return [
-            {
-                "id": row[0],
-                "title": row[1],
-                "created_at": row[2],
-                "updated_at": row[3],
-                "is_archived": bool(row[4]),
-                "message_count": row[5],
-                "last_message": row[6]
-            }
-            for row in rows
-        ]
+        return conversations
     
     @staticmethod
     def get_conversation(conversation_id: int, user_id: str) -> Optional[Dict]:
-        conn = Database.get_connection()
+        conn = Database.get_connection(user_id)
         cursor = conn.cursor()
         cursor.execute(
-            "SELECT id, user_id, title, created_at, updated_at, is_archived FROM conversations WHERE id = ? AND user_id = ?",
+            "SELECT id, user_id, title, created_at, updated_at, is_archived, crisis_flagged_at FROM conversations WHERE id = ? AND user_id = ?",
             (conversation_id, user_id)
         )
         row = cursor.fetchone()
@@ -223,13 +773,14 @@ class Database:
                 "title": row[2],
                 "created_at": row[3],
                 "updated_at": row[4],
-                "is_archived": bool(row[5])
+                "is_archived": bool(row[5]),
+                "crisis_flagged_at": row[6]
             }
         return None
     
     @staticmethod
     def update_conversation_title(conversation_id: int, user_id: str, title: str):
-        conn = Database.get_connection()
+        conn = Database.get_connection(user_id)
         cursor = conn.cursor()
         cursor.execute(
             "UPDATE conversations SET title = ?, updated_at = ? WHERE id = ? AND user_id = ?",
@@ -238,9 +789,21 @@ class Database:
         conn.commit()
         conn.close()
     
+    @staticmethod
+    def flag_conversation_crisis(conversation_id: int, user_id: str):
+        """Record when a conversation first matched a crisis phrase; later matches keep that time"""
+        conn = Database.get_connection(user_id)
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE conversations SET crisis_flagged_at = ? WHERE id = ? AND user_id = ? AND crisis_flagged_at IS NULL",
+            (datetime.utcnow(), conversation_id, user_id)
+        )
+        conn.commit()
+        conn.close()
+    
     @staticmethod
     def archive_conversation(conversation_id: int, user_id: str, archive: bool = True):
-        conn = Database.get_connection()
+        conn = Database.get_connection(user_id)
         cursor = conn.cursor()
         cursor.execute(
             "UPDATE conversations SET is_archived = ?, updated_at = ? WHERE id = ? AND user_id = ?",
@@ -251,17 +814,22 @@ class Database:
     
     @staticmethod
     def delete_conversation(conversation_id: int, user_id: str):
-        conn = Database.get_connection()
+        conn = Database.get_connection(user_id)
         cursor = conn.cursor()
         cursor.execute("DELETE FROM conversations WHERE id = ? AND user_id = ?", (conversation_id, user_id))
+        if cursor.rowcount:
+            cursor.execute("DELETE FROM conversation_archive WHERE conversation_id = ?", (conversation_id,))
         conn.commit()
         conn.close()
     
     # Message operations
     @staticmethod
-    def add_message(conversation_id: int, role: str, content: str, intent: Optional[str] = None):
-        conn = Database.get_connection()
+    def add_message(conversation_id: int, role: str, content: str, intent: Optional[str] = None, *,
+                    user_id: str):
+        """user_id, the conversation's owner, picks the shard; callers must have checked ownership"""
+        conn = Database.get_connection(user_id)
         cursor = conn.cursor()
+        ColdStorageDatabase.thaw_if_frozen(cursor, conversation_id)
         cursor.execute(
             "INSERT INTO messages (conversation_id, role, content, intent) VALUES (?, ?, ?, ?)",
             (conversation_id, role, content, intent)
@@ -280,16 +848,22 @@ class Database:
     
     @staticmethod
     def get_conversation_messages(conversation_id: int, user_id: str, limit: Optional[int] = None) -> List[Dict]:
-        conn = Database.get_connection()
+        conn = Database.get_connection(user_id)
         cursor = conn.cursor()
         
         # Verify user owns this conversation
-        cursor.execute("SELECT user_id FROM conversations WHERE id = ?", (conversation_id,))
+        cursor.execute("SELECT user_id, is_frozen FROM conversations WHERE id = ?", (conversation_id,))
         row = cursor.fetchone()
         if not row or row[0] != user_id:
             conn.close()
             return []
         
+        if row[1]:
+            # Served straight from the archive blob; the conversation stays frozen until written to
+            messages = ColdStorageDatabase.load_frozen_messages(cursor, conversation_id)
+            conn.close()
+            return messages[:limit] if limit else messages
+        
         query = """
             SELECT id, role, content, intent, created_at 
             FROM messages 
@@ -300,30 +874,48 @@ class Database:
         if limit:
             query += f" LIMIT {limit}"
         
+        cursor.row_factory = message_row
         cursor.execute(query, (conversation_id,))
-        rows = cursor.fetchall()
+        messages = cursor.fetchall()
         conn.close()
+        return messages
+    
+    @staticmethod
+    def get_recent_messages(conversation_id: int, limit: int, user_id: str) -> List[Dict]:
+        """Last `limit` messages, oldest first. Callers must have checked ownership."""
+        conn = Database.get_connection(user_id)
+        cursor = conn.cursor()
+        cursor.execute("SELECT is_frozen FROM conversations WHERE id = ?", (conversation_id,))
+        row = cursor.fetchone()
         
-        return [
-            {
-                "id": row[0],
-                "role": row[1],
-                "content": row[2],
-                "intent": row[3],
-                "created_at": row[4]
-            }
-            for row in rows
-        ]
+        if row and row[0]:
+            messages = ColdStorageDatabase.load_frozen_messages(cursor, conversation_id)[-limit:]
+            conn.close()
+            return messages
+        
+        cursor.row_factory = message_row
+        cursor.execute("""
+            SELECT id, role, content, intent, created_at
+            FROM messages
+            WHERE conversation_id = ?
+            ORDER BY created_at DESC, id DESC
+            LIMIT ?
+        """, (conversation_id, limit))
+        messages = cursor.fetchall()
+        conn.close()
+        messages.reverse()
+        return messages
     
     @staticmethod
     def delete_message(message_id: int, conversation_id: int, user_id: str):
-        conn = Database.get_connection()
+        conn = Database.get_connection(user_id)
         cursor = conn.cursor()
         
         # Verify user owns this conversation
         cursor.execute("SELECT user_id FROM conversations WHERE id = ?", (conversation_id,))
         row = cursor.fetchone()
         if row and row[0] == user_id:
+            ColdStorageDatabase.thaw_if_frozen(cursor, conversation_id)
             cursor.execute("DELETE FROM messages WHERE id = ? AND conversation_id = ?", (message_id, conversation_id))
             conn.commit()
         
@@ -331,7 +923,7 @@ class Database:
     
     @staticmethod
     def search_messages(user_id: str, search_query: str) -> List[Dict]:
-        conn = Database.get_connection()
+        conn = Database.get_connection(user_id)
         cursor = conn.cursor()
         
         query = """
@@ -343,21 +935,11 @@ class Database:
             LIMIT 50
         """
         
+        cursor.row_factory = search_result_row
         cursor.execute(query, (user_id, f"%{search_query}%"))
-        rows = cursor.fetchall()
+        results = cursor.fetchall()
         conn.close()
-        
-        return [
-            {
-                "id": row[0],
-                "content": row[1],
-                "role": row[2],
-                "created_at": row[3],
-                "conversation_title": row[4],
-                "conversation_id": row[5]
-            }
-            for row in rows
-        ]
+        return results
 
 # Initialize database on module import
 init_db()
@@ -367,7 +949,7 @@ init_db()
 class MoodDatabase:
     @staticmethod
     def add_mood_entry(user_id: str, mood_level: int, mood_emoji: str, notes: Optional[str] = None):
-        conn = Database.get_connection()
+        conn = Database.get_connection(user_id)
         cursor = conn.cursor()
         cursor.execute(
             "INSERT INTO mood_entries (user_id, mood_level, mood_emoji, notes) VALUES (?, ?, ?, ?)",
@@ -380,7 +962,7 @@ class MoodDatabase:
     
     @staticmethod
     def get_user_moods(user_id: str, days: int = 30) -> List[Dict]:
-        conn = Database.get_connection()
+        conn = Database.get_connection(user_id)
         cursor = conn.cursor()
         
         query = """
@@ -390,24 +972,15 @@ class MoodDatabase:
             ORDER BY created_at DESC
         """
         
+        cursor.row_factory = mood_row
         cursor.execute(query, (user_id, days))
-        rows = cursor.fetchall()
+        moods = cursor.fetchall()
         conn.close()
-        
-        return [
-            {
-                "id": row[0],
-                "mood_level": row[1],
-                "mood_emoji": row[2],
-                "notes": row[3],
-                "created_at": row[4]
-            }
-            for row in rows
-        ]
+        return moods
     
     @staticmethod
     def get_mood_analytics(user_id: str, days: int = 30) -> Dict:
-        conn = Database.get_connection()
+        conn = Database.get_connection(user_id)
         cursor = conn.cursor()
         
         query = """
@@ -431,7 +1004,7 @@ class MoodDatabase:
 class JournalDatabase:
     @staticmethod
     def create_journal_entry(user_id: str, title: Optional[str], content: str, mood_level: Optional[int] = None):
-        conn = Database.get_connection()
+        conn = Database.get_connection(user_id)
         cursor = conn.cursor()
         cursor.execute(
             "INSERT INTO journal_entries (user_id, title, content, mood_level) VALUES (?, ?, ?, ?)",
@@ -444,7 +1017,7 @@ class JournalDatabase:
     
     @staticmethod
     def get_user_journals(user_id: str, limit: int = 50) -> List[Dict]:
-        conn = Database.get_connection()
+        conn = Database.get_connection(user_id)
         cursor = conn.cursor()
         
         query = """
@@ -455,25 +1028,15 @@ class JournalDatabase:
             LIMIT ?
         """
         
+        cursor.row_factory = journal_row
         cursor.execute(query, (user_id, limit))
-        rows = cursor.fetchall()
+        entries = cursor.fetchall()
         conn.close()
-        
-        return [
-            {
-                "id": row[0],
-                "title": row[1],
-                "content": row[2],
-                "mood_level": row[3],
-                "created_at": row[4],
-                "updated_at": row[5]
-            }
-            for row in rows
-        ]
+        return entries
     
     @staticmethod
     def update_journal_entry(entry_id: int, user_id: str, title: Optional[str], content: str, mood_level: Optional[int]):
-        conn = Database.get_connection()
+        conn = Database.get_connection(user_id)
         cursor = conn.cursor()
         cursor.execute(
             """UPDATE journal_entries 
@@ -486,38 +1049,11 @@ class JournalDatabase:
     
     @staticmethod
     def delete_journal_entry(entry_id: int, user_id: str):
-        conn = Database.get_connection()
+        conn = Database.get_connection(user_id)
         cursor = conn.cursor()
         cursor.execute("DELETE FROM journal_entries WHERE id = ? AND user_id = ?", (entry_id, user_id))
         conn.commit()
         conn.close()
-        conn = Database.get_connection()
-        cursor = conn.cursor()
-        
-        query = """
-            SELECT m.id, m.conversation_id, m.role, m.content, m.created_at, c.title
-            FROM messages m
-            JOIN conversations c ON m.conversation_id = c.id
-            WHERE c.user_id = ? AND m.content LIKE ?
-            ORDER BY m.created_at DESC
-            LIMIT 50
-        """
-        
-        cursor.execute(query, (user_id, f"%{search_query}%"))
-        rows = cursor.fetchall()
-        conn.close()
-        
-        return [
-            {
-                "id": row[0],
-                "conversation_id": row[1],
-                "role": row[2],
-                "content": row[3],
-                "created_at": row[4],
-                "conversation_title": row[5]
-            }
-            for row in rows
-        ]
 
 class GoalsDatabase:
     """Database operations for mental health goals"""
@@ -526,7 +1062,7 @@ class GoalsDatabase:
     def create_goal(user_id: str, title: str, description: str, category: str, 
                    target_value: int, unit: str, target_date: str) -> int:
         """Create a new goal"""
-        conn = Database.get_connection()
+        conn = Database.get_connection(user_id)
         cursor = conn.cursor()
         
         cursor.execute("""
@@ -542,13 +1078,16 @@ class GoalsDatabase:
     @staticmethod
     def get_user_goals(user_id: str, status: str = None) -> List[Dict]:
         """Get all goals for a user, optionally filtered by status"""
-        conn = Database.get_connection()
+        conn = Database.get_connection(user_id)
         cursor = conn.cursor()
+        cursor.row_factory = goal_row
         
         if status:
             cursor.execute("""
                 SELECT id, title, description, category, target_value, current_value, unit, 
-                       start_date, target_date, status, created_at, updated_at, completed_at
+                       start_date, target_date, status, created_at, updated_at, completed_at,
+                       ROUND(CASE WHEN target_value > 0 THEN current_value * 100.0 / target_value ELSE 0 END, 1)
+                           as progress_percentage
                 FROM goals
                 WHERE user_id = ? AND status = ?
                 ORDER BY created_at DESC
@@ -556,67 +1095,68 @@ class GoalsDatabase:
         else:
             cursor.execute("""
                 SELECT id, title, description, category, target_value, current_value, unit, 
-                       start_date, target_date, status, created_at, updated_at, completed_at
+                       start_date, target_date, status, created_at, updated_at, completed_at,
+                       ROUND(CASE WHEN target_value > 0 THEN current_value * 100.0 / target_value ELSE 0 END, 1)
+                           as progress_percentage
                 FROM goals
                 WHERE user_id = ?
                 ORDER BY created_at DESC
             """, (user_id,))
         
-        rows = cursor.fetchall()
+        goals = cursor.fetchall()
         conn.close()
-        
-        return [
-            {
-                "id": row[0],
-                "title": row[1],
-                "description": row[2],
-                "category": row[3],
-                "target_value": row[4],
-                "current_value": row[5],
-                "unit": row[6],
-                "start_date": row[7],
-                "target_date": row[8],
-                "status": row[9],
-                "created_at": row[10],
-                "updated_at": row[11],
-                "completed_at": row[12],
-                "progress_percentage": round((row[5] / row[4] * 100) if row[4] > 0 else 0, 1)
-            }
-            for row in rows
-        ]
+        return goals
     
     @staticmethod
-    def update_goal_progress(goal_id: int, user_id: str, current_value: int):
-        """Update the progress of a goal"""
-        conn = Database.get_connection()
+    def update_goal_progress(goal_id: int, user_id: str, current_value: int) -> bool:
+        """Set a goal's progress; False if the user has no such goal.
+
+        The completion check happens in the same UPDATE, so concurrent updates
+        cannot interleave with it. Triggers append the change to
+        goal_progress_events and adjust goal_stats.
+        """
+        conn = Database.get_connection(user_id)
         cursor = conn.cursor()
-        
-        # Get target value to check if goal is completed
-        cursor.execute("SELECT target_value FROM goals WHERE id = ? AND user_id = ?", (goal_id, user_id))
-        result = cursor.fetchone()
-        
-        if not result:
-            conn.close()
-            return
-        
-        target_value = result[0]
-        status = 'completed' if current_value >= target_value else 'active'
-        completed_at = datetime.now().isoformat() if status == 'completed' else None
-        
         cursor.execute("""
-            UPDATE goals 
-            SET current_value = ?, status = ?, updated_at = CURRENT_TIMESTAMP, completed_at = ?
-            WHERE id = ? AND user_id = ?
-        """, (current_value, status, completed_at, goal_id, user_id))
-        
+            UPDATE goals
+            SET current_value = ?1,
+                status = CASE WHEN ?1 >= target_value THEN 'completed' ELSE 'active' END,
+                completed_at = CASE WHEN ?1 >= target_value THEN ?2 END,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?3 AND user_id = ?4
+        """, (current_value, datetime.now().isoformat(), goal_id, user_id))
+        updated = cursor.rowcount > 0
         conn.commit()
         conn.close()
+        return updated
+    
+    @staticmethod
+    def get_goal_progress_history(goal_id: int, user_id: str) -> Optional[List[Dict]]:
+        """Every recorded progress value of a goal, oldest first; None if the user has no such goal"""
+        conn = Database.get_connection(user_id)
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1 FROM goals WHERE id = ? AND user_id = ?", (goal_id, user_id))
+        if cursor.fetchone() is None:
+            conn.close()
+            return None
+        cursor.execute("""
+            SELECT previous_value, current_value, recorded_at
+            FROM goal_progress_events
+            WHERE goal_id = ?
+            ORDER BY id
+        """, (goal_id,))
+        history = [
+            {"previous_value": row[0], "current_value": row[1], "recorded_at": row[2]}
+            for row in cursor.fetchall()
+        ]
+        conn.close()
+        return history
     
     @staticmethod
     def update_goal(goal_id: int, user_id: str, title: str = None, description: str = None,
                    target_value: int = None, target_date: str = None):
         """Update goal details"""
-        conn = Database.get_connection()
+        conn = Database.get_connection(user_id)
         cursor = conn.cursor()
         
         updates = []
@@ -648,7 +1188,7 @@ class GoalsDatabase:
     @staticmethod
     def delete_goal(goal_id: int, user_id: str):
         """Delete a goal"""
-        conn = Database.get_connection()
+        conn = Database.get_connection(user_id)
         cursor = conn.cursor()
         cursor.execute("DELETE FROM goals WHERE id = ? AND user_id = ?", (goal_id, user_id))
         conn.commit()
@@ -656,29 +1196,1205 @@ class GoalsDatabase:
     
     @staticmethod
     def get_goal_statistics(user_id: str) -> Dict:
-        """Get goal completion statistics"""
-        conn = Database.get_connection()
+        """Get goal completion statistics from the counters in goal_stats"""
+        conn = Database.get_connection(user_id)
         cursor = conn.cursor()
-        
         cursor.execute("""
-            SELECT 
-                COUNT(*) as total_goals,
-                SUM(CASE WHEN status = 'completed' THEN 1 ELSE 0 END) as completed_goals,
-                SUM(CASE WHEN status = 'active' THEN 1 ELSE 0 END) as active_goals,
-                AVG(CASE WHEN status = 'active' THEN (current_value * 1.0 / target_value * 100) ELSE NULL END) as avg_progress
-            FROM goals
+            SELECT total_goals, completed_goals, active_goals, progress_sum, progress_count
+            FROM goal_stats
             WHERE user_id = ?
         """, (user_id,))
-        
-        row = cursor.fetchone()
+        row = cursor.fetchone() or (0, 0, 0, 0, 0)
         conn.close()
         
         return {
-            "total_goals": row[0] or 0,
-            "completed_goals": row[1] or 0,
-            "active_goals": row[2] or 0,
-            "avg_progress": round(row[3], 1) if row[3] else 0
+            "total_goals": row[0],
+            "completed_goals": row[1],
+            "active_goals": row[2],
+            "avg_progress": round(row[3] / row[4], 1) if row[4] else 0
         }
 
-# Initialize database on import
-init_db()
+
+class AccountPurgeDatabase:
+    """Database operations for the chunked account purge job"""
+    
+    # (table, statement deleting at most one batch of the user's rows)
+    PURGE_STEPS = [
+        ("conversation_archive", """
+            DELETE FROM conversation_archive WHERE conversation_id IN (
+                SELECT a.conversation_id FROM conversations c
+                JOIN conversation_archive a ON a.conversation_id = c.id
+                WHERE c.user_id = ? LIMIT ?
+            )
+        """),
+        ("messages", """
+            DELETE FROM messages WHERE id IN (
+                SELECT m.id FROM conversations c
+                JOIN messages m ON m.conversation_id = c.id
+                WHERE c.user_id = ? LIMIT ?
+            )
+        """),
+        ("conversations", "DELETE FROM conversations WHERE id IN (SELECT id FROM conversations WHERE user_id = ? LIMIT ?)"),
+        ("mood_entries", "DELETE FROM mood_entries WHERE id IN (SELECT id FROM mood_entries WHERE user_id = ? LIMIT ?)"),
+        ("journal_entries", "DELETE FROM journal_entries WHERE id IN (SELECT id FROM journal_entries WHERE user_id = ? LIMIT ?)"),
+        ("goals", "DELETE FROM goals WHERE id IN (SELECT id FROM goals WHERE user_id = ? LIMIT ?)"),
+        # Emptied by the goals deletes above; only the zeroed row is left
+        ("goal_stats", "DELETE FROM goal_stats WHERE user_id IN (SELECT user_id FROM goal_stats WHERE user_id = ? LIMIT ?)"),
+        # After journal_entries: its deletes queue one change each
+        ("journal_insight_changes", """
+            DELETE FROM journal_insight_changes WHERE id IN (SELECT id FROM journal_insight_changes WHERE user_id = ? LIMIT ?)
+        """),
+        ("journal_insights", "DELETE FROM journal_insights WHERE user_id IN (SELECT user_id FROM journal_insights WHERE user_id = ? LIMIT ?)"),
+        ("sync_operations", """
+            DELETE FROM sync_operations WHERE (user_id, op_id) IN (
+                SELECT user_id, op_id FROM sync_operations WHERE user_id = ? LIMIT ?
+            )
+        """),
+        ("embeddings", """
+            DELETE FROM embeddings WHERE (kind, item_id) IN (
+                SELECT kind, item_id FROM embeddings WHERE user_id = ? LIMIT ?
+            )
+        """),
+        # Last: the deletes above bump these counters
+        ("resource_versions", """
+            DELETE FROM resource_versions WHERE (user_id, resource) IN (
+                SELECT user_id, resource FROM resource_versions WHERE user_id = ? LIMIT ?
+            )
+        """),
+    ]
+    
+    @staticmethod
+    def request_purge(user_id: str):
+        """Mark the user deleted and queue their data for purging"""
+        conn = Database.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("UPDATE users SET deleted_at = ? WHERE id = ? AND deleted_at IS NULL", (datetime.utcnow(), user_id))
+        cursor.execute("""
+            INSERT INTO account_purge_jobs (user_id, status) VALUES (?, 'pending')
+            ON CONFLICT(user_id) DO UPDATE SET status = 'pending', finished_at = NULL, updated_at = CURRENT_TIMESTAMP
+        """, (user_id,))
+        conn.commit()
+        conn.close()
+    
+    @staticmethod
+    def delete_batch(user_id: str, table: str, statement: str, batch_size: int) -> int:
+        """Delete one batch in its own short transaction and record progress"""
+        conn = Database.get_connection(user_id)
+        cursor = conn.cursor()
+        cursor.execute(statement, (user_id, batch_size))
+        deleted = cursor.rowcount
+        if database_path(user_id) != database_path():
+            # Sharded: the job row is in the directory, the user's rows in their shard
+            conn.commit()
+            conn.close()
+            conn = Database.get_connection()
+            cursor = conn.cursor()
+        cursor.execute("""
+            UPDATE account_purge_jobs
+            SET status = 'running', current_table = ?, rows_deleted = rows_deleted + ?, updated_at = CURRENT_TIMESTAMP
+            WHERE user_id = ?
+        """, (table, deleted, user_id))
+        conn.commit()
+        conn.close()
+        return deleted
+    
+    @staticmethod
+    def finish_purge(user_id: str):
+        """Remove the user row itself once all their data is gone"""
+        conn = Database.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM users WHERE id = ? AND deleted_at IS NOT NULL", (user_id,))
+        cursor.execute("""
+            UPDATE account_purge_jobs
+            SET status = 'completed', current_table = NULL, rows_deleted = rows_deleted + ?,
+                updated_at = CURRENT_TIMESTAMP, finished_at = CURRENT_TIMESTAMP
+            WHERE user_id = ?
+        """, (cursor.rowcount, user_id))
+        conn.commit()
+        conn.close()
+    
+    @staticmethod
+    def mark_failed(user_id: str):
+        conn = Database.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE account_purge_jobs SET status = 'failed', updated_at = CURRENT_TIMESTAMP WHERE user_id = ?",
+            (user_id,)
+        )
+        conn.commit()
+        conn.close()
+    
+    @staticmethod
+    def get_purge_status(user_id: str) -> Optional[Dict]:
+        conn = Database.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT status, current_table, rows_deleted, requested_at, updated_at, finished_at
+            FROM account_purge_jobs WHERE user_id = ?
+        """, (user_id,))
+        row = cursor.fetchone()
+        conn.close()
+        
+        if row:
+            return {
+                "status": row[0],
+                "current_table": row[1],
+                "rows_deleted": row[2],
+                "requested_at": row[3],
+                "updated_at": row[4],
+                "finished_at": row[5]
+            }
+        return None
+    
+    @staticmethod
+    def get_unfinished_purges(statuses: tuple = ("pending", "running", "failed")) -> List[str]:
+        """User ids whose purge was interrupted, e.g. by a restart, or failed"""
+        conn = Database.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            f"SELECT user_id FROM account_purge_jobs WHERE status IN ({', '.join('?' for _ in statuses)})",
+            statuses
+        )
+        rows = cursor.fetchall()
+        conn.close()
+        return [row[0] for row in rows]
+    
+    @staticmethod
+    def incremental_vacuum(max_pages: int, user_id: Optional[str] = None) -> int:
+        """Return up to max_pages free pages to the OS; returns pages still free.
+        
+        With user_id, vacuums the file holding that user's rows.
+        """
+        conn = Database.get_connection(user_id)
+        cursor = conn.cursor()
+        # Each step of this pragma frees one page; executescript steps it to completion
+        cursor.executescript(f"PRAGMA incremental_vacuum({int(max_pages)})")
+        cursor.execute("PRAGMA freelist_count")
+        remaining = cursor.fetchone()[0]
+        conn.close()
+        return remaining
+
+
+class SyncDatabase:
+    """Applies a batch of queued offline writes in a single transaction"""
+    
+    # kind -> (table, statement). Creates take (id, user_id, *values); updates and
+    # deletes take (*values, id, user_id).
+    STATEMENTS = {
+        "mood.create": ("mood_entries", """
+            INSERT INTO mood_entries (id, user_id, mood_level, mood_emoji, notes, created_at)
+            VALUES (?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+        """),
+        "journal.create": ("journal_entries", """
+            INSERT INTO journal_entries (id, user_id, title, content, mood_level, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP), COALESCE(?, CURRENT_TIMESTAMP))
+        """),
+        "journal.update": ("journal_entries", """
+            UPDATE journal_entries SET title = ?, content = ?, mood_level = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND user_id = ?
+        """),
+        "journal.delete": ("journal_entries", "DELETE FROM journal_entries WHERE id = ? AND user_id = ?"),
+        "goal.create": ("goals", """
+            INSERT INTO goals (id, user_id, title, description, category, target_value, unit, start_date, target_date, status)
+            VALUES (?, ?, ?, ?, ?, ?, ?, DATE('now'), ?, 'active')
+        """),
+        # Same completion rule as GoalsDatabase.update_goal_progress, decided in SQL
+        "goal.progress": ("goals", """
+            UPDATE goals
+            SET current_value = ?1,
+                status = CASE WHEN ?1 >= target_value THEN 'completed' ELSE 'active' END,
+                completed_at = CASE WHEN ?1 >= target_value THEN ?2 END,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?3 AND user_id = ?4
+        """),
+        "goal.delete": ("goals", "DELETE FROM goals WHERE id = ? AND user_id = ?"),
+    }
+    
+    LEDGER_DAYS = 30
+    
+    @staticmethod
+    def apply_operations(user_id: str, operations: List[Dict]) -> List[Dict]:
+        """Apply validated operations in order; returns one result per operation.
+        
+        Each operation is {"op_id", "type", "values", "id" or "ref"} as built by
+        offline_sync. Operations already in the ledger are answered from it instead
+        of being applied twice. The whole batch is planned in Python (ids for
+        creates, ownership for updates), then consecutive operations of the same
+        type go to the database through one executemany.
+        """
+        conn = Database.get_connection(user_id)
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            
+            # Earlier results for retried operations and for refs to creates from earlier batches
+            keys = list({op["op_id"] for op in operations} | {op["ref"] for op in operations if op.get("ref")})
+            ledger = {}
+            if keys:
+                cursor.execute(
+                    f"SELECT op_id, kind, status, result_id FROM sync_operations WHERE user_id = ? AND op_id IN ({','.join('?' * len(keys))})",
+                    (user_id, *keys)
+                )
+                ledger = {row[0]: {"type": row[1], "status": row[2], "id": row[3]} for row in cursor.fetchall()}
+            
+            def target_of(op: Dict) -> Optional[int]:
+                """Row an update/delete applies to: an explicit id, or the row created by the `ref` operation"""
+                if op.get("id") is not None:
+                    return op["id"]
+                created = ledger.get(op.get("ref"))
+                if (created and created["status"] == "applied" and created["type"].endswith(".create")
+                        and SyncDatabase.STATEMENTS[created["type"]][0] == SyncDatabase.STATEMENTS[op["type"]][0]):
+                    return created["id"]
+                return None
+            
+            # Which existing rows the updates and deletes may touch
+            wanted = {}
+            for op in operations:
+                table = SyncDatabase.STATEMENTS[op["type"]][0]
+                target = target_of(op)
+                if target is not None:
+                    wanted.setdefault(table, set()).add(target)
+            owned = {}
+            for table, ids in wanted.items():
+                cursor.execute(
+                    f"SELECT id FROM {table} WHERE user_id = ? AND id IN ({','.join('?' * len(ids))})",
+                    (user_id, *ids)
+                )
+                owned[table] = {row[0] for row in cursor.fetchall()}
+            
+            next_ids = {}
+            runs = []
+            results = []
+            ledger_rows = []
+            for op in operations:
+                op_id, kind = op["op_id"], op["type"]
+                if op_id in ledger:
+                    results.append({"op_id": op_id, **ledger[op_id], "replayed": True})
+                    continue
+                table, _ = SyncDatabase.STATEMENTS[kind]
+                
+                if kind.endswith(".create"):
+                    if table not in next_ids:
+                        # Ids are assigned up front so inserts can be batched; the write
+                        # lock taken above means nobody else can claim them meanwhile
+                        cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,))
+                        row = cursor.fetchone()
+                        next_ids[table] = row[0] if row else 0
+                    next_ids[table] += 1
+                    target = next_ids[table]
+                    owned.setdefault(table, set()).add(target)
+                    params = (target, user_id, *op["values"])
+                else:
+                    target = target_of(op)
+                    if target not in owned.get(table, ()):
+                        ledger[op_id] = {"type": kind, "status": "not_found", "id": target}
+                        ledger_rows.append((user_id, op_id, kind, "not_found", target))
+                        results.append({"op_id": op_id, **ledger[op_id]})
+                        continue
+                    if kind.endswith(".delete"):
+                        owned[table].discard(target)
+                    params = (*op["values"], target, user_id)
+                
+                if runs and runs[-1][0] == kind:
+                    runs[-1][1].append(params)
+                else:
+                    runs.append((kind, [params]))
+                ledger[op_id] = {"type": kind, "status": "applied", "id": target}
+                ledger_rows.append((user_id, op_id, kind, "applied", target))
+                results.append({"op_id": op_id, **ledger[op_id]})
+            
+            for kind, rows in runs:
+                cursor.executemany(SyncDatabase.STATEMENTS[kind][1], rows)
+            cursor.executemany(
+                "INSERT INTO sync_operations (user_id, op_id, kind, status, result_id) VALUES (?, ?, ?, ?, ?)",
+                ledger_rows
+            )
+            # Clients only retry recent batches; keep the ledger from growing without bound
+            cursor.execute(
+                "DELETE FROM sync_operations WHERE user_id = ? AND created_at < datetime('now', ?)",
+                (user_id, f"-{SyncDatabase.LEDGER_DAYS} days")
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        return results
+
+
+class EmbeddingDatabase:
+    """Stored sentence vectors behind semantic search"""
+    
+    @staticmethod
+    def get_pending(user_id: str, model_key: str, limit: int) -> List[tuple]:
+        """Messages and journal entries with no vector from this model yet.
+        
+        Returns (kind, item_id, conversation_id, text) tuples.
+        """
+        conn = Database.get_connection(user_id)
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT 'message', m.id, m.conversation_id, m.content
+            FROM conversations c
+            JOIN messages m ON m.conversation_id = c.id
+            LEFT JOIN embeddings e ON e.kind = 'message' AND e.item_id = m.id AND e.model_key = ?
+            WHERE c.user_id = ? AND e.item_id IS NULL
+            LIMIT ?
+        """, (model_key, user_id, limit))
+        pending = cursor.fetchall()
+        if len(pending) < limit:
+            cursor.execute("""
+                SELECT 'journal', j.id, NULL, COALESCE(j.title || '. ', '') || j.content
+                FROM journal_entries j
+                LEFT JOIN embeddings e ON e.kind = 'journal' AND e.item_id = j.id AND e.model_key = ?
+                WHERE j.user_id = ? AND e.item_id IS NULL
+                LIMIT ?
+            """, (model_key, user_id, limit - len(pending)))
+            pending += cursor.fetchall()
+        conn.close()
+        return pending
+    
+    @staticmethod
+    def save_vectors(user_id: str, model_key: str, rows: List[tuple]):
+        """rows: (kind, item_id, conversation_id, vector bytes)"""
+        conn = Database.get_connection(user_id)
+        cursor = conn.cursor()
+        cursor.executemany("""
+            INSERT OR REPLACE INTO embeddings (kind, item_id, user_id, conversation_id, model_key, vector)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, [(kind, item_id, user_id, conversation_id, model_key, vector)
+              for kind, item_id, conversation_id, vector in rows])
+        conn.commit()
+        conn.close()
+    
+    @staticmethod
+    def delete_orphans(user_id: str) -> int:
+        """Drop vectors whose message or journal entry is gone; frozen conversations keep theirs"""
+        conn = Database.get_connection(user_id)
+        cursor = conn.cursor()
+        cursor.execute("""
+            DELETE FROM embeddings
+            WHERE user_id = ? AND kind = 'message'
+              AND NOT EXISTS (SELECT 1 FROM messages m WHERE m.id = embeddings.item_id)
+              AND NOT EXISTS (SELECT 1 FROM conversations c WHERE c.id = embeddings.conversation_id AND c.is_frozen = 1)
+        """, (user_id,))
+        deleted = cursor.rowcount
+        cursor.execute("""
+            DELETE FROM embeddings
+            WHERE user_id = ? AND kind = 'journal'
+              AND NOT EXISTS (SELECT 1 FROM journal_entries j WHERE j.id = embeddings.item_id)
+        """, (user_id,))
+        deleted += cursor.rowcount
+        conn.commit()
+        conn.close()
+        return deleted
+    
+    @staticmethod
+    def get_vectors(user_id: str, model_key: str) -> List[tuple]:
+        """(kind, item_id, conversation_id, vector bytes) for all of the user's current vectors"""
+        conn = Database.get_connection(user_id)
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT kind, item_id, conversation_id, vector FROM embeddings WHERE user_id = ? AND model_key = ?",
+            (user_id, model_key)
+        )
+        rows = cursor.fetchall()
+        conn.close()
+        return rows
+    
+    @staticmethod
+    def get_search_items(user_id: str, messages: List[tuple], journal_ids: List[int]) -> Dict[tuple, Dict]:
+        """Display records for search hits keyed by (kind, id); messages are (id, conversation_id) pairs"""
+        conn = Database.get_connection(user_id)
+        cursor = conn.cursor()
+        items = {}
+        
+        if messages:
+            ids = [message_id for message_id, _ in messages]
+            cursor.execute(f"""
+                SELECT m.id, m.content, m.role, m.created_at, c.title, c.id
+                FROM messages m
+                JOIN conversations c ON m.conversation_id = c.id
+                WHERE m.id IN ({','.join('?' * len(ids))}) AND c.user_id = ?
+            """, (*ids, user_id))
+            for row in cursor.fetchall():
+                items[("message", row[0])] = {"kind": "message", **search_result_row(cursor, row)}
+            
+            # Hits in frozen conversations are read back from their archive blobs
+            missing = {conversation_id for message_id, conversation_id in messages if ("message", message_id) not in items}
+            for conversation_id in missing:
+                cursor.execute(
+                    "SELECT title FROM conversations WHERE id = ? AND user_id = ? AND is_frozen = 1",
+                    (conversation_id, user_id)
+                )
+                row = cursor.fetchone()
+                if not row:
+                    continue
+                for message in ColdStorageDatabase.load_frozen_messages(cursor, conversation_id):
+                    items[("message", message["id"])] = {
+                        "kind": "message",
+                        "id": message["id"],
+                        "content": message["content"],
+                        "role": message["role"],
+                        "created_at": message["created_at"],
+                        "conversation_title": row[0],
+                        "conversation_id": conversation_id
+                    }
+        
+        if journal_ids:
+            cursor.execute(f"""
+                SELECT id, title, content, mood_level, created_at, updated_at
+                FROM journal_entries
+                WHERE id IN ({','.join('?' * len(journal_ids))}) AND user_id = ?
+            """, (*journal_ids, user_id))
+            for row in cursor.fetchall():
+                items[("journal", row[0])] = {"kind": "journal", **journal_row(cursor, row)}
+        
+        conn.close()
+        return items
+
+
+class BackfillDatabase:
+    """Chunked, resumable passes over the messages table"""
+    
+    @staticmethod
+    def get_checkpoint(job: str) -> Optional[Dict]:
+        conn = Database.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT model_key, last_id, processed, updated_at FROM backfill_checkpoints WHERE job = ?",
+            (job,)
+        )
+        row = cursor.fetchone()
+        conn.close()
+        if not row:
+            return None
+        return {"model_key": row[0], "last_id": row[1], "processed": row[2], "updated_at": row[3]}
+    
+    @staticmethod
+    def get_message_chunk(after_id: int, limit: int) -> List[tuple]:
+        """Up to `limit` hot messages with id > after_id, in id order: (id, conversation_id, role, content, intent).
+        
+        Messages of frozen conversations live in conversation_archive and are not included.
+        """
+        conn = Database.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT id, conversation_id, role, content, intent FROM messages WHERE id > ? ORDER BY id LIMIT ?",
+            (after_id, limit)
+        )
+        rows = cursor.fetchall()
+        conn.close()
+        return rows
+    
+    @staticmethod
+    def get_prompting_messages(replies: List[tuple]) -> Dict[int, str]:
+        """For (assistant message id, conversation_id) pairs, the user message each one answered"""
+        conn = Database.get_connection()
+        cursor = conn.cursor()
+        prompts = {}
+        for message_id, conversation_id in replies:
+            cursor.execute("""
+                SELECT content FROM messages
+                WHERE conversation_id = ? AND role = 'user' AND id < ?
+                ORDER BY created_at DESC
+                LIMIT 1
+            """, (conversation_id, message_id))
+            row = cursor.fetchone()
+            if row:
+                prompts[message_id] = row[0]
+        conn.close()
+        return prompts
+    
+    @staticmethod
+    def save_intents(job: str, model_key: str, updates: List[tuple], last_id: int, processed: int):
+        """Write (intent, message_id) pairs and advance the checkpoint in one transaction"""
+        conn = Database.get_connection()
+        cursor = conn.cursor()
+        # Unchanged rows are skipped so they do not fire the version triggers
+        cursor.executemany("UPDATE messages SET intent = ? WHERE id = ? AND intent IS NOT ?",
+                           [(intent, message_id, intent) for intent, message_id in updates])
+        cursor.execute("""
+            INSERT INTO backfill_checkpoints (job, model_key, last_id, processed, updated_at)
+            VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(job) DO UPDATE SET
+                model_key = excluded.model_key,
+                last_id = excluded.last_id,
+                processed = excluded.processed,
+                updated_at = excluded.updated_at
+        """, (job, model_key, last_id, processed))
+        conn.commit()
+        conn.close()
+
+
+class JournalInsightsDatabase:
+    """Storage for the incremental journal insights index (see journal_insights.py)"""
+    
+    STATE_COLUMNS = ("last_change_id", "entry_count", "word_count", "terms", "term_counts",
+                     "slot_entries", "slot_mood_sum", "slot_mood_count")
+    
+    @staticmethod
+    def get_state(user_id: str) -> Optional[Dict]:
+        conn = Database.get_connection(user_id)
+        cursor = conn.cursor()
+        cursor.execute(
+            f"SELECT {', '.join(JournalInsightsDatabase.STATE_COLUMNS)}, updated_at FROM journal_insights WHERE user_id = ?",
+            (user_id,)
+        )
+        row = cursor.fetchone()
+        conn.close()
+        if not row:
+            return None
+        return dict(zip(JournalInsightsDatabase.STATE_COLUMNS + ("updated_at",), row))
+    
+    @staticmethod
+    def get_changes(user_id: str, after_id: int, limit: int) -> List[tuple]:
+        """Queued (id, sign, text, mood_level, weekday, hour) changes after `after_id`, oldest first"""
+        conn = Database.get_connection(user_id)
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT id, sign, text, mood_level, weekday, hour
+            FROM journal_insight_changes
+            WHERE user_id = ? AND id > ?
+            ORDER BY id
+            LIMIT ?
+        """, (user_id, after_id, limit))
+        rows = cursor.fetchall()
+        conn.close()
+        return rows
+    
+    @staticmethod
+    def get_next_queued_user(after_user_id: str) -> Optional[str]:
+        """The first user after after_user_id, in id order, with queued changes in the current file"""
+        conn = Database.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT user_id FROM journal_insight_changes WHERE user_id > ? ORDER BY user_id LIMIT 1",
+            (after_user_id,)
+        )
+        row = cursor.fetchone()
+        conn.close()
+        return row[0] if row else None
+    
+    @staticmethod
+    def save_state(user_id: str, expected_change_id: int, state: Dict) -> bool:
+        """Store the folded state and drop the changes it includes, in one transaction.
+        
+        Only succeeds if the stored state still ends at `expected_change_id`, so two
+        concurrent refreshes can never fold the same change twice; False otherwise.
+        """
+        columns = JournalInsightsDatabase.STATE_COLUMNS
+        conn = Database.get_connection(user_id)
+        cursor = conn.cursor()
+        values = [state[column] for column in columns]
+        if expected_change_id == 0:
+            cursor.execute(f"""
+                INSERT INTO journal_insights (user_id, {', '.join(columns)})
+                VALUES (?, {', '.join('?' for _ in columns)})
+                ON CONFLICT(user_id) DO NOTHING
+            """, (user_id, *values))
+        else:
+            cursor.execute(f"""
+                UPDATE journal_insights
+                SET {', '.join(f'{column} = ?' for column in columns)}, updated_at = CURRENT_TIMESTAMP
+                WHERE user_id = ? AND last_change_id = ?
+            """, (*values, user_id, expected_change_id))
+        saved = cursor.rowcount > 0
+        if saved:
+            cursor.execute(
+                "DELETE FROM journal_insight_changes WHERE user_id = ? AND id <= ?",
+                (user_id, state["last_change_id"])
+            )
+        conn.commit()
+        conn.close()
+        return saved
+
+
+class CorrelationDatabase:
+    """Bulk reads of one user's time-stamped signals since a given time, for correlations.py"""
+    
+    @staticmethod
+    def get_moods(user_id: str, since: str) -> List[tuple]:
+        """(created_at, mood_level) in time order"""
+        conn = Database.get_connection(user_id)
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT created_at, mood_level FROM mood_entries
+            WHERE user_id = ? AND created_at >= ?
+            ORDER BY created_at
+        """, (user_id, since))
+        rows = cursor.fetchall()
+        conn.close()
+        return rows
+    
+    @staticmethod
+    def get_journal_times(user_id: str, since: str) -> List[str]:
+        conn = Database.get_connection(user_id)
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT created_at FROM journal_entries
+            WHERE user_id = ? AND created_at >= ?
+            ORDER BY created_at
+        """, (user_id, since))
+        rows = [row[0] for row in cursor.fetchall()]
+        conn.close()
+        return rows
+    
+    @staticmethod
+    def get_intents(user_id: str, since: str) -> List[tuple]:
+        """(created_at, intent) of classified chat turns, unordered.
+        
+        Each assistant reply carries the intent of the user message it answered
+        (see /predict), so one row per turn. Frozen conversations are in cold
+        storage and not included.
+        """
+        conn = Database.get_connection(user_id)
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT m.created_at, m.intent
+            FROM conversations c
+            JOIN messages m ON m.conversation_id = c.id
+            WHERE c.user_id = ? AND m.created_at >= ? AND m.role = 'assistant' AND m.intent IS NOT NULL
+        """, (user_id, since))
+        rows = cursor.fetchall()
+        conn.close()
+        return rows
+
+
+class MaintenanceDatabase:
+    """Housekeeping statements for db_maintenance.py, and the record of its runs"""
+    
+    CHECKPOINT_MODES = ("PASSIVE", "FULL", "RESTART", "TRUNCATE")
+    
+    @staticmethod
+    def get_file_stats() -> Dict:
+        conn = Database.get_connection()
+        cursor = conn.cursor()
+        stats = {}
+        for pragma in ("page_size", "page_count", "freelist_count", "auto_vacuum", "journal_mode"):
+            cursor.execute(f"PRAGMA {pragma}")
+            stats[pragma] = cursor.fetchone()[0]
+        conn.close()
+        wal_path = database_path() + "-wal"
+        stats["wal_bytes"] = os.path.getsize(wal_path) if os.path.exists(wal_path) else 0
+        return stats
+    
+    @staticmethod
+    def optimize(analysis_limit: int) -> List[str]:
+        """Run the ANALYZE statements PRAGMA optimize asks for; returns them"""
+        conn = Database.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f"PRAGMA analysis_limit = {int(analysis_limit)}")
+        cursor.fetchall()
+        # 0x10000 considers every table, not only those this connection queried (SQLite 3.46+);
+        # 0x01 returns the statements instead of running them
+        cursor.execute("PRAGMA optimize(0x10003)")
+        statements = [row[0] for row in cursor.fetchall()]
+        for statement in statements:
+            cursor.execute(statement)
+        conn.commit()
+        conn.close()
+        return statements
+    
+    @staticmethod
+    def analyze(analysis_limit: int):
+        """Refresh the planner statistics of every table; limit 0 reads every index in full"""
+        conn = Database.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f"PRAGMA analysis_limit = {int(analysis_limit)}")
+        cursor.fetchall()
+        cursor.execute("ANALYZE")
+        conn.commit()
+        conn.close()
+    
+    @staticmethod
+    def checkpoint(mode: str = "TRUNCATE") -> tuple:
+        """Copy the WAL back into the database file; (busy, wal pages, pages checkpointed)"""
+        if mode not in MaintenanceDatabase.CHECKPOINT_MODES:
+            raise ValueError(f"Unknown checkpoint mode: {mode}")
+        conn = Database.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f"PRAGMA wal_checkpoint({mode})")
+        busy, wal_pages, checkpointed = cursor.fetchone()
+        conn.close()
+        return busy, wal_pages, checkpointed
+    
+    @staticmethod
+    def backup(target_path: str, pages_per_step: int, pause_seconds: float, max_restarts: int) -> Dict:
+        """Online copy through the SQLite backup API, pausing between steps.
+        
+        A write by another connection restarts a stepped backup. After
+        max_restarts the copy is taken in a single step instead; in WAL mode
+        that only holds a read snapshot, so writers still go ahead.
+        """
+        source = Database.get_connection()
+        target = sqlite3.connect(target_path)
+        restarts = 0
+        last_remaining = [None]
+        
+        def progress(status, remaining, total):
+            nonlocal restarts
+            if last_remaining[0] is not None and remaining > last_remaining[0]:
+                restarts += 1
+                if restarts > max_restarts:
+                    raise InterruptedError("backup restarted too often")
+            last_remaining[0] = remaining
+            time.sleep(pause_seconds)
+        
+        stepped = True
+        try:
+            source.backup(target, pages=pages_per_step, progress=progress)
+        except InterruptedError:
+            stepped = False
+            source.backup(target)
+        target.execute("PRAGMA journal_mode = DELETE")
+        pages = target.execute("PRAGMA page_count").fetchone()[0]
+        integrity = target.execute("PRAGMA quick_check").fetchone()[0]
+        target.close()
+        source.close()
+        return {"pages": pages, "restarts": restarts, "stepped": stepped, "integrity": integrity}
+    
+    @staticmethod
+    def claim_task(task: str, interval_seconds: float) -> bool:
+        """Mark a task started if it has not started within interval_seconds; False if it has"""
+        conn = Database.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO maintenance_runs (task) VALUES (?) ON CONFLICT(task) DO NOTHING", (task,))
+        cursor.execute("""
+            UPDATE maintenance_runs SET started_at = CURRENT_TIMESTAMP
+            WHERE task = ? AND (started_at IS NULL OR started_at <= datetime('now', ?))
+        """, (task, f"-{float(interval_seconds)} seconds"))
+        claimed = cursor.rowcount == 1
+        conn.commit()
+        conn.close()
+        return claimed
+    
+    @staticmethod
+    def finish_task(task: str, status: str, seconds: float, pages: int, details: Dict):
+        conn = Database.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            UPDATE maintenance_runs
+            SET finished_at = CURRENT_TIMESTAMP, status = ?, seconds = ?, pages = ?, details = ?
+            WHERE task = ?
+        """, (status, seconds, pages, json.dumps(details), task))
+        conn.commit()
+        conn.close()
+    
+    @staticmethod
+    def get_runs() -> List[Dict]:
+        conn = Database.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT task, started_at, finished_at, status, seconds, pages, details
+            FROM maintenance_runs ORDER BY task
+        """)
+        rows = cursor.fetchall()
+        conn.close()
+        return [
+            {
+                "task": row[0],
+                "started_at": row[1],
+                "finished_at": row[2],
+                "status": row[3],
+                "seconds": row[4],
+                "pages": row[5],
+                "details": json.loads(row[6]) if row[6] else None
+            }
+            for row in rows
+        ]
+
+
+class ResourceVersionDatabase:
+    """Per-user change counters for conditional GETs on the listing endpoints"""
+    
+    @staticmethod
+    def get_version(user_id: str, resource: str) -> int:
+        """0 until the first write to the resource after this table was added"""
+        conn = Database.get_connection(user_id)
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT version FROM resource_versions WHERE user_id = ? AND resource = ?",
+            (user_id, resource)
+        )
+        row = cursor.fetchone()
+        conn.close()
+        return row[0] if row else 0
+
+
+class ColdStorageDatabase:
+    """Compressed cold storage for the messages of long-idle conversations"""
+    
+    CODEC = "zlib"
+    
+    @staticmethod
+    def _decode(codec: str, payload: bytes) -> List[list]:
+        if codec != "zlib":
+            raise ValueError(f"Unsupported archive codec: {codec}")
+        return json.loads(zlib.decompress(payload))
+    
+    @staticmethod
+    def load_frozen_messages(cursor, conversation_id: int) -> List[Dict]:
+        """Decode a frozen conversation's messages without writing them back"""
+        cursor.execute("SELECT codec, payload FROM conversation_archive WHERE conversation_id = ?", (conversation_id,))
+        row = cursor.fetchone()
+        if not row:
+            return []
+        return [message_row(cursor, m) for m in ColdStorageDatabase._decode(row[0], row[1])]
+    
+    @staticmethod
+    def thaw_if_frozen(cursor, conversation_id: int) -> bool:
+        """Move a frozen conversation's messages back into the hot table; caller commits"""
+        # Take the write lock before reading, so two writers cannot both restore the same ids
+        if not cursor.connection.in_transaction:
+            cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute(
+            """SELECT a.codec, a.payload FROM conversations c
+               JOIN conversation_archive a ON a.conversation_id = c.id
+               WHERE c.id = ? AND c.is_frozen = 1""",
+            (conversation_id,)
+        )
+        row = cursor.fetchone()
+        if not row:
+            return False
+        
+        cursor.executemany(
+            "INSERT INTO messages (id, conversation_id, role, content, intent, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            [(m[0], conversation_id, m[1], m[2], m[3], m[4]) for m in ColdStorageDatabase._decode(row[0], row[1])]
+        )
+        cursor.execute("DELETE FROM conversation_archive WHERE conversation_id = ?", (conversation_id,))
+        cursor.execute("UPDATE conversations SET is_frozen = 0 WHERE id = ?", (conversation_id,))
+        return True
+    
+    @staticmethod
+    def freeze_conversation(conversation_id: int) -> int:
+        """Compress a conversation's messages into the archive; returns the number moved"""
+        conn = Database.get_connection()
+        cursor = conn.cursor()
+        # Take the write lock before reading so no message can land between SELECT and DELETE
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("SELECT is_frozen FROM conversations WHERE id = ?", (conversation_id,))
+        row = cursor.fetchone()
+        if not row or row[0]:
+            conn.rollback()
+            conn.close()
+            return 0
+        cursor.execute(
+            "SELECT id, role, content, intent, created_at FROM messages WHERE conversation_id = ? ORDER BY created_at ASC",
+            (conversation_id,)
+        )
+        rows = cursor.fetchall()
+        
+        # Conversations without messages are frozen too (an empty archive), or the sweep would pick them forever
+        payload = zlib.compress(json.dumps(rows, separators=(",", ":")).encode("utf-8"), 9)
+        cursor.execute(
+            """INSERT INTO conversation_archive (conversation_id, codec, message_count, last_message, payload)
+               VALUES (?, ?, ?, ?, ?)""",
+            (conversation_id, ColdStorageDatabase.CODEC, len(rows), rows[-1][2] if rows else None, payload)
+        )
+        cursor.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+        cursor.execute("UPDATE conversations SET is_frozen = 1 WHERE id = ?", (conversation_id,))
+        
+        conn.commit()
+        conn.close()
+        return len(rows)
+    
+    @staticmethod
+    def get_freeze_candidates(archived_days: int, idle_days: int, limit: int) -> List[int]:
+        """Archived conversations untouched for archived_days, or any untouched for idle_days"""
+        conn = Database.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT id FROM conversations
+            WHERE is_frozen = 0
+              AND updated_at < datetime('now', '-' || ? || ' days')
+              AND (is_archived = 1 OR updated_at < datetime('now', '-' || ? || ' days'))
+            ORDER BY updated_at ASC
+            LIMIT ?
+        """, (min(archived_days, idle_days), idle_days, limit))
+        rows = cursor.fetchall()
+        conn.close()
+        return [row[0] for row in rows]
+    
+    @staticmethod
+    def get_storage_stats() -> Dict:
+        conn = Database.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*), SUM(message_count), SUM(LENGTH(payload)) FROM conversation_archive")
+        row = cursor.fetchone()
+        conn.close()
+        return {
+            "frozen_conversations": row[0] or 0,
+            "frozen_messages": row[1] or 0,
+            "archive_bytes": row[2] or 0
+        }
+
+
+class UserDataDatabase:
+    """Keyset-paged reads and batched writes for full account export and import"""
+    
+    # kind -> (query paged on (created_at/updated_at, id), output columns).
+    # Each page is its own short read, so a slow export client never holds a lock.
+    EXPORT_QUERIES = {
+        "conversation": ("""
+            SELECT id, title, created_at, updated_at, is_archived, is_frozen, updated_at
+            FROM conversations
+            WHERE user_id = ? AND (updated_at, id) > (?, ?)
+            ORDER BY updated_at, id LIMIT ?
+        """, ("id", "title", "created_at", "updated_at", "is_archived", "is_frozen")),
+        "message": ("""
+            SELECT id, conversation_id, role, content, intent, created_at, created_at
+            FROM messages
+            WHERE conversation_id = ? AND (created_at, id) > (?, ?)
+            ORDER BY created_at, id LIMIT ?
+        """, ("id", "conversation_id", "role", "content", "intent", "created_at")),
+        "mood": ("""
+            SELECT id, mood_level, mood_emoji, notes, created_at, created_at
+            FROM mood_entries
+            WHERE user_id = ? AND (created_at, id) > (?, ?)
+            ORDER BY created_at, id LIMIT ?
+        """, ("id", "mood_level", "mood_emoji", "notes", "created_at")),
+        "journal": ("""
+            SELECT id, title, content, mood_level, created_at, updated_at, created_at
+            FROM journal_entries
+            WHERE user_id = ? AND (created_at, id) > (?, ?)
+            ORDER BY created_at, id LIMIT ?
+        """, ("id", "title", "content", "mood_level", "created_at", "updated_at")),
+        "goal": ("""
+            SELECT id, title, description, category, target_value, current_value, unit,
+                   start_date, target_date, status, created_at, updated_at, completed_at, created_at
+            FROM goals
+            WHERE user_id = ? AND (created_at, id) > (?, ?)
+            ORDER BY created_at, id LIMIT ?
+        """, ("id", "title", "description", "category", "target_value", "current_value", "unit",
+              "start_date", "target_date", "status", "created_at", "updated_at", "completed_at")),
+    }
+    
+    @staticmethod
+    def get_export_page(kind: str, owner, after: tuple, limit: int, user_id: Optional[str] = None) -> tuple:
+        """One page of records owned by a user (or a conversation, for messages).
+        
+        user_id picks the shard. Returns (records, key to pass as `after` for the
+        next page or None when done).
+        """
+        query, columns = UserDataDatabase.EXPORT_QUERIES[kind]
+        conn = Database.get_connection(user_id)
+        cursor = conn.cursor()
+        cursor.execute(query, (owner, after[0], after[1], limit))
+        rows = cursor.fetchall()
+        conn.close()
+        
+        records = [dict(zip(columns, row)) for row in rows]
+        next_key = (rows[-1][-1], rows[-1][0]) if len(rows) == limit else None
+        return records, next_key
+    
+    @staticmethod
+    def get_frozen_messages(conversation_id: int, user_id: Optional[str] = None) -> List[Dict]:
+        conn = Database.get_connection(user_id)
+        cursor = conn.cursor()
+        messages = ColdStorageDatabase.load_frozen_messages(cursor, conversation_id)
+        conn.close()
+        return messages
+    
+    @staticmethod
+    def import_batch(user_id: str, records: List[Dict], conversation_ids: Dict[int, int]) -> Dict[str, int]:
+        """Insert one batch of exported records for user_id in a single transaction.
+        
+        conversation_ids maps exported conversation ids to the new ones and is
+        updated in place, so messages in later batches land in the right place.
+        """
+        conn = Database.get_connection(user_id)
+        cursor = conn.cursor()
+        counts = {}
+        messages, moods, journals, goals = [], [], [], []
+        
+        for record in records:
+            kind = record.get("type")
+            if kind == "conversation":
+                cursor.execute(
+                    """INSERT INTO conversations (user_id, title, created_at, updated_at, is_archived)
+                       VALUES (?, ?, COALESCE(?, CURRENT_TIMESTAMP), COALESCE(?, CURRENT_TIMESTAMP), ?)""",
+                    (user_id, record.get("title"), record.get("created_at"), record.get("updated_at"),
+                     1 if record.get("is_archived") else 0)
+                )
+                conversation_ids[record.get("id")] = cursor.lastrowid
+            elif kind == "message" and record.get("conversation_id") in conversation_ids:
+                messages.append((conversation_ids[record["conversation_id"]], record["role"], record["content"],
+                                 record.get("intent"), record.get("created_at")))
+            elif kind == "mood":
+                moods.append((user_id, record["mood_level"], record["mood_emoji"], record.get("notes"),
+                              record.get("created_at")))
+            elif kind == "journal":
+                journals.append((user_id, record.get("title"), record["content"], record.get("mood_level"),
+                                 record.get("created_at"), record.get("updated_at")))
+            elif kind == "goal":
+                goals.append((user_id, record["title"], record.get("description"), record.get("category"),
+                              record.get("target_value"), record.get("current_value", 0), record.get("unit"),
+                              record.get("start_date"), record.get("target_date"), record.get("status", "active"),
+                              record.get("created_at"), record.get("updated_at"), record.get("completed_at")))
+            elif kind == "user":
+                # Profile line of the export; the import always targets the current account
+                continue
+            else:
+                counts["skipped"] = counts.get("skipped", 0) + 1
+                continue
+            counts[kind] = counts.get(kind, 0) + 1
+        
+        # COALESCE keeps the column defaults for records without timestamps
+        cursor.executemany("""
+            INSERT INTO messages (conversation_id, role, content, intent, created_at)
+            VALUES (?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+        """, messages)
+        cursor.executemany("""
+            INSERT INTO mood_entries (user_id, mood_level, mood_emoji, notes, created_at)
+            VALUES (?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+        """, moods)
+        cursor.executemany("""
+            INSERT INTO journal_entries (user_id, title, content, mood_level, created_at, updated_at)
+            VALUES (?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP), COALESCE(?, CURRENT_TIMESTAMP))
+        """, journals)
+        cursor.executemany("""
+            INSERT INTO goals (user_id, title, description, category, target_value, current_value, unit,
+                               start_date, target_date, status, created_at, updated_at, completed_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP), COALESCE(?, CURRENT_TIMESTAMP), ?)
+        """, goals)
+        
+        conn.commit()
+        conn.close()
+        return counts
+
+class AnalyticsExportDatabase:
+    """Reads for the incremental analytics export (analytics_export.py), one keyset page at a time"""
+    
+    # table -> (joins after "FROM <table> t", [(column, expression)]). Timestamps come out
+    # normalized to UTC 'YYYY-MM-DD HH:MM:SS.SSS'; every query adds the created_at month last.
+    COLUMNS = {
+        "messages": ("LEFT JOIN conversations c ON c.id = t.conversation_id", [
+            ("id", "t.id"), ("conversation_id", "t.conversation_id"), ("user_id", "c.user_id"), ("role", "t.role"),
+            ("content", "t.content"), ("intent", "t.intent"), ("created_at", "strftime('%Y-%m-%d %H:%M:%f', t.created_at)"),
+        ]),
+        "conversations": ("", [
+            ("id", "t.id"), ("user_id", "t.user_id"), ("title", "t.title"),
+            # Not updated_at: new messages bump it without a logged change (see ANALYTICS_CHANGE_EVENTS)
+            ("created_at", "strftime('%Y-%m-%d %H:%M:%f', t.created_at)"), ("is_archived", "t.is_archived"),
+            ("crisis_flagged_at", "strftime('%Y-%m-%d %H:%M:%f', t.crisis_flagged_at)"),
+        ]),
+        "mood_entries": ("", [
+            ("id", "t.id"), ("user_id", "t.user_id"), ("mood_level", "t.mood_level"), ("mood_emoji", "t.mood_emoji"),
+            ("notes", "t.notes"), ("created_at", "strftime('%Y-%m-%d %H:%M:%f', t.created_at)"),
+        ]),
+        "journal_entries": ("", [
+            ("id", "t.id"), ("user_id", "t.user_id"), ("title", "t.title"), ("content", "t.content"),
+            ("mood_level", "t.mood_level"), ("created_at", "strftime('%Y-%m-%d %H:%M:%f', t.created_at)"),
+            ("updated_at", "strftime('%Y-%m-%d %H:%M:%f', t.updated_at)"),
+        ]),
+        "goals": ("", [
+            ("id", "t.id"), ("user_id", "t.user_id"), ("title", "t.title"), ("description", "t.description"),
+            ("category", "t.category"), ("target_value", "t.target_value"), ("current_value", "t.current_value"),
+            ("unit", "t.unit"), ("start_date", "date(t.start_date)"), ("target_date", "date(t.target_date)"),
+            ("status", "t.status"), ("created_at", "strftime('%Y-%m-%d %H:%M:%f', t.created_at)"),
+            ("updated_at", "strftime('%Y-%m-%d %H:%M:%f', t.updated_at)"),
+            ("completed_at", "strftime('%Y-%m-%d %H:%M:%f', t.completed_at)"),
+        ]),
+    }
+    
+    @staticmethod
+    def _select(table: str) -> tuple:
+        joins, columns = AnalyticsExportDatabase.COLUMNS[table]
+        expressions = ", ".join(expression for _, expression in columns)
+        return f"{expressions}, strftime('%Y-%m', t.created_at)", joins
+    
+    @staticmethod
+    def get_high_water(table: str) -> int:
+        """Largest id in an exported table, or in analytics_changes"""
+        if table != "analytics_changes" and table not in AnalyticsExportDatabase.COLUMNS:
+            raise ValueError(f"Not an exported table: {table}")
+        conn = Database.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT MAX(id) FROM {table}")
+        row = cursor.fetchone()
+        conn.close()
+        return row[0] or 0
+    
+    @staticmethod
+    def get_new_rows(table: str, after_id: int, until_id: int, limit: int) -> List[tuple]:
+        """Rows with after_id < id <= until_id, in id order: the COLUMNS values, then the month"""
+        select, joins = AnalyticsExportDatabase._select(table)
+        conn = Database.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            f"SELECT {select} FROM {table} t {joins} WHERE t.id > ? AND t.id <= ? ORDER BY t.id LIMIT ?",
+            (after_id, until_id, limit)
+        )
+        rows = cursor.fetchall()
+        conn.close()
+        return rows
+    
+    @staticmethod
+    def get_changed_rows(table: str, after_change: int, until_change: int, limit: int) -> List[tuple]:
+        """Logged changes to `table` in (after_change, until_change], in log order.
+        
+        Each row is (change id, row id, deleted, then get_new_rows' columns as the
+        row is now, all None once it is gone).
+        """
+        select, joins = AnalyticsExportDatabase._select(table)
+        conn = Database.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT ch.id, ch.row_id, ch.deleted, {select}
+            FROM analytics_changes ch
+            LEFT JOIN {table} t ON t.id = ch.row_id {joins}
+            WHERE ch.id > ? AND ch.id <= ? AND ch.source = ?
+            ORDER BY ch.id LIMIT ?
+        """, (after_change, until_change, table, limit))
+        rows = cursor.fetchall()
+        conn.close()
+        return rows
+    
+    @staticmethod
+    def get_archived_messages(after: tuple, until_archived_at: str, limit: int) -> List[tuple]:
+        """Conversations frozen before until_archived_at, in (archived_at, conversation_id) order
+        after `after`: (conversation_id, user_id, archived_at, [[id, role, content, intent, created_at], ...])"""
+        conn = Database.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT a.conversation_id, c.user_id, a.archived_at, a.codec, a.payload
+            FROM conversation_archive a
+            LEFT JOIN conversations c ON c.id = a.conversation_id
+            WHERE (a.archived_at, a.conversation_id) > (?, ?) AND a.archived_at < ?
+            ORDER BY a.archived_at, a.conversation_id LIMIT ?
+        """, (after[0], after[1], until_archived_at, limit))
+        rows = cursor.fetchall()
+        conn.close()
+        return [(row[0], row[1], row[2], ColdStorageDatabase._decode(row[3], row[4])) for row in rows]
+    
+    @staticmethod
+    def get_purged_users(finished_after: str) -> List[tuple]:
+        """(user_id, finished_at) of account purges completed after finished_after; directory only"""
+        conn = Database.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT user_id, finished_at FROM account_purge_jobs
+            WHERE status = 'completed' AND finished_at > ?
+        """, (finished_after,))
+        rows = cursor.fetchall()
+        conn.close()
+        return rows
+    
+    @staticmethod
+    def trim_changes(until_change: int, batch_size: int) -> int:
+        """Delete up to batch_size consumed analytics_changes entries; returns how many went"""
+        conn = Database.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "DELETE FROM analytics_changes WHERE id IN (SELECT id FROM analytics_changes WHERE id <= ? LIMIT ?)",
+            (until_change, batch_size)
+        )
+        deleted = cursor.rowcount
+        conn.commit()
+        conn.close()
+        return deleted
+
+# Initialize database on import
+init_storage()
@@ -0,0 +1,252 @@
+"""Scheduled SQLite maintenance: statistics, vacuum, WAL checkpoints and backups.
+
+Tasks, each with its own interval:
+
+  * optimize    PRAGMA optimize, re-analyzing tables whose size moved a lot
+  * analyze     ANALYZE of every table (approximate, see ANALYSIS_LIMIT)
+  * journal     fold queued journal changes into each user's insights
+                (journal_insights.py), so users who never read them do not
+                keep a second copy of every entry in the queue
+  * vacuum      incremental vacuum once free pages pass VACUUM_MIN_FREE_MB
+  * checkpoint  WAL checkpoint (TRUNCATE) once the -wal file passes WAL_CHECKPOINT_MB
+  * backup      throttled online copy to BACKUP_DIR, keeping the newest BACKUP_KEEP
+  * purge       restart account purges that failed (account_purge.py)
+
+Inside the app a background thread runs whichever tasks are due every
+MAINTENANCE_TICK_SECONDS. A task is claimed in maintenance_runs before it
+runs, so several workers sharing the file never run it twice. Every run
+reports its time and the pages it read or wrote. With sharded storage each
+task runs on the directory and on every shard, one file at a time.
+
+From the serena-backend directory:
+
+    python db_maintenance.py                        # run the due tasks once
+    python db_maintenance.py checkpoint backup --force --backup-dir /var/backups/serene
+    python db_maintenance.py --status
+"""
+import argparse
+import glob
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+import account_purge
+import journal_insights
+from database import AccountPurgeDatabase, JournalInsightsDatabase, MaintenanceDatabase, database_path, each_database
+
+MAINTENANCE_ENABLED = os.getenv("MAINTENANCE_ENABLED", "1") == "1"
+MAINTENANCE_TICK_SECONDS = float(os.getenv("MAINTENANCE_TICK_SECONDS", "60"))
+
+OPTIMIZE_INTERVAL_SECONDS = float(os.getenv("OPTIMIZE_INTERVAL_SECONDS", str(3600)))
+ANALYZE_INTERVAL_SECONDS = float(os.getenv("ANALYZE_INTERVAL_SECONDS", str(24 * 3600)))
+# Rows sampled per index by ANALYZE; 0 reads every index in full
+ANALYSIS_LIMIT = int(os.getenv("ANALYSIS_LIMIT", "1000"))
+
+VACUUM_INTERVAL_SECONDS = float(os.getenv("VACUUM_INTERVAL_SECONDS", str(3600)))
+VACUUM_MIN_FREE_MB = float(os.getenv("VACUUM_MIN_FREE_MB", "8"))
+VACUUM_PAGES_PER_STEP = int(os.getenv("VACUUM_PAGES_PER_STEP", "1000"))
+
+CHECKPOINT_INTERVAL_SECONDS = float(os.getenv("CHECKPOINT_INTERVAL_SECONDS", str(300)))
+WAL_CHECKPOINT_MB = float(os.getenv("WAL_CHECKPOINT_MB", "16"))
+
+# Backups are off unless BACKUP_DIR is set
+BACKUP_DIR = os.getenv("BACKUP_DIR", "")
+BACKUP_INTERVAL_SECONDS = float(os.getenv("BACKUP_INTERVAL_SECONDS", str(24 * 3600)))
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))
+BACKUP_PAGES_PER_STEP = int(os.getenv("BACKUP_PAGES_PER_STEP", "512"))
+BACKUP_MAX_RESTARTS = int(os.getenv("BACKUP_MAX_RESTARTS", "3"))
+
+JOURNAL_FOLD_INTERVAL_SECONDS = float(os.getenv("JOURNAL_FOLD_INTERVAL_SECONDS", str(3600)))
+PURGE_RETRY_INTERVAL_SECONDS = float(os.getenv("PURGE_RETRY_INTERVAL_SECONDS", str(900)))
+
+# Pause between steps of the vacuum and the backup so queued writers get the lock
+MAINTENANCE_PAUSE_SECONDS = float(os.getenv("MAINTENANCE_PAUSE_SECONDS", "0.02"))
+
+MB = 1024 * 1024
+
+
+def optimize(force: bool) -> dict:
+    stats = MaintenanceDatabase.get_file_stats()
+    statements = MaintenanceDatabase.optimize(ANALYSIS_LIMIT)
+    # ANALYZE reads index pages; with a limit it samples rather than reading them all
+    return {"pages": (stats["page_count"] - stats["freelist_count"]) if statements else 0, "statements": statements}
+
+
+def analyze(force: bool) -> dict:
+    stats = MaintenanceDatabase.get_file_stats()
+    MaintenanceDatabase.analyze(ANALYSIS_LIMIT)
+    return {"pages": stats["page_count"] - stats["freelist_count"], "analysis_limit": ANALYSIS_LIMIT}
+
+
+def vacuum(force: bool) -> dict:
+    stats = MaintenanceDatabase.get_file_stats()
+    free = stats["freelist_count"]
+    if stats["auto_vacuum"] != 2:
+        # Files created before auto_vacuum=INCREMENTAL need one offline VACUUM to switch
+        return {"status": "skipped", "pages": 0, "reason": "auto_vacuum is not INCREMENTAL", "free_pages": free}
+    if not force and free * stats["page_size"] < VACUUM_MIN_FREE_MB * MB:
+        return {"status": "skipped", "pages": 0, "free_pages": free}
+
+    remaining = free
+    while remaining:
+        still_free = AccountPurgeDatabase.incremental_vacuum(VACUUM_PAGES_PER_STEP)
+        if still_free >= remaining:
+            break
+        remaining = still_free
+        time.sleep(MAINTENANCE_PAUSE_SECONDS)
+    return {"pages": free - remaining, "free_pages": remaining}
+
+
+def checkpoint(force: bool) -> dict:
+    stats = MaintenanceDatabase.get_file_stats()
+    if stats["journal_mode"] != "wal":
+        return {"status": "skipped", "pages": 0, "reason": f"journal_mode is {stats['journal_mode']}"}
+    if not force and stats["wal_bytes"] < WAL_CHECKPOINT_MB * MB:
+        return {"status": "skipped", "pages": 0, "wal_bytes": stats["wal_bytes"]}
+
+    busy, wal_pages, checkpointed = MaintenanceDatabase.checkpoint("TRUNCATE")
+    # busy: a reader still needed part of the WAL, which stays until the next checkpoint
+    return {"pages": max(checkpointed, 0), "wal_pages": max(wal_pages, 0), "busy": bool(busy),
+            "wal_bytes_before": stats["wal_bytes"]}
+
+
+def backup(force: bool) -> dict:
+    if not BACKUP_DIR:
+        return {"status": "skipped", "pages": 0, "reason": "BACKUP_DIR is not set"}
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    # serene-<time>.db, or shard-003-of-008-<time>.db for a shard
+    name = os.path.splitext(os.path.basename(database_path()))[0]
+    path = os.path.join(BACKUP_DIR, f"{name}-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}.db")
+    partial = path + ".partial"
+    try:
+        result = MaintenanceDatabase.backup(partial, BACKUP_PAGES_PER_STEP, MAINTENANCE_PAUSE_SECONDS, BACKUP_MAX_RESTARTS)
+    except Exception:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    if result["integrity"] != "ok":
+        os.remove(partial)
+        raise RuntimeError(f"backup failed quick_check: {result['integrity']}")
+    os.replace(partial, path)
+
+    # Names sort by time
+    for old in sorted(glob.glob(os.path.join(BACKUP_DIR, f"{glob.escape(name)}-*.db")))[:-BACKUP_KEEP]:
+        os.remove(old)
+    return {**result, "path": path, "bytes": os.path.getsize(path)}
+
+
+def journal(force: bool) -> dict:
+    users = 0
+    user_id = JournalInsightsDatabase.get_next_queued_user("")
+    while user_id is not None:
+        # One short transaction per user, as when they read their insights
+        journal_insights.refresh(user_id)
+        users += 1
+        user_id = JournalInsightsDatabase.get_next_queued_user(user_id)
+    return {"pages": 0, "users": users}
+
+
+def purge(force: bool) -> dict:
+    # Purge jobs live in the directory; the query finds none in a shard
+    return {"pages": 0, "restarted": account_purge.retry_failed_purges()}
+
+
+# name -> (interval, task); run in this order
+TASKS = {
+    "optimize": (OPTIMIZE_INTERVAL_SECONDS, optimize),
+    "analyze": (ANALYZE_INTERVAL_SECONDS, analyze),
+    "journal": (JOURNAL_FOLD_INTERVAL_SECONDS, journal),
+    "vacuum": (VACUUM_INTERVAL_SECONDS, vacuum),
+    "checkpoint": (CHECKPOINT_INTERVAL_SECONDS, checkpoint),
+    "backup": (BACKUP_INTERVAL_SECONDS, backup),
+    "purge": (PURGE_RETRY_INTERVAL_SECONDS, purge),
+}
+
+
+def run_task(name: str, force: bool = False):
+    """Run one task on the current file if it is due (always, with force); returns its report, or None if not due"""
+    interval, task = TASKS[name]
+    if not MaintenanceDatabase.claim_task(name, 0 if force else interval):
+        return None
+    started = time.perf_counter()
+    try:
+        details = task(force)
+        status = details.pop("status", "ran")
+    except Exception as e:
+        details = {"pages": 0, "error": str(e)}
+        status = "failed"
+    seconds = round(time.perf_counter() - started, 3)
+    MaintenanceDatabase.finish_task(name, status, seconds, details["pages"], details)
+    database = os.path.basename(database_path())
+    if status != "skipped":
+        print(f"Maintenance {name} on {database}: {status} in {seconds:.3f}s, {details['pages']} pages")
+    return {"task": name, "database": database, "status": status, "seconds": seconds, **details}
+
+
+def run_due_tasks(names=None, force: bool = False):
+    reports = []
+    for _ in each_database(include_directory=True):
+        for name in names or TASKS:
+            report = run_task(name, force)
+            if report is not None:
+                reports.append(report)
+    return reports
+
+
+_stop = threading.Event()
+_thread = None
+
+
+def _run_scheduler():
+    while not _stop.wait(MAINTENANCE_TICK_SECONDS):
+        try:
+            run_due_tasks()
+        except Exception as e:
+            print(f"Maintenance tick failed: {e}")
+
+
+def start_scheduler():
+    """Run due tasks on a background thread every MAINTENANCE_TICK_SECONDS"""
+    global _thread
+    if _thread is not None and _thread.is_alive():
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_run_scheduler, name="db-maintenance", daemon=True)
+    _thread.start()
+
+
+def stop_scheduler():
+    _stop.set()
+
+
+def main():
+    global BACKUP_DIR
+    parser = argparse.ArgumentParser(description="Run SQLite maintenance tasks on the Serene database")
+    parser.add_argument("tasks", nargs="*", help=f"Tasks to run: {', '.join(TASKS)} (default: all due tasks)")
+    parser.add_argument("--force", action="store_true", help="Run now, ignoring intervals and size thresholds")
+    parser.add_argument("--backup-dir", help="Where backups go (overrides BACKUP_DIR)")
+    parser.add_argument("--status", action="store_true", help="Print file statistics and the last run of each task")
+    args = parser.parse_args()
+    unknown = [name for name in args.tasks if name not in TASKS]
+    if unknown:
+        parser.error(f"unknown task(s): {', '.join(unknown)}")
+    if args.backup_dir:
+        BACKUP_DIR = args.backup_dir
+
+    if args.status:
+        status = {
+            os.path.basename(database_path()): {"file": MaintenanceDatabase.get_file_stats(), "runs": MaintenanceDatabase.get_runs()}
+            for _ in each_database(include_directory=True)
+        }
+        print(json.dumps(status, indent=2))
+        return
+    reports = run_due_tasks(args.tasks, args.force)
+    print(json.dumps(reports, indent=2))
+    if any(report["status"] == "failed" for report in reports):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
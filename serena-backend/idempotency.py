@@ -0,0 +1,76 @@
+"""Idempotency-Key support: replay stored results and collapse concurrent retries.
+
+A request carrying an Idempotency-Key runs at most once per (user, key):
+the first call starts the computation as its own task, concurrent duplicates
+await that same task, and later duplicates get the stored result back. A key
+reused with a different request body is rejected rather than replayed.
+Failed computations are not stored, so the client can retry them.
+
+Results live in this process only; with several workers a retry that lands
+on another worker is computed again there.
+"""
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, Tuple
+
+
+class IdempotencyConflict(Exception):
+    """The key was already used for a request with a different body"""
+
+
+def fingerprint(payload: dict) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class IdempotencyStore:
+    """Bounded, TTL-limited map of key -> (request fingerprint, result task); running tasks are never evicted"""
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        # key -> (fingerprint, task, expires_at); insertion order == expiry order
+        self._entries: "OrderedDict[Hashable, Tuple[str, asyncio.Task, float]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _expire(self, now: float):
+        # Oldest first, finished entries only: dropping a running one would let a
+        # retry start the turn again. Running entries stay, even past the cap.
+        stale = []
+        excess = len(self._entries) - self.max_entries
+        for key, (_, task, expires_at) in self._entries.items():
+            if expires_at > now and len(stale) >= excess:
+                break
+            if task.done():
+                stale.append(key)
+        for key in stale:
+            del self._entries[key]
+
+    def _forget_failure(self, key: Hashable, task: asyncio.Task):
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] is task and (task.cancelled() or task.exception() is not None):
+            del self._entries[key]
+
+    async def run(self, key: Hashable, request_fingerprint: str,
+                  compute: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Result for `key`, computing it at most once; returns (result, replayed)"""
+        now = time.monotonic()
+        self._expire(now)
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            stored_fingerprint, task, _ = entry
+            if stored_fingerprint != request_fingerprint:
+                raise IdempotencyConflict()
+            # shield: a duplicate that disconnects must not cancel the shared computation
+            return await asyncio.shield(task), True
+
+        task = asyncio.ensure_future(compute())
+        task.add_done_callback(lambda done: self._forget_failure(key, done))
+        self._entries[key] = (request_fingerprint, task, now + self.ttl_seconds)
+        self._expire(now)
+        return await asyncio.shield(task), False
@@ -0,0 +1,409 @@
+"""Out-of-process intent inference over a Unix domain socket.
+
+The sidecar owns the model, so TensorFlow's memory and compute stay out of
+the API workers and inference never holds a worker's GIL:
+
+    python inference_sidecar.py --socket /run/serene/intent.sock
+    INTENT_SIDECAR_SOCKET=/run/serene/intent.sock uvicorn main:app --workers 4
+
+Requests are length-prefixed JSON ({"op": ..., "texts": [...]}). Each
+connection gets its own shared-memory block, and the float outputs
+(probabilities, sentence vectors) are written there rather than into the
+reply. Requests that arrive while the model is busy are batched into its
+next call.
+
+Workers reach the sidecar through SidecarIntentClassifier. It keeps a pool
+of connections and gives each call a timeout. When the sidecar is down or
+slow, it loads the same backend in-process and uses that, retrying the
+sidecar after INTENT_SIDECAR_RETRY_SECONDS. Run the sidecar and the workers
+with the same INTENT_MODEL_BACKEND and models directory, so that stored
+semantic-search vectors match either way.
+"""
+import argparse
+import json
+import os
+import queue
+import signal
+import socket
+import socketserver
+import struct
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+from typing import List, Optional
+
+import numpy as np
+
+from intent_classifiers import INTENT_MODEL_BACKEND, KerasIntentClassifier, load_intent_classifier
+from intent_model import EmbeddingEncoder
+
+# Empty keeps inference in-process
+INTENT_SIDECAR_SOCKET = os.getenv("INTENT_SIDECAR_SOCKET", "")
+INTENT_SIDECAR_POOL_SIZE = int(os.getenv("INTENT_SIDECAR_POOL_SIZE", "8"))
+INTENT_SIDECAR_TIMEOUT = int(os.getenv("INTENT_SIDECAR_TIMEOUT_MS", "500")) / 1000
+# After a failure, calls go straight to the local fallback for this long
+INTENT_SIDECAR_RETRY_SECONDS = float(os.getenv("INTENT_SIDECAR_RETRY_SECONDS", "5"))
+MAX_BATCH = 512
+
+HEADER = struct.Struct("!I")
+
+
+class SidecarUnavailable(Exception):
+    """The sidecar could not answer in time; the caller falls back to in-process inference"""
+
+
+def send_message(sock: socket.socket, message: dict):
+    body = json.dumps(message).encode()
+    sock.sendall(HEADER.pack(len(body)) + body)
+
+
+def recv_exactly(sock: socket.socket, size: int) -> Optional[bytes]:
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def recv_message(sock: socket.socket) -> Optional[dict]:
+    """The next message, or None once the peer has closed the connection"""
+    header = recv_exactly(sock, HEADER.size)
+    if header is None:
+        return None
+    body = recv_exactly(sock, HEADER.unpack(header)[0])
+    return None if body is None else json.loads(body)
+
+
+def load_serving_models(backend: Optional[str] = None, models_dir: str = "./models") -> tuple:
+    """(classifier, encoder) as the API loads them; the encoder feeds semantic search"""
+    classifier = load_intent_classifier(backend, models_dir)
+    encoder = getattr(classifier, "encoder", None)
+    if encoder is None:
+        model = getattr(classifier, "model", None) or KerasIntentClassifier.load(models_dir).model
+        encoder = EmbeddingEncoder.from_model(model)
+    return classifier, encoder
+
+
+class Batcher:
+    """Runs `function` on one thread, merging the requests queued while it was busy into one call"""
+
+    def __init__(self, function, max_batch: int = MAX_BATCH):
+        self.function = function
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, texts: List[str]) -> np.ndarray:
+        pending = {"texts": texts, "done": threading.Event()}
+        self._queue.put(pending)
+        pending["done"].wait()
+        if "error" in pending:
+            raise pending["error"]
+        return pending["result"]
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            size = len(batch[0]["texts"])
+            while size < self.max_batch:
+                try:
+                    pending = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(pending)
+                size += len(pending["texts"])
+
+            try:
+                results = self.function([text for pending in batch for text in pending["texts"]])
+                start = 0
+                for pending in batch:
+                    pending["result"] = results[start:start + len(pending["texts"])]
+                    start += len(pending["texts"])
+            except Exception as e:
+                for pending in batch:
+                    pending["error"] = e
+            for pending in batch:
+                pending["done"].set()
+
+
+class SidecarHandler(socketserver.BaseRequestHandler):
+    """One client connection: requests answered in order, outputs written to this connection's block"""
+
+    def setup(self):
+        self.block = None
+
+    def handle(self):
+        while True:
+            request = recv_message(self.request)
+            if request is None:
+                return
+            try:
+                reply = self.server.dispatch(request, self)
+            except Exception as e:
+                reply = {"error": f"{type(e).__name__}: {e}"}
+            try:
+                send_message(self.request, reply)
+            except OSError:
+                # The client timed out and closed the connection
+                return
+
+    def write_array(self, array: np.ndarray) -> dict:
+        """Copy `array` into this connection's block, growing it first if needed"""
+        if self.block is None or self.block.size < array.nbytes:
+            self.server.release(self.block)
+            self.block = self.server.allocate(max(array.nbytes, 1))
+        view = np.ndarray(array.shape, dtype=array.dtype, buffer=self.block.buf)
+        view[...] = array
+        del view
+        return {"shm": self.block.name, "shape": list(array.shape), "dtype": array.dtype.str}
+
+    def finish(self):
+        self.server.release(self.block)
+
+
+class InferenceServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+    # Every worker opens its whole pool at once on a cold start; a full backlog fails connect() at once
+    request_queue_size = 128
+
+    def __init__(self, path: str, classifier, encoder: Optional[EmbeddingEncoder]):
+        self.classifier = classifier
+        self.encoder = encoder
+        self.batchers = {"classify": Batcher(lambda texts: classifier.predict_proba(texts).astype(np.float32))}
+        if encoder is not None:
+            self.batchers["encode"] = Batcher(encoder.encode)
+        self._blocks = set()
+        self._blocks_lock = threading.Lock()
+        super().__init__(path, SidecarHandler)
+
+    def dispatch(self, request: dict, handler: SidecarHandler) -> dict:
+        op = request.get("op")
+        if op == "info":
+            return {
+                "backend": self.classifier.name,
+                "class_names": [str(name) for name in self.classifier.class_names],
+                "encoder": self.encoder and {"model_key": self.encoder.model_key, "dimensions": self.encoder.dimensions},
+            }
+        if op not in self.batchers:
+            return {"error": f"Unknown op {op!r}"}
+        return handler.write_array(self.batchers[op].submit(list(request["texts"])))
+
+    def allocate(self, size: int) -> shared_memory.SharedMemory:
+        block = shared_memory.SharedMemory(create=True, size=size)
+        with self._blocks_lock:
+            self._blocks.add(block)
+        return block
+
+    def release(self, block: Optional[shared_memory.SharedMemory]):
+        if block is None:
+            return
+        with self._blocks_lock:
+            if block not in self._blocks:
+                return
+            self._blocks.discard(block)
+        block.close()
+        block.unlink()
+
+    def server_close(self):
+        super().server_close()
+        for block in list(self._blocks):
+            self.release(block)
+
+
+class SidecarConnection:
+    def __init__(self, path: str, timeout: float):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.block = None
+        try:
+            self.sock.connect(path)
+        except OSError:
+            self.sock.close()
+            raise
+
+    def request(self, message: dict):
+        send_message(self.sock, message)
+        reply = recv_message(self.sock)
+        if reply is None:
+            raise SidecarUnavailable("sidecar closed the connection")
+        if "error" in reply:
+            raise SidecarUnavailable(reply["error"])
+        if "shm" not in reply:
+            return reply
+        if self.block is None or self.block.name != reply["shm"]:
+            self._detach()
+            self.block = shared_memory.SharedMemory(name=reply["shm"])
+            # The sidecar owns the block; stop this process's tracker from unlinking it at exit
+            resource_tracker.unregister(self.block._name, "shared_memory")
+        view = np.ndarray(reply["shape"], dtype=np.dtype(reply["dtype"]), buffer=self.block.buf)
+        result = view.copy()
+        del view
+        return result
+
+    def _detach(self):
+        if self.block is not None:
+            self.block.close()
+            self.block = None
+
+    def close(self):
+        self._detach()
+        self.sock.close()
+
+
+class SidecarClient:
+    """Pooled connections to the sidecar; every call either answers within the timeout or raises SidecarUnavailable"""
+
+    def __init__(self, path: str, pool_size: int = INTENT_SIDECAR_POOL_SIZE, timeout: float = INTENT_SIDECAR_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._idle = queue.LifoQueue()
+
+    def call(self, op: str, texts: Optional[List[str]] = None):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise SidecarUnavailable("all sidecar connections are busy")
+        try:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                connection = None
+            while True:
+                reused = connection is not None
+                try:
+                    connection = connection or SidecarConnection(self.path, self.timeout)
+                    result = connection.request({"op": op, "texts": texts})
+                    break
+                except (OSError, ValueError, SidecarUnavailable) as e:
+                    # A timed-out connection may still receive the late reply, so it is never reused
+                    if connection is not None:
+                        connection.close()
+                    connection = None
+                    if reused and not isinstance(e, socket.timeout):
+                        # Pooled connections go stale when the sidecar restarts; retry once on a new one
+                        self.close()
+                        continue
+                    if isinstance(e, SidecarUnavailable):
+                        raise
+                    raise SidecarUnavailable(str(e) or type(e).__name__) from e
+            self._idle.put(connection)
+            return result
+        finally:
+            self._slots.release()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class SidecarIntentClassifier:
+    """Intent classifier backed by the sidecar, with in-process inference as the fallback"""
+
+    name = "sidecar"
+
+    def __init__(self, client: SidecarClient, backend: Optional[str] = None, models_dir: str = "./models",
+                 retry_seconds: float = INTENT_SIDECAR_RETRY_SECONDS):
+        self.client = client
+        self.backend = backend
+        self.models_dir = models_dir
+        self.retry_seconds = retry_seconds
+        self._retry_at = 0.0
+        self._local = None
+        self._local_lock = threading.Lock()
+
+        info = self._call("info")
+        if info is not None:
+            self.class_names = np.asarray(info["class_names"])
+            self.encoder = info["encoder"] and SidecarEncoder(self, **info["encoder"])
+            print(f"Intent sidecar at {client.path} serving {info['backend']}")
+        else:
+            classifier, self.encoder = self.local()
+            self.class_names = classifier.class_names
+
+    def local(self) -> tuple:
+        """(classifier, encoder) loaded in this process on first use"""
+        with self._local_lock:
+            if self._local is None:
+                print("Loading the intent model in-process as the sidecar fallback")
+                self._local = load_serving_models(self.backend, self.models_dir)
+            return self._local
+
+    def _call(self, op: str, texts: Optional[List[str]] = None):
+        """The sidecar's answer, or None when it is unavailable and the caller should fall back"""
+        if time.monotonic() < self._retry_at:
+            return None
+        try:
+            return self.client.call(op, texts)
+        except SidecarUnavailable as e:
+            print(f"Intent sidecar unavailable ({e}); using in-process inference for {self.retry_seconds:g}s")
+            self._retry_at = time.monotonic() + self.retry_seconds
+            return None
+
+    def predict_proba(self, texts: List[str]) -> np.ndarray:
+        probabilities = self._call("classify", texts)
+        if probabilities is None:
+            probabilities = self.local()[0].predict_proba(texts)
+        return probabilities
+
+    def classify(self, text: str) -> str:
+        return str(self.class_names[int(np.argmax(self.predict_proba([text])[0]))])
+
+    def classify_batch(self, texts: List[str]) -> List[str]:
+        if not texts:
+            return []
+        return [str(name) for name in self.class_names[self.predict_proba(texts).argmax(axis=1)]]
+
+    def warmup(self) -> float:
+        started = time.perf_counter()
+        self.predict_proba(["warmup"])
+        return time.perf_counter() - started
+
+
+class SidecarEncoder:
+    """EmbeddingEncoder stand-in whose vectors come from the sidecar"""
+
+    def __init__(self, owner: SidecarIntentClassifier, model_key: str, dimensions: int):
+        self.owner = owner
+        self.model_key = model_key
+        self.dimensions = dimensions
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        vectors = self.owner._call("encode", texts)
+        if vectors is None:
+            vectors = self.owner.local()[1].encode(texts)
+        return vectors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve intent classification to the API workers over a Unix socket")
+    parser.add_argument("--socket", default=INTENT_SIDECAR_SOCKET or "/tmp/serene-intent.sock")
+    parser.add_argument("--backend", default=INTENT_MODEL_BACKEND)
+    parser.add_argument("--models-dir", default="./models")
+    args = parser.parse_args()
+
+    classifier, encoder = load_serving_models(args.backend, args.models_dir)
+    print(f"Intent classifier {classifier.name} warmed up in {classifier.warmup():.2f}s")
+
+    if os.path.exists(args.socket):
+        os.unlink(args.socket)
+    server = InferenceServer(args.socket, classifier, encoder)
+    os.chmod(args.socket, 0o600)
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown).start())
+    print(f"Serving on {args.socket}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+
+
+if __name__ == "__main__":
+    main()
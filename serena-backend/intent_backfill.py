@@ -0,0 +1,169 @@
+"""Offline batch re-labeling of `messages.intent` with the current model.
+
+Live chat only labels assistant replies, with whichever model was serving at
+the time. This job walks the whole messages table in id order and labels
+every row with the current model: user messages by their own text, assistant
+replies by the user message they answered (as /predict does). Text the crisis
+phrase list matches is labeled with its crisis intent, as live chat does,
+instead of a model class. Each chunk is written back with one executemany
+together with a checkpoint, so an interrupted run resumes where it stopped;
+a retrained model or a new phrase list starts over. With sharded storage
+the shards are walked one after another, each with the checkpoint kept in
+its own file.
+
+    python intent_backfill.py                 # label, resuming from the checkpoint
+    python intent_backfill.py --dry-run       # only report the label distribution
+    python intent_backfill.py --restart --chunk-size 50000
+
+Messages of frozen conversations stay in cold storage and are not relabeled.
+"""
+import argparse
+import time
+from collections import Counter
+from typing import Optional
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.layers import TextVectorization
+
+from crisis_detection import CrisisDetector
+from database import BackfillDatabase, each_database
+from intent_model import BatchClassifier
+
+JOB = "intent"
+
+
+def load_classifier(model_path: str, classes_path: str, batch_size: int) -> BatchClassifier:
+    model = tf.keras.models.load_model(
+        model_path,
+        custom_objects={"TextVectorization": TextVectorization},
+        compile=False
+    )
+    return BatchClassifier(model, np.load(classes_path, allow_pickle=True), batch_size)
+
+
+def label_chunk(classifier: BatchClassifier, rows: list, crisis_detector: Optional[CrisisDetector] = None) -> list:
+    """(intent, message_id) for every row that has text to classify"""
+    last_prompt = {}
+    targets = []
+    missing = []
+    for message_id, conversation_id, role, content, _ in rows:
+        if role == "user":
+            last_prompt[conversation_id] = content
+            targets.append((message_id, content))
+        elif conversation_id in last_prompt:
+            targets.append((message_id, last_prompt[conversation_id]))
+        else:
+            # The user message this reply answered is in an earlier chunk
+            missing.append((message_id, conversation_id))
+
+    if missing:
+        prompts = BackfillDatabase.get_prompting_messages(missing)
+        targets += [(message_id, prompts[message_id]) for message_id, _ in missing if message_id in prompts]
+
+    # Crisis replies are answered before the model runs; the model has no crisis class
+    crisis = []
+    if crisis_detector:
+        crisis = [(crisis_detector.intent, message_id) for message_id, text in targets if crisis_detector.match(text)]
+        matched = {message_id for _, message_id in crisis}
+        targets = [(message_id, text) for message_id, text in targets if message_id not in matched]
+
+    labels = classifier.predict([text for _, text in targets])
+    return crisis + [(str(label), message_id) for (message_id, _), label in zip(targets, labels)]
+
+
+def backfill_intents(classifier: BatchClassifier, chunk_size: int = 20000, dry_run: bool = False,
+                     restart: bool = False, max_messages: Optional[int] = None,
+                     crisis_detector: Optional[CrisisDetector] = None) -> dict:
+    """Re-label messages chunk by chunk; a dry run classifies without writing anything"""
+    started = time.perf_counter()
+    totals = {"messages": 0, "labeled": 0, "changed": 0, "distribution": Counter(), "resumed_from": 0}
+    for _ in each_database():
+        remaining = None if max_messages is None else max_messages - totals["messages"]
+        if remaining == 0:
+            break
+        result = backfill_database(classifier, chunk_size, dry_run, restart, remaining, crisis_detector)
+        for key in ("messages", "labeled", "changed"):
+            totals[key] += result[key]
+        totals["distribution"].update(result["distribution"])
+        totals["resumed_from"] = max(totals["resumed_from"], result["resumed_from"])
+
+    seconds = time.perf_counter() - started
+    totals["distribution"] = dict(totals["distribution"].most_common())
+    totals["seconds"] = round(seconds, 3)
+    totals["messages_per_second"] = round(totals["messages"] / seconds) if seconds else 0
+    return totals
+
+
+def backfill_database(classifier: BatchClassifier, chunk_size: int, dry_run: bool, restart: bool,
+                      max_messages: Optional[int], crisis_detector: Optional[CrisisDetector] = None) -> dict:
+    """backfill_intents over one database file"""
+    # A new phrase list relabels from the start, as a new model does
+    model_key = classifier.key + (f"+crisis-v{crisis_detector.version}" if crisis_detector else "")
+    checkpoint = BackfillDatabase.get_checkpoint(JOB)
+    resume = not dry_run and not restart and checkpoint and checkpoint["model_key"] == model_key
+    last_id = checkpoint["last_id"] if resume else 0
+    processed = checkpoint["processed"] if resume else 0
+
+    started = time.perf_counter()
+    scanned = changed = 0
+    distribution = Counter()
+    while max_messages is None or scanned < max_messages:
+        limit = chunk_size if max_messages is None else min(chunk_size, max_messages - scanned)
+        rows = BackfillDatabase.get_message_chunk(last_id, limit)
+        if not rows:
+            break
+
+        updates = label_chunk(classifier, rows, crisis_detector)
+        current = {row[0]: row[4] for row in rows}
+        changed += sum(1 for intent, message_id in updates if current[message_id] != intent)
+        distribution.update(intent for intent, _ in updates)
+
+        last_id = rows[-1][0]
+        scanned += len(rows)
+        processed += len(rows)
+        if not dry_run:
+            BackfillDatabase.save_intents(JOB, model_key, updates, last_id, processed)
+
+        elapsed = time.perf_counter() - started
+        print(f"{scanned} messages up to id {last_id} ({scanned / elapsed:.0f}/s)")
+
+    seconds = time.perf_counter() - started
+    return {
+        "messages": scanned,
+        "labeled": sum(distribution.values()),
+        "changed": changed,
+        "distribution": dict(distribution.most_common()),
+        "resumed_from": checkpoint["last_id"] if resume else 0,
+        "seconds": round(seconds, 3),
+        "messages_per_second": round(scanned / seconds) if seconds else 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-label messages.intent with the current intent model")
+    parser.add_argument("--model", default="./models/chatbot.keras")
+    parser.add_argument("--classes", default="./models/classes.npy")
+    parser.add_argument("--chunk-size", type=int, default=20000, help="Messages read and written per transaction")
+    parser.add_argument("--batch-size", type=int, default=4096, help="Texts per model call")
+    parser.add_argument("--max-messages", type=int, help="Stop after this many messages")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and start from the first message")
+    parser.add_argument("--dry-run", action="store_true", help="Classify and report the label distribution without writing")
+    args = parser.parse_args()
+
+    classifier = load_classifier(args.model, args.classes, args.batch_size)
+    crisis_detector = CrisisDetector.load()
+    result = backfill_intents(classifier, args.chunk_size, args.dry_run, args.restart, args.max_messages,
+                              crisis_detector)
+
+    if result["resumed_from"]:
+        print(f"resumed after message {result['resumed_from']}")
+    verb = "would change" if args.dry_run else "changed"
+    print(f"labeled {result['labeled']} of {result['messages']} messages in {result['seconds']}s "
+          f"({result['messages_per_second']}/s), {verb} {result['changed']}")
+    for intent, count in result["distribution"].items():
+        print(f"  {intent:<24} {count:>9}  {100 * count / max(result['labeled'], 1):5.1f}%")
+
+
+if __name__ == "__main__":
+    main()
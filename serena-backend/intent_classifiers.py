@@ -0,0 +1,487 @@
+"""Interchangeable intent classifiers and the serving adapter that picks one.
+
+Every backend answers the same calls (`classify`, `classify_batch`,
+`predict_proba`) and loads from the models directory:
+
+  * keras  - the BiLSTM in chatbot.keras (trained by train.py)
+  * tfidf  - word unigram+bigram TF-IDF with multinomial logistic regression
+  * hashed - hashed word and character n-grams with the same linear model
+  * quantized - the BiLSTM with int8/float16 weights, run in NumPy (quantize.py)
+
+The two linear models are pure NumPy, train in well under a second and are
+saved as intent_<name>.npz. benchmarks/classifier_bakeoff.py compares all
+three on fixed splits and can export the linear ones; the API serves
+whichever INTENT_MODEL_BACKEND names.
+"""
+import os
+import time
+import zlib
+from collections import Counter
+from typing import List, Optional
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.layers import TextVectorization
+
+from intent_model import STRIP_PUNCTUATION, BatchClassifier, EmbeddingEncoder, Vectorizer, find_layer
+
+INTENT_MODEL_BACKEND = os.getenv("INTENT_MODEL_BACKEND", "keras")
+# Compile the Keras serving function with XLA; falls back to plain graph mode where XLA fails
+INTENT_MODEL_XLA = os.getenv("INTENT_MODEL_XLA", "1") == "1"
+
+
+def tokenize(text: str) -> List[str]:
+    """Same standardization as the Keras model's TextVectorization"""
+    return STRIP_PUNCTUATION.sub("", text.lower()).split()
+
+
+class KerasIntentClassifier:
+    """The trained BiLSTM behind a traced serving function (see intent_model.BatchClassifier)"""
+
+    name = "keras"
+
+    def __init__(self, model, class_names, batch_size: int = 256, jit_compile: bool = INTENT_MODEL_XLA):
+        self.model = model
+        self.class_names = np.asarray(class_names)
+        self.batch_size = batch_size
+        # Models without a TextVectorization layer (such as the load-test stub) go through predict()
+        self.serving = None
+        if find_layer(model, "TextVectorization") is not None:
+            self.serving = BatchClassifier(model, class_names, batch_size, jit_compile)
+
+    @classmethod
+    def load(cls, models_dir: str = "./models") -> "KerasIntentClassifier":
+        model = tf.keras.models.load_model(
+            os.path.join(models_dir, "chatbot.keras"),
+            custom_objects={"TextVectorization": TextVectorization},
+            compile=False
+        )
+        return cls(model, np.load(os.path.join(models_dir, "classes.npy"), allow_pickle=True))
+
+    def predict_proba(self, texts: List[str]) -> np.ndarray:
+        if self.serving is not None:
+            return self.serving.probabilities(texts)
+        return self.model.predict(np.array(texts, dtype=object), batch_size=self.batch_size, verbose=0)
+
+    def warmup(self) -> float:
+        if self.serving is not None:
+            return self.serving.warmup()
+        started = time.perf_counter()
+        self.predict_proba(["warmup"])
+        return time.perf_counter() - started
+
+    def classify(self, text: str) -> str:
+        return str(self.class_names[int(np.argmax(self.predict_proba([text])[0]))])
+
+    def classify_batch(self, texts: List[str]) -> List[str]:
+        if not texts:
+            return []
+        return [str(name) for name in self.class_names[self.predict_proba(texts).argmax(axis=1)]]
+
+    def weights_bytes(self) -> int:
+        return sum(weights.nbytes for weights in self.model.get_weights())
+
+
+class LinearIntentClassifier:
+    """Softmax regression over sparse text features; subclasses define the features.
+
+    Features are CSR triples (indptr, indices, values) with one L2-normalized
+    row per text, so scoring touches only the weight rows a text uses.
+    """
+
+    name = ""
+
+    def __init__(self):
+        self.class_names = np.array([], dtype=str)
+        self.weights = None
+        self.bias = None
+
+    @property
+    def filename(self) -> str:
+        return f"intent_{self.name}.npz"
+
+    # Features
+
+    def terms(self, text: str) -> List[str]:
+        raise NotImplementedError
+
+    def fit_features(self, texts: List[str]):
+        """Learn whatever the feature mapping needs from the training texts"""
+
+    def feature_ids(self, terms: List[str]) -> tuple:
+        """(column indices, values) before normalization"""
+        raise NotImplementedError
+
+    def row(self, text: str) -> tuple:
+        """One text's (column indices, L2-normalized values)"""
+        columns, values = self.feature_ids(self.terms(text))
+        norm = np.sqrt(np.dot(values, values)) if len(values) else 0.0
+        return columns, values / norm if norm else values
+
+    def features(self, texts: List[str]) -> tuple:
+        indptr = [0]
+        indices, values = [], []
+        for text in texts:
+            columns, row_values = self.row(text)
+            indices.append(columns)
+            values.append(row_values)
+            indptr.append(indptr[-1] + len(columns))
+        return (
+            np.array(indptr, dtype=np.int64),
+            np.concatenate(indices).astype(np.int64) if indices else np.zeros(0, dtype=np.int64),
+            np.concatenate(values).astype(np.float32) if values else np.zeros(0, dtype=np.float32),
+        )
+
+    # Scoring
+
+    def _scores(self, indptr: np.ndarray, indices: np.ndarray, values: np.ndarray) -> np.ndarray:
+        rows = len(indptr) - 1
+        scores = np.zeros((rows, len(self.class_names)), dtype=np.float32)
+        nonempty = indptr[1:] > indptr[:-1]
+        if nonempty.any():
+            # Segments of empty rows are zero-length, so summing from each non-empty row's start is exact
+            contributions = values[:, None] * self.weights[indices]
+            scores[nonempty] = np.add.reduceat(contributions, indptr[:-1][nonempty], axis=0)
+        return scores + self.bias
+
+    def predict_proba(self, texts: List[str]) -> np.ndarray:
+        scores = self._scores(*self.features(texts))
+        scores -= scores.max(axis=1, keepdims=True)
+        np.exp(scores, out=scores)
+        return scores / scores.sum(axis=1, keepdims=True)
+
+    def classify(self, text: str) -> str:
+        columns, values = self.row(text)
+        scores = self.bias + values @ self.weights[columns] if len(columns) else self.bias
+        return str(self.class_names[int(np.argmax(scores))])
+
+    def classify_batch(self, texts: List[str]) -> List[str]:
+        if not texts:
+            return []
+        return [str(name) for name in self.class_names[self._scores(*self.features(texts)).argmax(axis=1)]]
+
+    def weights_bytes(self) -> int:
+        return self.weights.nbytes + self.bias.nbytes
+
+    def warmup(self) -> float:
+        started = time.perf_counter()
+        self.classify_batch(["warmup"])
+        return time.perf_counter() - started
+
+    # Training
+
+    def fit(self, texts: List[str], labels: np.ndarray, class_names, epochs: int = 60,
+            learning_rate: float = 0.5, l2: float = 1e-4, batch_size: int = 64, seed: int = 42):
+        """AdaGrad on the softmax loss, updating only the weight rows each batch touches"""
+        self.class_names = np.asarray(class_names).astype(str)
+        self.fit_features(texts)
+        indptr, indices, values = self.features(texts)
+        labels = np.asarray(labels)
+        rng = np.random.default_rng(seed)
+
+        classes = len(self.class_names)
+        self.weights = np.zeros((self.dimensions, classes), dtype=np.float32)
+        self.bias = np.zeros(classes, dtype=np.float32)
+        weight_accumulator = np.full_like(self.weights, 1e-8)
+        bias_accumulator = np.full_like(self.bias, 1e-8)
+
+        for _ in range(epochs):
+            order = rng.permutation(len(labels))
+            for start in range(0, len(order), batch_size):
+                rows = order[start:start + batch_size]
+                lengths = indptr[rows + 1] - indptr[rows]
+                batch_indptr = np.concatenate([[0], np.cumsum(lengths)])
+                spans = [np.arange(indptr[row], indptr[row + 1]) for row in rows]
+                positions = np.concatenate(spans) if spans else np.zeros(0, dtype=np.int64)
+                batch_indices, batch_values = indices[positions], values[positions]
+
+                scores = self._scores(batch_indptr, batch_indices, batch_values)
+                scores -= scores.max(axis=1, keepdims=True)
+                gradient = np.exp(scores)
+                gradient /= gradient.sum(axis=1, keepdims=True)
+                gradient[np.arange(len(rows)), labels[rows]] -= 1
+                gradient /= len(rows)
+
+                columns, inverse = np.unique(batch_indices, return_inverse=True)
+                row_gradient = np.zeros((len(columns), classes), dtype=np.float32)
+                np.add.at(row_gradient, inverse, batch_values[:, None] * gradient[np.repeat(np.arange(len(rows)), lengths)])
+                row_gradient += l2 * self.weights[columns]
+                weight_accumulator[columns] += row_gradient ** 2
+                self.weights[columns] -= learning_rate * row_gradient / np.sqrt(weight_accumulator[columns])
+
+                bias_gradient = gradient.sum(axis=0)
+                bias_accumulator += bias_gradient ** 2
+                self.bias -= learning_rate * bias_gradient / np.sqrt(bias_accumulator)
+        return self
+
+    # Persistence
+
+    def state(self) -> dict:
+        return {}
+
+    def load_state(self, state):
+        pass
+
+    def save(self, models_dir: str = "./models") -> str:
+        os.makedirs(models_dir, exist_ok=True)
+        path = os.path.join(models_dir, self.filename)
+        np.savez(path, weights=self.weights, bias=self.bias, class_names=self.class_names, **self.state())
+        return path
+
+    @classmethod
+    def load(cls, models_dir: str = "./models") -> "LinearIntentClassifier":
+        classifier = cls()
+        with np.load(os.path.join(models_dir, classifier.filename), allow_pickle=False) as state:
+            classifier.weights = state["weights"]
+            classifier.bias = state["bias"]
+            classifier.class_names = state["class_names"]
+            classifier.load_state(state)
+        return classifier
+
+
+class TfidfIntentClassifier(LinearIntentClassifier):
+    """Word unigrams and bigrams weighted by smoothed inverse document frequency"""
+
+    name = "tfidf"
+
+    def __init__(self):
+        super().__init__()
+        self.vocabulary = {}
+        self.idf = np.zeros(0, dtype=np.float32)
+
+    @property
+    def dimensions(self) -> int:
+        return len(self.vocabulary)
+
+    def terms(self, text: str) -> List[str]:
+        tokens = tokenize(text)
+        return tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+    def fit_features(self, texts: List[str]):
+        document_frequency = Counter(term for text in texts for term in set(self.terms(text)))
+        terms = sorted(document_frequency)
+        self.vocabulary = {term: index for index, term in enumerate(terms)}
+        counts = np.array([document_frequency[term] for term in terms], dtype=np.float32)
+        self.idf = (np.log((1 + len(texts)) / (1 + counts)) + 1).astype(np.float32)
+
+    def feature_ids(self, terms: List[str]) -> tuple:
+        counts = Counter(self.vocabulary[term] for term in terms if term in self.vocabulary)
+        columns = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        values = np.fromiter(counts.values(), dtype=np.float32, count=len(counts)) * self.idf[columns]
+        return columns, values
+
+    def state(self) -> dict:
+        terms = sorted(self.vocabulary, key=self.vocabulary.get)
+        return {"vocabulary": np.array(terms, dtype=str), "idf": self.idf}
+
+    def load_state(self, state):
+        self.vocabulary = {str(term): index for index, term in enumerate(state["vocabulary"])}
+        self.idf = state["idf"]
+
+
+class HashedIntentClassifier(LinearIntentClassifier):
+    """Word unigrams, bigrams and character trigrams hashed into a fixed number of signed buckets.
+
+    No vocabulary to fit or ship, and misspellings still share trigrams with
+    the words they were meant to be.
+    """
+
+    name = "hashed"
+
+    def __init__(self, dimensions: int = 1 << 16):
+        super().__init__()
+        self.dimensions = dimensions
+
+    def terms(self, text: str) -> List[str]:
+        tokens = tokenize(text)
+        terms = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        for token in tokens:
+            padded = f"<{token}>"
+            terms += [f"#{padded[i:i + 3]}" for i in range(len(padded) - 2)]
+        return terms
+
+    def feature_ids(self, terms: List[str]) -> tuple:
+        counts = Counter()
+        for term in terms:
+            # crc32 rather than hash(): str hashes are salted per process
+            digest = zlib.crc32(term.encode())
+            counts[digest % self.dimensions] += 1.0 if digest & 0x80000000 else -1.0
+        columns = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        values = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+        return columns, values
+
+    def state(self) -> dict:
+        return {"dimensions": np.array(self.dimensions)}
+
+    def load_state(self, state):
+        self.dimensions = int(state["dimensions"])
+
+
+def sigmoid(x: np.ndarray) -> np.ndarray:
+    return 0.5 * (np.tanh(0.5 * x) + 1)
+
+
+class QuantizedIntentClassifier:
+    """The BiLSTM with int8 or float16 weights, run by a NumPy forward pass.
+
+    The embedding table holds most of the parameters: in int8 mode it is
+    stored with one scale per row, and only the rows a batch looks up are
+    widened to float32. The LSTM and Dense weights are kept in float16 and
+    widened per call. Built from chatbot.keras by quantize.py.
+    """
+
+    name = "quantized"
+    filename = "intent_quantized.npz"
+
+    def __init__(self, vocabulary, sequence_length: int, embeddings: np.ndarray, embedding_scales: Optional[np.ndarray],
+                 lstm_weights: List[np.ndarray], dense_weights: List[np.ndarray], class_names, mode: str):
+        self.vectorizer = Vectorizer(list(vocabulary), sequence_length)
+        self.embeddings = embeddings
+        self.embedding_scales = embedding_scales
+        # forward kernel, recurrent kernel, bias, then the same for the backward direction
+        self.lstm_weights = [weights.astype(np.float16) for weights in lstm_weights]
+        self.dense_weights = [weights.astype(np.float16) for weights in dense_weights]
+        self.class_names = np.asarray(class_names)
+        self.mode = mode
+        self.encoder = EmbeddingEncoder(self.vectorizer, embeddings, embedding_scales)
+        self._padding_states = self._run_padding()
+
+    @classmethod
+    def from_keras(cls, model, class_names, mode: str = "int8") -> "QuantizedIntentClassifier":
+        """Quantize a trained TextVectorization -> Embedding -> Bidirectional(LSTM) -> Dense model"""
+        if mode not in ("int8", "float16"):
+            raise ValueError(f"Unknown quantization mode {mode!r}; expected int8 or float16")
+        vectorizer = find_layer(model, "TextVectorization")
+        bidirectional = find_layer(model, "Bidirectional")
+        table = find_layer(model, "Embedding").get_weights()[0]
+        if mode == "int8":
+            # Symmetric per-row scales: every token vector keeps its own range
+            scales = np.abs(table).max(axis=1) / 127
+            scales[scales == 0] = 1
+            embeddings = np.round(table / scales[:, None]).astype(np.int8)
+            scales = scales.astype(np.float32)
+        else:
+            embeddings, scales = table.astype(np.float16), None
+        return cls(
+            vectorizer.get_vocabulary(), vectorizer.get_config()["output_sequence_length"], embeddings, scales,
+            bidirectional.forward_layer.get_weights() + bidirectional.backward_layer.get_weights(),
+            find_layer(model, "Dense").get_weights(), class_names, mode,
+        )
+
+    def save(self, models_dir: str = "./models") -> str:
+        os.makedirs(models_dir, exist_ok=True)
+        path = os.path.join(models_dir, self.filename)
+        vocabulary = [""] * 2 + sorted(self.vectorizer.token_ids, key=self.vectorizer.token_ids.get)
+        arrays = {f"lstm_{i}": weights for i, weights in enumerate(self.lstm_weights)}
+        arrays.update({f"dense_{i}": weights for i, weights in enumerate(self.dense_weights)})
+        if self.embedding_scales is not None:
+            arrays["embedding_scales"] = self.embedding_scales
+        np.savez(
+            path, vocabulary=np.array(vocabulary, dtype=str), sequence_length=np.array(self.vectorizer.sequence_length),
+            embeddings=self.embeddings, class_names=self.class_names.astype(str), mode=np.array(self.mode), **arrays
+        )
+        return path
+
+    @classmethod
+    def load(cls, models_dir: str = "./models") -> "QuantizedIntentClassifier":
+        with np.load(os.path.join(models_dir, cls.filename), allow_pickle=False) as state:
+            return cls(
+                state["vocabulary"], int(state["sequence_length"]), state["embeddings"],
+                state["embedding_scales"] if "embedding_scales" in state else None,
+                [state[f"lstm_{i}"] for i in range(6)], [state[f"dense_{i}"] for i in range(2)],
+                state["class_names"], str(state["mode"]),
+            )
+
+    def _embed(self, ids: np.ndarray) -> np.ndarray:
+        rows = self.embeddings[ids].astype(np.float32)
+        if self.embedding_scales is not None:
+            rows *= self.embedding_scales[ids][..., None]
+        return rows
+
+    @staticmethod
+    def _lstm(inputs: np.ndarray, kernel: np.ndarray, recurrent: np.ndarray, bias: np.ndarray,
+              state: tuple) -> tuple:
+        """Run (batch, steps, features) inputs through one LSTM direction; Keras gate order i, f, c, o"""
+        kernel, recurrent, bias = kernel.astype(np.float32), recurrent.astype(np.float32), bias.astype(np.float32)
+        units = recurrent.shape[0]
+        projected = inputs @ kernel + bias
+        h, c = state
+        for step in range(inputs.shape[1]):
+            z = projected[:, step] + h @ recurrent
+            i = sigmoid(z[:, :units])
+            f = sigmoid(z[:, units:2 * units])
+            g = np.tanh(z[:, 2 * units:3 * units])
+            o = sigmoid(z[:, 3 * units:])
+            c = f * c + i * g
+            h = o * np.tanh(c)
+        return h, c
+
+    def _run_padding(self) -> List[tuple]:
+        """Backward-direction state after k padding tokens, for k = 0..sequence_length.
+
+        Padding is at the end, so the backward pass always starts on padding
+        from a zero state; starting from these states skips those steps exactly.
+        """
+        kernel, recurrent, bias = self.lstm_weights[3:]
+        units = recurrent.shape[0]
+        state = (np.zeros((1, units), dtype=np.float32), np.zeros((1, units), dtype=np.float32))
+        padding = self._embed(np.zeros((1, 1), dtype=np.int64))
+        states = [state]
+        for _ in range(self.vectorizer.sequence_length):
+            state = self._lstm(padding, kernel, recurrent, bias, state)
+            states.append(state)
+        return states
+
+    def predict_proba(self, texts: List[str]) -> np.ndarray:
+        ids = self.vectorizer(texts)
+        x = self._embed(ids)
+        batch, steps = ids.shape
+        units = self.lstm_weights[1].shape[0]
+        zeros = np.zeros((batch, units), dtype=np.float32)
+
+        forward, _ = self._lstm(x, *self.lstm_weights[:3], (zeros, zeros))
+        longest = int((ids > 0).sum(axis=1).max()) if batch else 0
+        h, c = self._padding_states[steps - longest]
+        backward, _ = self._lstm(x[:, longest - 1::-1] if longest else x[:, :0], *self.lstm_weights[3:],
+                                 (np.repeat(h, batch, axis=0), np.repeat(c, batch, axis=0)))
+
+        kernel, bias = self.dense_weights
+        scores = np.concatenate([forward, backward], axis=1) @ kernel.astype(np.float32) + bias.astype(np.float32)
+        scores -= scores.max(axis=1, keepdims=True)
+        np.exp(scores, out=scores)
+        return scores / scores.sum(axis=1, keepdims=True)
+
+    def classify(self, text: str) -> str:
+        return str(self.class_names[int(np.argmax(self.predict_proba([text])[0]))])
+
+    def classify_batch(self, texts: List[str]) -> List[str]:
+        if not texts:
+            return []
+        return [str(name) for name in self.class_names[self.predict_proba(texts).argmax(axis=1)]]
+
+    def weights_bytes(self) -> int:
+        arrays = [self.embeddings, *self.lstm_weights, *self.dense_weights]
+        if self.embedding_scales is not None:
+            arrays.append(self.embedding_scales)
+        return sum(array.nbytes for array in arrays)
+
+    def warmup(self) -> float:
+        started = time.perf_counter()
+        self.classify_batch(["warmup"])
+        return time.perf_counter() - started
+
+
+BACKENDS = {
+    KerasIntentClassifier.name: KerasIntentClassifier,
+    TfidfIntentClassifier.name: TfidfIntentClassifier,
+    HashedIntentClassifier.name: HashedIntentClassifier,
+    QuantizedIntentClassifier.name: QuantizedIntentClassifier,
+}
+
+
+def load_intent_classifier(backend: Optional[str] = None, models_dir: str = "./models"):
+    """The classifier named by INTENT_MODEL_BACKEND (or `backend`), loaded from models_dir"""
+    backend = backend or INTENT_MODEL_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown INTENT_MODEL_BACKEND {backend!r}; expected one of {', '.join(BACKENDS)}")
+    return BACKENDS[backend].load(models_dir)
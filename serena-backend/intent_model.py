@@ -0,0 +1,194 @@
+"""NumPy views of the trained Keras intent model.
+
+The model in models/chatbot.keras is TextVectorization -> Embedding ->
+BiLSTM -> Dense. Pieces of it are useful outside a TensorFlow call: the
+vectorizer's vocabulary and the embedding table are plain arrays, so text can
+be tokenized and embedded with NumPy alone, without building a tf.data
+pipeline per call. BatchClassifier uses the same split for bulk labeling and
+for serving: NumPy tokenizes, and only the layers after TextVectorization run
+in TensorFlow, as one traced (optionally XLA-compiled) function.
+"""
+import hashlib
+import re
+import time
+from typing import Iterable, List, Optional
+
+import numpy as np
+import tensorflow as tf
+
+# Same characters Keras strips for standardize="lower_and_strip_punctuation"
+STRIP_PUNCTUATION = re.compile(r'[!"#$%&()\*\+,\-\./:;<=>?@\[\\\]\^_`{|}~\']')
+
+
+def iter_layers(model) -> Iterable:
+    """All layers of a model, descending into nested models"""
+    for layer in getattr(model, "layers", []):
+        yield layer
+        yield from iter_layers(layer)
+
+
+def find_layer(model, class_name: str):
+    return next((layer for layer in iter_layers(model) if type(layer).__name__ == class_name), None)
+
+
+class Vectorizer:
+    """NumPy replica of the model's TextVectorization layer (whitespace split, padded token ids)"""
+
+    def __init__(self, vocabulary: List[str], sequence_length: int):
+        self.sequence_length = sequence_length
+        # Index 0 is padding and 1 is the out-of-vocabulary token, as in Keras
+        self.token_ids = {token: index for index, token in enumerate(vocabulary) if index > 1}
+
+    @classmethod
+    def from_layer(cls, layer) -> "Vectorizer":
+        return cls(layer.get_vocabulary(), layer.get_config()["output_sequence_length"])
+
+    def tokenize(self, text: str) -> List[str]:
+        return STRIP_PUNCTUATION.sub("", text.lower()).split()
+
+    def __call__(self, texts: List[str]) -> np.ndarray:
+        ids = np.zeros((len(texts), self.sequence_length), dtype=np.int32)
+        for row, text in enumerate(texts):
+            tokens = self.tokenize(text)[:self.sequence_length]
+            ids[row, :len(tokens)] = [self.token_ids.get(token, 1) for token in tokens]
+        return ids
+
+
+class EmbeddingEncoder:
+    """Sentence vectors from the model's Embedding layer: mean of the token vectors, unit length"""
+
+    def __init__(self, vectorizer: Vectorizer, embeddings: np.ndarray, scales: Optional[np.ndarray] = None):
+        """`scales` marks an int8 table with one scale per row; rows are widened to float32 as they are looked up"""
+        self.vectorizer = vectorizer
+        self.embeddings = embeddings
+        self.scales = scales
+        self.dimensions = embeddings.shape[1]
+        # Identifies the weights the vectors came from, so a retrained model re-embeds everything
+        digest = hashlib.sha1(np.ascontiguousarray(embeddings).tobytes())
+        if scales is not None:
+            digest.update(scales.tobytes())
+        self.model_key = digest.hexdigest()[:16]
+
+    @classmethod
+    def from_model(cls, model) -> Optional["EmbeddingEncoder"]:
+        """None if the model has no TextVectorization + Embedding layers to borrow"""
+        vectorizer = find_layer(model, "TextVectorization")
+        embedding = find_layer(model, "Embedding")
+        if vectorizer is None or embedding is None:
+            return None
+        return cls(Vectorizer.from_layer(vectorizer), embedding.get_weights()[0])
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """(len(texts), dimensions) float16; texts with no known tokens get a zero vector"""
+        ids = self.vectorizer(texts)
+        # Out-of-vocabulary tokens carry no meaning of their own, so they are pooled out with the padding
+        mask = (ids > 1).astype(np.float32)
+        rows = self.embeddings[ids].astype(np.float32)
+        if self.scales is not None:
+            rows *= self.scales[ids][..., None]
+        pooled = np.einsum("nt,ntd->nd", mask, rows)
+        counts = mask.sum(axis=1, keepdims=True)
+        pooled /= np.maximum(counts, 1)
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        pooled /= np.where(norms > 0, norms, 1)
+        return pooled.astype(np.float16)
+
+
+def weights_key(model, class_names) -> str:
+    """Identifies a trained model and its label set, e.g. to tell whether stored labels are stale"""
+    digest = hashlib.sha1()
+    for weights in model.get_weights():
+        digest.update(np.ascontiguousarray(weights).tobytes())
+    digest.update("\n".join(str(name) for name in class_names).encode())
+    return digest.hexdigest()[:16]
+
+
+# Batch shapes the XLA-compiled path is built for: larger batches are split and
+# smaller ones padded up, so XLA compiles each of these once and nothing else
+SERVING_BATCH_SIZES = (1, 8, 32, 128, 512)
+
+
+class BatchClassifier:
+    """Intent labels for many texts at once.
+
+    When the model's top level starts with TextVectorization, tokenizing is
+    done by Vectorizer and the remaining layers run as one tf.function with a
+    fixed (batch, sequence_length) int32 signature, optionally compiled by
+    XLA; otherwise the whole model is called on the strings. predict()
+    classifies each distinct text once.
+    """
+
+    def __init__(self, model, class_names, batch_size: int = 4096, jit_compile: bool = False):
+        self.model = model
+        self.class_names = np.asarray(class_names)
+        self.batch_size = batch_size
+        self.key = weights_key(model, class_names)
+
+        names = [type(layer).__name__ for layer in model.layers]
+        self.vectorizer = None
+        self.jit_compile = False
+        if "TextVectorization" in names:
+            position = names.index("TextVectorization")
+            self.vectorizer = Vectorizer.from_layer(model.layers[position])
+            self._head = model.layers[position + 1:]
+            self._run_head = self._trace(jit_compile)
+
+    def _trace(self, jit_compile: bool):
+        head = self._head
+        signature = [tf.TensorSpec([None, self.vectorizer.sequence_length], tf.int32)]
+
+        @tf.function(input_signature=signature, jit_compile=jit_compile)
+        def run_head(ids):
+            for layer in head:
+                ids = layer(ids, training=False)
+            return ids
+
+        self.jit_compile = jit_compile
+        return run_head
+
+    def probabilities(self, texts: List[str]) -> np.ndarray:
+        """(len(texts), classes) softmax output"""
+        if self.vectorizer is None:
+            return self.model.predict(np.array(texts, dtype=object), batch_size=self.batch_size, verbose=0)
+        ids = self.vectorizer(texts)
+        if not self.jit_compile:
+            return self._run_head(tf.constant(ids)).numpy()
+
+        outputs = []
+        largest = SERVING_BATCH_SIZES[-1]
+        for start in range(0, len(ids), largest):
+            chunk = ids[start:start + largest]
+            size = next(size for size in SERVING_BATCH_SIZES if size >= len(chunk))
+            padded = np.zeros((size, ids.shape[1]), dtype=np.int32)
+            padded[:len(chunk)] = chunk
+            outputs.append(self._run_head(tf.constant(padded)).numpy()[:len(chunk)])
+        return np.concatenate(outputs)
+
+    def warmup(self) -> float:
+        """Trace the serving function for every batch shape (compiling it, with XLA); returns seconds taken.
+
+        If XLA cannot compile the model here, serving continues with the uncompiled function.
+        """
+        started = time.perf_counter()
+        try:
+            for size in SERVING_BATCH_SIZES:
+                self.probabilities(["warmup"] * size)
+        except (tf.errors.OpError, NotImplementedError, ValueError) as e:
+            if not self.jit_compile:
+                raise
+            print(f"XLA compilation failed, serving the intent model without it: {e}")
+            self._run_head = self._trace(False)
+            for size in SERVING_BATCH_SIZES:
+                self.probabilities(["warmup"] * size)
+        return time.perf_counter() - started
+
+    def predict(self, texts: List[str]) -> np.ndarray:
+        """Class name per text, in input order"""
+        if not texts:
+            return self.class_names[:0]
+        unique, inverse = np.unique(np.array(texts, dtype=object), return_inverse=True)
+        labels = np.empty(len(unique), dtype=np.int64)
+        for start in range(0, len(unique), self.batch_size):
+            batch = list(unique[start:start + self.batch_size])
+            labels[start:start + len(batch)] = self.probabilities(batch).argmax(axis=1)
+        return self.class_names[labels[inverse]]
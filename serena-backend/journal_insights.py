@@ -0,0 +1,152 @@
+"""Incremental journal insights: themes, entry length and mood by time of week.
+
+Every create, update or delete of a journal entry queues a change through
+triggers on journal_entries: +1 with the new text, -1 with the old. Each
+user has one packed row in journal_insights:
+
+  * terms        newline-joined, most frequent first
+  * term_counts  int32 occurrences, parallel to terms
+  * slot_*       int32[7 * 24] entries, mood sum and mood count by weekday x hour
+
+Reading a user's insights first folds any queued changes into their row.
+The cost depends on how much changed since the last read, never on how many
+entries exist. Top terms are the first lines of the blob, so answering
+takes milliseconds even for years of journaling.
+"""
+import re
+from collections import Counter
+from typing import Dict, List
+
+import numpy as np
+
+from database import JournalInsightsDatabase
+
+CHANGE_CHUNK = 2000
+SLOTS = 7 * 24
+WEEKDAYS = ("Sunday", "Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday")
+
+WORD = re.compile(r"[a-z]+(?:'[a-z]+)*")
+STOPWORDS = frozenset("""
+    a about above after again against all also am an and any are arent as at be because been before being
+    below between both but by can cant could couldnt did didnt do does doesnt doing dont down during each
+    even ever every few for from further get got had hadnt has hasnt have havent having he her here hers
+    herself him himself his how however i id if ill im in into is isnt it its itself ive just know let like
+    lot me more most much must my myself no nor not now of off on once one only or other ought our ours
+    ourselves out over own really same shant she should shouldnt so some still such than that thats the
+    their theirs them themselves then there theres these they theyre thing things this those though
+    through to today too under until up us very was wasnt way we well were werent what when where which
+    while who whom why will with wont would wouldnt yet you youre your yours yourself yourselves
+""".split())
+
+
+def words(text: str) -> List[str]:
+    return [word.replace("'", "") for word in WORD.findall(text.lower())]
+
+
+def themes(tokens: List[str]) -> List[str]:
+    """Words worth counting as themes: no stopwords, at least three letters"""
+    return [token for token in tokens if len(token) >= 3 and token not in STOPWORDS]
+
+
+class InsightState:
+    """A user's folded insights as arrays"""
+
+    def __init__(self, state: Dict = None):
+        state = state or {}
+        self.last_change_id = state.get("last_change_id", 0)
+        self.entry_count = state.get("entry_count", 0)
+        self.word_count = state.get("word_count", 0)
+        self.terms_blob = state.get("terms", b"")
+        self.term_counts = np.frombuffer(state.get("term_counts", b""), dtype=np.int32)
+        self.slot_entries = self._slots(state.get("slot_entries"))
+        self.slot_mood_sum = self._slots(state.get("slot_mood_sum"))
+        self.slot_mood_count = self._slots(state.get("slot_mood_count"))
+
+    @staticmethod
+    def _slots(blob) -> np.ndarray:
+        return np.frombuffer(blob, dtype=np.int32).copy() if blob else np.zeros(SLOTS, dtype=np.int32)
+
+    def apply(self, changes: List[tuple]):
+        """Fold (id, sign, text, mood_level, weekday, hour) changes in"""
+        counts = Counter()
+        if self.terms_blob:
+            counts.update(dict(zip(self.terms_blob.decode().split("\n"), self.term_counts.tolist())))
+        for _, sign, text, mood_level, weekday, hour in changes:
+            tokens = words(text)
+            self.entry_count += sign
+            self.word_count += sign * len(tokens)
+            for term, count in Counter(themes(tokens)).items():
+                counts[term] += sign * count
+            if weekday is not None and hour is not None:
+                slot = weekday * 24 + hour
+                self.slot_entries[slot] += sign
+                if mood_level is not None:
+                    self.slot_mood_sum[slot] += sign * mood_level
+                    self.slot_mood_count[slot] += sign
+        self.last_change_id = changes[-1][0]
+
+        # Most frequent first, so the top terms are the first lines of the blob
+        ranked = sorted(((count, term) for term, count in counts.items() if count > 0), key=lambda item: (-item[0], item[1]))
+        self.terms_blob = "\n".join(term for _, term in ranked).encode()
+        self.term_counts = np.array([count for count, _ in ranked], dtype=np.int32)
+
+    def to_state(self) -> Dict:
+        return {
+            "last_change_id": self.last_change_id,
+            "entry_count": self.entry_count,
+            "word_count": self.word_count,
+            "terms": self.terms_blob,
+            "term_counts": self.term_counts.astype(np.int32).tobytes(),
+            "slot_entries": self.slot_entries.tobytes(),
+            "slot_mood_sum": self.slot_mood_sum.tobytes(),
+            "slot_mood_count": self.slot_mood_count.tobytes(),
+        }
+
+    def top_terms(self, limit: int) -> List[Dict]:
+        if not self.terms_blob or limit <= 0:
+            return []
+        terms = self.terms_blob.split(b"\n", limit)[:limit]
+        return [{"term": term.decode(), "count": int(count)} for term, count in zip(terms, self.term_counts[:limit])]
+
+
+def refresh(user_id: str) -> InsightState:
+    """The user's insights with every queued change folded in"""
+    while True:
+        stored = JournalInsightsDatabase.get_state(user_id)
+        state = InsightState(stored)
+        expected = state.last_change_id
+        changed = False
+        while True:
+            changes = JournalInsightsDatabase.get_changes(user_id, state.last_change_id, CHANGE_CHUNK)
+            if not changes:
+                break
+            state.apply(changes)
+            changed = True
+        if not changed or JournalInsightsDatabase.save_state(user_id, expected, state.to_state()):
+            return state
+        # Another request folded the same changes first; start again from its result
+
+
+def by_slot(key: str, labels, entries: np.ndarray, mood_sum: np.ndarray, mood_count: np.ndarray) -> List[Dict]:
+    return [
+        {
+            key: label,
+            "entries": int(entries[i]),
+            "average_mood": round(int(mood_sum[i]) / int(mood_count[i]), 2) if mood_count[i] else None,
+        }
+        for i, label in enumerate(labels)
+    ]
+
+
+def get_insights(user_id: str, top: int = 20) -> Dict:
+    state = refresh(user_id)
+    entries = state.slot_entries.reshape(7, 24)
+    mood_sum = state.slot_mood_sum.reshape(7, 24)
+    mood_count = state.slot_mood_count.reshape(7, 24)
+    return {
+        "entry_count": state.entry_count,
+        "average_words": round(state.word_count / state.entry_count, 1) if state.entry_count else 0,
+        "top_terms": state.top_terms(top),
+        "by_weekday": by_slot("weekday", WEEKDAYS, entries.sum(axis=1), mood_sum.sum(axis=1), mood_count.sum(axis=1)),
+        "by_hour": by_slot("hour", range(24), entries.sum(axis=0), mood_sum.sum(axis=0), mood_count.sum(axis=0)),
+    }
@@ -1,22 +1,46 @@
-from fastapi import FastAPI, status, HTTPException, Depends
+from fastapi import FastAPI, status, HTTPException, Depends, Header, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse, JSONResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.websockets import WebSocketState
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel, EmailStr, validator
-from typing import Optional, List
+from typing import Any, Optional, List
 import numpy as np
+import asyncio
 import tensorflow as tf
 import json
 import os
 import re
 import random
 import string
+import time
+import zlib
+from collections import deque
 from datetime import datetime, timedelta
 from tensorflow.keras.layers import TextVectorization
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from dotenv import load_dotenv
 from google import genai
 import jwt
 from passlib.context import CryptContext
-from database import Database, MoodDatabase, JournalDatabase, GoalsDatabase
+from database import Database, MoodDatabase, JournalDatabase, GoalsDatabase, AccountPurgeDatabase, ResourceVersionDatabase
+import account_purge
+import db_maintenance
+import data_transfer
+import offline_sync
+import journal_insights
+from correlations import CorrelationCache
+from semantic_search import SemanticIndex
+from crisis_detection import CrisisDetector
+from intent_classifiers import INTENT_MODEL_BACKEND, KerasIntentClassifier, QuantizedIntentClassifier, load_intent_classifier
+from inference_sidecar import INTENT_SIDECAR_SOCKET, SidecarClient, SidecarIntentClassifier
+from idempotency import IdempotencyStore, IdempotencyConflict, fingerprint
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 load_dotenv()
 
@@ -121,6 +145,7 @@ class PredictResponse(BaseModel):
     intent: str
     response: str
     conversation_id: int
+    crisis: bool = False
 
 # Conversation Models
 class ConversationCreate(BaseModel):
@@ -195,6 +220,9 @@ class GoalUpdate(BaseModel):
 class GoalProgressUpdate(BaseModel):
     current_value: int
 
+class SyncRequest(BaseModel):
+    operations: List[Any]  # validated one by one in offline_sync
+
 class GoalResponse(BaseModel):
     id: int
     user_id: str
@@ -212,6 +240,50 @@ class GoalResponse(BaseModel):
     updated_at: str
     completed_at: Optional[str]
 
+# Response serialization
+# With SERENE_DEBUG set, list endpoints hand their rows back to FastAPI so every
+# item is validated against its response_model; otherwise the row dicts from
+# database.py (already in the response shape) are serialized directly.
+SERENE_DEBUG = os.getenv("SERENE_DEBUG", "").lower() in ("1", "true", "yes")
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson when it is installed"""
+    def render(self, content) -> bytes:
+        if orjson is None:
+            return super().render(content)
+        return orjson.dumps(content)
+
+def fast_response(content, response: Optional[Response] = None):
+    """`response` is the endpoint's injected Response; headers set on it are kept"""
+    if SERENE_DEBUG:
+        return content
+    # Returning a Response skips response_model validation and jsonable_encoder
+    return FastJSONResponse(content, headers=dict(response.headers) if response else None)
+
+# Conditional GET
+# Listing ETags come from per-user version counters that database triggers bump
+# on every write, so a matching If-None-Match is answered without the list query.
+LISTING_CACHE_CONTROL = "private, no-cache"
+
+def check_etag(request: Request, response: Response, user_id: str, resource: str, *variant) -> Optional[Response]:
+    """Set the listing's weak ETag on `response`; returns a 304 if the client already has it"""
+    version = ResourceVersionDatabase.get_version(user_id, resource)
+    # Query parameters change the body, so they are part of the tag
+    etag = f'W/"{resource}-{version}-{zlib.crc32(repr(variant).encode()):08x}"'
+    headers = {"ETag": etag, "Cache-Control": LISTING_CACHE_CONTROL}
+    
+    if_none_match = request.headers.get("if-none-match", "")
+    # Weak comparison: W/ prefixes are ignored on both sides
+    client_tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    if if_none_match.strip() == "*" or etag.removeprefix("W/") in client_tags:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    
+    response.headers.update(headers)
+    return None
+
+# Responses smaller than this are sent uncompressed
+GZIP_MINIMUM_SIZE = int(os.getenv("GZIP_MINIMUM_SIZE", "1000"))
+
 app = FastAPI()
 app.add_middleware(
     CORSMiddleware,
@@ -220,65 +292,103 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MINIMUM_SIZE, compresslevel=6)
 
 gemini_client = None
+crisis_detector = None
+model = None
+semantic_index = None
+intent_classifier = None
+# Set once the classifier has been warmed up, or has given up; /health/ready reports it
+model_ready = False
+warmup_error = None
+warmup_task = None
+# Tries before serving without the compiled path, with 2s, 4s, ... between them
+WARMUP_ATTEMPTS = max(1, int(os.getenv("WARMUP_ATTEMPTS", "3")))
 if GEMINI_API_KEY:
     gemini_client = client
 @app.on_event("startup")
 async def load_model():
-    global model, class_names, responses
-    model = tf.keras.models.load_model(
-        "./models/chatbot.keras",
-        custom_objects={"TextVectorization": TextVectorization},
-        compile=False
-    )
-    class_names = np.load("./models/classes.npy", allow_pickle=True)
+    global model, class_names, responses, semantic_index, intent_classifier, warmup_task, crisis_detector
+    # Loaded first: the crisis fast path does not depend on the model
+    crisis_detector = CrisisDetector.load()
+    print(f"Crisis phrases v{crisis_detector.version}: {crisis_detector.phrase_count} phrases")
     with open("./models/dataset.json", "r") as f:
         data = json.load(f)
     responses = {
         intent["tag"]: intent.get("responses", [])
         for intent in data.get("intents", [])
     }
-@app.post("/predict", response_model=PredictResponse)
-async def predict(req: PredictRequest, credentials: HTTPAuthorizationCredentials = Depends(security)):
-    # Verify user authentication
-    try:
-        token = credentials.credentials
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
-        
-        if user_id is None:
-            raise HTTPException(status_code=401, detail="Invalid authentication")
-    except jwt.PyJWTError:
-        raise HTTPException(status_code=401, detail="Invalid authentication")
-    
-    # Get or create conversation
-    conversation_id = req.conversation_id
-    if not conversation_id:
-        # Create new conversation with auto-generated title
-        conversation_id = Database.create_conversation(user_id, "New Chat")
+    if INTENT_SIDECAR_SOCKET:
+        # Inference runs in inference_sidecar.py; the model is only loaded here if the sidecar fails
+        intent_classifier = SidecarIntentClassifier(SidecarClient(INTENT_SIDECAR_SOCKET), INTENT_MODEL_BACKEND)
+        class_names = intent_classifier.class_names
+        semantic_index = SemanticIndex(intent_classifier.encoder) if intent_classifier.encoder else None
+    elif INTENT_MODEL_BACKEND == QuantizedIntentClassifier.name:
+        # No float32 weights in memory: semantic search shares the quantized embedding table
+        intent_classifier = load_intent_classifier(INTENT_MODEL_BACKEND)
+        class_names = intent_classifier.class_names
+        semantic_index = SemanticIndex(intent_classifier.encoder)
     else:
-        # Verify user owns this conversation
-        conv = Database.get_conversation(conversation_id, user_id)
-        if not conv:
-            raise HTTPException(status_code=403, detail="Access denied to this conversation")
-    
-    # Save user message
-    Database.add_message(conversation_id, "user", req.text)
-    
-    # Generate AI response
-    texts = np.array([req.text], dtype=object)
-    preds = model.predict(texts)
-    idx = int(np.argmax(preds, axis=1)[0])
-    intent = class_names[idx]
-    
-    if gemini_client:
+        model = tf.keras.models.load_model(
+            "./models/chatbot.keras",
+            custom_objects={"TextVectorization": TextVectorization},
+            compile=False
+        )
+        class_names = np.load("./models/classes.npy", allow_pickle=True)
+        semantic_index = SemanticIndex.from_model(model)
+        # The Keras model stays loaded for semantic search whichever other backend classifies
+        if INTENT_MODEL_BACKEND == KerasIntentClassifier.name:
+            intent_classifier = KerasIntentClassifier(model, class_names)
+        else:
+            intent_classifier = load_intent_classifier(INTENT_MODEL_BACKEND)
+    print(f"Intent classifier: {intent_classifier.name}")
+    # Warm up off the startup path: the worker is live at once and ready when this finishes
+    warmup_task = asyncio.create_task(run_in_threadpool(warm_up_intent_classifier))
+
+def warm_up_intent_classifier():
+    """Trace and compile the serving path for the common batch sizes before taking traffic"""
+    global model_ready, warmup_error
+    for attempt in range(1, WARMUP_ATTEMPTS + 1):
         try:
-            # Get conversation history for context (last 10 messages)
-            history = Database.get_conversation_messages(conversation_id, user_id, limit=10)
-            context = "\n".join([f"{msg['role']}: {msg['content']}" for msg in history[-5:]])  # Last 5 messages
-            
-            prompt = f"""You are a mental wellness support chatbot.
+            seconds = intent_classifier.warmup()
+        except Exception as e:
+            warmup_error = str(e)
+            print(f"Intent classifier warmup failed (attempt {attempt}/{WARMUP_ATTEMPTS}): {e}")
+            if attempt < WARMUP_ATTEMPTS:
+                time.sleep(2 ** attempt)
+            continue
+        warmup_error = None
+        model_ready = True
+        print(f"Intent classifier warmed up in {seconds:.2f}s")
+        return
+    # /predict still classifies, only slower on first use; readiness reports why
+    model_ready = True
+
+@app.on_event("startup")
+async def resume_account_purges():
+    account_purge.resume_unfinished_purges()
+
+@app.on_event("startup")
+async def start_db_maintenance():
+    if db_maintenance.MAINTENANCE_ENABLED:
+        db_maintenance.start_scheduler()
+
+@app.on_event("shutdown")
+async def stop_db_maintenance():
+    db_maintenance.stop_scheduler()
+
+def classify_intent(text: str) -> str:
+    return intent_classifier.classify(text)
+
+def detect_crisis(text: str) -> bool:
+    """True if the message contains a phrase from models/crisis_phrases.json"""
+    return bool(crisis_detector and crisis_detector.match(text))
+
+def build_prompt(history: List[dict], text: str) -> str:
+    """Gemini prompt for a chat turn; history is the most recent messages, oldest first"""
+    context = "\n".join([f"{msg['role']}: {msg['content']}" for msg in history])
+    return f"""You are a mental wellness support chatbot.
 
 Your purpose is to provide empathetic, supportive, and calming responses to users who may be experiencing stress, anxiety, sadness, or emotional overwhelm.
 
@@ -306,33 +416,284 @@ Recent conversation context:
 {context}
 
 Current user message:
-"{req.text}"
+"{text}"
 
 Respond in a calm, supportive, and understanding tone.
 Keep the response concise, helpful, and reassuring."""
-            
-            response = gemini_client.models.generate_content(
-                model='gemini-2.0-flash-exp',
-                contents=prompt
-            )
-            reply = response.text.strip()
-        except Exception as e:
-            print(f"Gemini API error: {e}")
-            reply = "I'm having trouble connecting right now. Please try again."
+
+def conversation_title(text: str) -> str:
+    """Use first few words of user's message as title"""
+    return text[:50] + ("..." if len(text) > 50 else "")
+
+GEMINI_MODEL = 'gemini-2.0-flash-exp'
+GEMINI_ERROR_REPLY = "I'm having trouble connecting right now. Please try again."
+GEMINI_MISSING_REPLY = "Gemini API is not configured."
+CONTEXT_MESSAGES = 5
+
+# Results of /predict calls made with an Idempotency-Key, so client retries
+# neither duplicate the user's message nor pay for a second Gemini call
+predict_results = IdempotencyStore(
+    max_entries=int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "10000")),
+    ttl_seconds=float(os.getenv("IDEMPOTENCY_TTL_SECONDS", str(24 * 3600)))
+)
+
+# Mood / journal / chat correlations per user, recomputed only after new data
+correlation_cache = CorrelationCache()
+
+@app.post("/predict", response_model=PredictResponse)
+async def predict(
+    req: PredictRequest,
+    response: Response,
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    idempotency_key: Optional[str] = Header(None, max_length=255)
+):
+    # Verify user authentication
+    try:
+        token = credentials.credentials
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        user_id: str = payload.get("sub")
+        
+        if user_id is None:
+            raise HTTPException(status_code=401, detail="Invalid authentication")
+    except jwt.PyJWTError:
+        raise HTTPException(status_code=401, detail="Invalid authentication")
+    if not Database.get_user(user_id):
+        raise HTTPException(status_code=401, detail="Invalid authentication")
+    
+    if not idempotency_key:
+        return await answer_predict(user_id, req)
+    
+    try:
+        result, replayed = await predict_results.run(
+            (user_id, idempotency_key),
+            fingerprint({"text": req.text, "conversation_id": req.conversation_id}),
+            lambda: answer_predict(user_id, req)
+        )
+    except IdempotencyConflict:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request")
+    if replayed:
+        response.headers["Idempotency-Replayed"] = "true"
+    return result
+
+async def answer_predict(user_id: str, req: PredictRequest) -> PredictResponse:
+    """One chat turn: persist the message, classify it, ask Gemini and persist the reply.
+    Only the Gemini call leaves the event loop; the writes stay where the other endpoints make them."""
+    # Get or create conversation
+    conversation_id = req.conversation_id
+    if not conversation_id:
+        # Create new conversation with auto-generated title
+        conversation_id = Database.create_conversation(user_id, "New Chat")
     else:
-        reply = "Gemini API is not configured."
+        # Verify user owns this conversation
+        conv = Database.get_conversation(conversation_id, user_id)
+        if not conv:
+            raise HTTPException(status_code=403, detail="Access denied to this conversation")
+    
+    # Save user message
+    Database.add_message(conversation_id, "user", req.text, user_id=user_id)
+    
+    crisis = detect_crisis(req.text)
+    if crisis:
+        # Vetted reply at once: no classifier, and no Gemini round trip that could be slow or fail
+        intent, reply = crisis_detector.intent, crisis_detector.response
+        Database.flag_conversation_crisis(conversation_id, user_id)
+    else:
+        # Generate AI response
+        intent = classify_intent(req.text)
+        
+        if gemini_client:
+            try:
+                # Most recent messages, including the one just saved, for context
+                history = Database.get_recent_messages(conversation_id, CONTEXT_MESSAGES, user_id)
+                response = await run_in_threadpool(
+                    gemini_client.models.generate_content,
+                    model=GEMINI_MODEL,
+                    contents=build_prompt(history, req.text)
+                )
+                reply = response.text.strip()
+            except Exception as e:
+                print(f"Gemini API error: {e}")
+                reply = GEMINI_ERROR_REPLY
+        else:
+            reply = GEMINI_MISSING_REPLY
     
     # Save AI response
-    Database.add_message(conversation_id, "assistant", reply, intent)
+    Database.add_message(conversation_id, "assistant", reply, intent, user_id=user_id)
     
-    # Auto-generate conversation title if it's a new conversation
-    messages = Database.get_conversation_messages(conversation_id, user_id)
+    # Auto-generate conversation title if it's a new conversation; three rows are enough to tell
+    messages = Database.get_recent_messages(conversation_id, 3, user_id)
     if len(messages) == 2:  # First exchange
-        # Use first few words of user's message as title
-        title = req.text[:50] + ("..." if len(req.text) > 50 else "")
-        Database.update_conversation_title(conversation_id, user_id, title)
+        Database.update_conversation_title(conversation_id, user_id, conversation_title(req.text))
+    
+    return PredictResponse(intent=intent, response=reply, conversation_id=conversation_id, crisis=crisis)
+
+# WebSocket Chat
+WS_HEARTBEAT_SECONDS = 20
+WS_IDLE_TIMEOUT_SECONDS = 60
+WS_OUTBOX_SIZE = 64  # frames buffered for a slow client before the turn waits
+WS_INBOX_SIZE = 4    # chat messages queued behind the one being answered
+
+class ChatSession:
+    """State kept for the lifetime of one /ws/chat connection"""
+    def __init__(self, user_id: str, conversation_id: Optional[int], history: List[dict]):
+        self.user_id = user_id
+        self.conversation_id = conversation_id
+        self.history = deque(history, maxlen=CONTEXT_MESSAGES)
+        self.needs_title = not history
+
+def decode_user_id(token: str) -> Optional[str]:
+    """The token's user, or None if the token is invalid or the account deleted"""
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except jwt.PyJWTError:
+        return None
+    user_id = payload.get("sub")
+    if user_id is None or not Database.get_user(user_id):
+        return None
+    return user_id
+
+async def stream_reply(prompt: str, outbox: asyncio.Queue) -> str:
+    """Forward Gemini output to the client as token frames; returns the full reply"""
+    if not gemini_client:
+        await outbox.put({"type": "token", "text": GEMINI_MISSING_REPLY})
+        return GEMINI_MISSING_REPLY
+    
+    parts = []
+    try:
+        stream = await run_in_threadpool(
+            gemini_client.models.generate_content_stream, model=GEMINI_MODEL, contents=prompt
+        )
+        chunks = iter(stream)
+        # Pull one chunk at a time so a slow client slows the upstream read instead of buffering it
+        while (chunk := await run_in_threadpool(next, chunks, None)) is not None:
+            if chunk.text:
+                parts.append(chunk.text)
+                await outbox.put({"type": "token", "text": chunk.text})
+    except Exception as e:
+        print(f"Gemini API error: {e}")
+        if not parts:
+            await outbox.put({"type": "token", "text": GEMINI_ERROR_REPLY})
+            return GEMINI_ERROR_REPLY
+    return "".join(parts).strip()
+
+async def run_chat_turn(session: ChatSession, text: str, outbox: asyncio.Queue):
+    """One user message -> intent, streamed reply and persistence, as in /predict"""
+    if session.conversation_id is None:
+        session.conversation_id = await run_in_threadpool(Database.create_conversation, session.user_id, "New Chat")
+        await outbox.put({"type": "conversation", "conversation_id": session.conversation_id})
     
-    return PredictResponse(intent=intent, response=reply, conversation_id=conversation_id)
+    await run_in_threadpool(Database.add_message, session.conversation_id, "user", text, user_id=session.user_id)
+    session.history.append({"role": "user", "content": text})
+    
+    crisis = detect_crisis(text)
+    if crisis:
+        intent, reply = crisis_detector.intent, crisis_detector.response
+        await outbox.put({"type": "intent", "intent": intent, "crisis": True})
+        await outbox.put({"type": "token", "text": reply})
+        await run_in_threadpool(Database.flag_conversation_crisis, session.conversation_id, session.user_id)
+    else:
+        intent = await run_in_threadpool(classify_intent, text)
+        await outbox.put({"type": "intent", "intent": intent})
+        reply = await stream_reply(build_prompt(list(session.history), text), outbox)
+    await run_in_threadpool(Database.add_message, session.conversation_id, "assistant", reply, intent, user_id=session.user_id)
+    session.history.append({"role": "assistant", "content": reply})
+    await outbox.put({
+        "type": "done", "intent": intent, "response": reply, "conversation_id": session.conversation_id, "crisis": crisis
+    })
+    
+    if session.needs_title:
+        title = conversation_title(text)
+        await run_in_threadpool(Database.update_conversation_title, session.conversation_id, session.user_id, title)
+        session.needs_title = False
+        await outbox.put({"type": "title", "conversation_id": session.conversation_id, "title": title})
+
+@app.websocket("/ws/chat")
+async def chat_socket(websocket: WebSocket, token: str = "", conversation_id: Optional[int] = None):
+    """Chat over a WebSocket: authenticate once, then send {"type": "message", "text": ...} frames"""
+    user_id = decode_user_id(token)
+    if user_id is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    
+    history = []
+    if conversation_id:
+        if not Database.get_conversation(conversation_id, user_id):
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+            return
+        history = Database.get_recent_messages(conversation_id, CONTEXT_MESSAGES, user_id)
+    
+    await websocket.accept()
+    session = ChatSession(user_id, conversation_id, history)
+    outbox = asyncio.Queue(maxsize=WS_OUTBOX_SIZE)
+    inbox = asyncio.Queue(maxsize=WS_INBOX_SIZE)
+    loop = asyncio.get_running_loop()
+    last_seen = loop.time()
+    
+    def notify(frame: dict):
+        # Control frames are dropped rather than waiting behind a full outbox
+        try:
+            outbox.put_nowait(frame)
+        except asyncio.QueueFull:
+            pass
+    
+    async def receive():
+        nonlocal last_seen
+        while True:
+            try:
+                raw = await websocket.receive_text()
+            except WebSocketDisconnect:
+                return
+            last_seen = loop.time()
+            try:
+                frame = json.loads(raw)
+            except ValueError:
+                notify({"type": "error", "detail": "Frames must be JSON"})
+                continue
+            kind = frame.get("type") if isinstance(frame, dict) else None
+            if kind == "message":
+                text = str(frame.get("text") or "").strip()
+                if not text:
+                    notify({"type": "error", "detail": "Message text is required"})
+                    continue
+                try:
+                    inbox.put_nowait(text)
+                except asyncio.QueueFull:
+                    notify({"type": "error", "detail": "Too many messages in flight, please wait"})
+            elif kind == "ping":
+                notify({"type": "pong"})
+            elif kind != "pong":
+                notify({"type": "error", "detail": f"Unknown frame type: {kind}"})
+    
+    async def answer():
+        while True:
+            text = await inbox.get()
+            try:
+                await run_chat_turn(session, text, outbox)
+            except Exception as e:
+                print(f"Chat socket error: {e}")
+                await outbox.put({"type": "error", "detail": "Failed to process message"})
+    
+    async def send():
+        while True:
+            await websocket.send_json(await outbox.get())
+    
+    async def heartbeat():
+        while True:
+            await asyncio.sleep(WS_HEARTBEAT_SECONDS)
+            if loop.time() - last_seen > WS_IDLE_TIMEOUT_SECONDS:
+                return
+            notify({"type": "ping"})
+    
+    await outbox.put({"type": "ready", "conversation_id": session.conversation_id})
+    tasks = [asyncio.create_task(coro) for coro in (receive(), answer(), send(), heartbeat())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.wait(tasks)
+        if websocket.client_state == WebSocketState.CONNECTED:
+            await websocket.close()
 
 @app.get("/")
 def root():
@@ -342,6 +703,25 @@ def root():
 def health_check():
     return {"status": "healthy"}
 
+@app.get("/health/live", status_code=status.HTTP_200_OK)
+def liveness_check():
+    """The process is up and serving requests"""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+def readiness_check():
+    """503 until the intent classifier is loaded and warmed up, so load balancers skip cold workers.
+    A worker whose warmup kept failing is ready without it and reports the error."""
+    if not model_ready:
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content={"status": "warming_up"})
+    serving = getattr(intent_classifier, "serving", None)
+    return {
+        "status": "ready",
+        "intent_backend": intent_classifier.name,
+        "xla": bool(serving and serving.jit_compile and not warmup_error),
+        "warmup_error": warmup_error,
+    }
+
 # Authentication Endpoints
 @app.post("/auth/send-otp")
 async def send_otp(request: OTPRequest):
@@ -494,7 +874,8 @@ def create_access_token(data: dict):
     return encoded_jwt
 
 # Helper function to get current user from token
-async def get_current_user_id(credentials: HTTPAuthorizationCredentials = Depends(security)) -> str:
+async def get_token_user_id(credentials: HTTPAuthorizationCredentials = Depends(security)) -> str:
+    """The token's user, even if the account was deleted; only for the account deletion endpoints"""
     try:
         token = credentials.credentials
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
@@ -505,15 +886,26 @@ async def get_current_user_id(credentials: HTTPAuthorizationCredentials = Depend
     except jwt.PyJWTError:
         raise HTTPException(status_code=401, detail="Invalid authentication")
 
+async def get_current_user_id(user_id: str = Depends(get_token_user_id)) -> str:
+    # Tokens of deleted accounts stop working at once, so nothing is written behind the purge
+    if not Database.get_user(user_id):
+        raise HTTPException(status_code=401, detail="Invalid authentication")
+    return user_id
+
 # Conversation Management Endpoints
 @app.get("/conversations", response_model=List[ConversationResponse])
 async def get_conversations(
+    request: Request,
+    response: Response,
     include_archived: bool = False,
     user_id: str = Depends(get_current_user_id)
 ):
     """Get all conversations for the current user"""
+    not_modified = check_etag(request, response, user_id, "conversations", include_archived)
+    if not_modified:
+        return not_modified
     conversations = Database.get_user_conversations(user_id, include_archived)
-    return conversations
+    return fast_response(conversations, response)
 
 @app.post("/conversations", response_model=ConversationResponse)
 async def create_conversation(
@@ -535,7 +927,7 @@ async def get_conversation_messages(
 ):
     """Get all messages in a conversation"""
     messages = Database.get_conversation_messages(conversation_id, user_id)
-    return messages
+    return fast_response(messages)
 
 @app.patch("/conversations/{conversation_id}")
 async def update_conversation(
@@ -581,14 +973,24 @@ async def delete_conversation(
 @app.get("/search")
 async def search_messages(
     q: str,
+    mode: str = "text",
+    limit: int = 20,
     user_id: str = Depends(get_current_user_id)
 ):
-    """Search through user's message history"""
+    """Search through user's message history; mode=semantic also matches journal entries by meaning"""
     if len(q) < 2:
         raise HTTPException(status_code=400, detail="Search query must be at least 2 characters")
-    
+    if mode not in ("text", "semantic"):
+        raise HTTPException(status_code=400, detail="mode must be 'text' or 'semantic'")
+
+    if mode == "semantic":
+        if semantic_index is None:
+            raise HTTPException(status_code=503, detail="Semantic search is not available")
+        results = await run_in_threadpool(semantic_index.search, user_id, q, max(1, min(limit, 50)))
+        return fast_response({"results": results, "mode": "semantic"})
+
     results = Database.search_messages(user_id, q)
-    return {"results": results}
+    return fast_response({"results": results})
 
 # Mood Tracking Endpoints
 @app.post("/mood", response_model=MoodResponse)
@@ -614,12 +1016,18 @@ async def create_mood_entry(
 
 @app.get("/mood/history")
 async def get_mood_history(
+    request: Request,
+    response: Response,
     days: int = 30,
     user_id: str = Depends(get_current_user_id)
 ):
     """Get user's mood history for the specified number of days"""
+    # The window slides with the clock, so the tag also changes daily
+    not_modified = check_etag(request, response, user_id, "moods", days, datetime.utcnow().date().isoformat())
+    if not_modified:
+        return not_modified
     moods = MoodDatabase.get_user_moods(user_id, days)
-    return {"moods": moods, "period_days": days}
+    return fast_response({"moods": moods, "period_days": days}, response)
 
 @app.get("/mood/analytics")
 async def get_mood_analytics(
@@ -630,6 +1038,15 @@ async def get_mood_analytics(
     analytics = MoodDatabase.get_mood_analytics(user_id, days)
     return analytics
 
+@app.get("/insights/correlations")
+async def get_correlations(
+    days: int = 90,
+    max_lag: int = 3,
+    user_id: str = Depends(get_current_user_id)
+):
+    """How journaling and chat intents line up with mood on the same and following days"""
+    return await run_in_threadpool(correlation_cache.get, user_id, max(7, min(days, 730)), max(0, min(max_lag, 14)))
+
 # Journal Endpoints
 @app.post("/journal", response_model=JournalResponse)
 async def create_journal_entry(
@@ -655,12 +1072,25 @@ async def create_journal_entry(
 
 @app.get("/journal")
 async def get_journal_entries(
+    request: Request,
+    response: Response,
     limit: int = 50,
     user_id: str = Depends(get_current_user_id)
 ):
     """Get user's journal entries"""
+    not_modified = check_etag(request, response, user_id, "journal", limit)
+    if not_modified:
+        return not_modified
     entries = JournalDatabase.get_user_journals(user_id, limit)
-    return {"entries": entries, "total": len(entries)}
+    return fast_response({"entries": entries, "total": len(entries)}, response)
+
+@app.get("/journal/insights")
+async def get_journal_insights(
+    top: int = 20,
+    user_id: str = Depends(get_current_user_id)
+):
+    """Recurring themes, entry length and mood by weekday and hour, from the incremental insights index"""
+    return await run_in_threadpool(journal_insights.get_insights, user_id, max(0, min(top, 100)))
 
 @app.put("/journal/{entry_id}")
 async def update_journal_entry(
@@ -688,43 +1118,55 @@ async def delete_journal_entry(
     return {"message": "Journal entry deleted successfully"}
 
 # User Account Management
-@app.delete("/auth/delete-account")
-async def delete_account(user_id: str = Depends(get_current_user_id)):
+@app.delete("/auth/delete-account", status_code=status.HTTP_202_ACCEPTED)
+async def delete_account(user_id: str = Depends(get_token_user_id)):
     """Permanently delete user account and all associated data"""
     try:
-        # Delete all user data from all tables
-        conn = sqlite3.connect('serene.db')
-        cursor = conn.cursor()
-        
-        # Delete mood entries
-        cursor.execute("DELETE FROM mood_entries WHERE user_id = ?", (user_id,))
-        
-        # Delete journal entries
-        cursor.execute("DELETE FROM journal_entries WHERE user_id = ?", (user_id,))
-        
-        # Delete goals
-        cursor.execute("DELETE FROM goals WHERE user_id = ?", (user_id,))
-        
-        # Delete messages (cascade through conversations)
-        cursor.execute("""
-            DELETE FROM messages 
-            WHERE conversation_id IN (
-                SELECT id FROM conversations WHERE user_id = ?
-            )
-        """, (user_id,))
-        
-        # Delete conversations
-        cursor.execute("DELETE FROM conversations WHERE user_id = ?", (user_id,))
-        
-        # Delete user account
-        cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
-        
-        conn.commit()
-        conn.close()
-        
-        return {"message": "Account and all data deleted successfully"}
+        # The account is unusable from here on; its data is purged in the background
+        AccountPurgeDatabase.request_purge(user_id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to delete account: {str(e)}")
+    
+    account_purge.start_purge(user_id)
+    return {
+        "message": "Account deleted. Your data is being removed.",
+        "purge": AccountPurgeDatabase.get_purge_status(user_id)
+    }
+
+@app.get("/auth/delete-account/status")
+async def delete_account_status(user_id: str = Depends(get_token_user_id)):
+    """Progress of a pending account deletion"""
+    purge = AccountPurgeDatabase.get_purge_status(user_id)
+    if not purge:
+        raise HTTPException(status_code=404, detail="No account deletion in progress")
+    return purge
+
+# Data Export / Import
+@app.get("/export")
+async def export_data(
+    compress: bool = False,
+    user_id: str = Depends(get_current_user_id)
+):
+    """Stream all of the user's data as NDJSON (gzip-compressed with ?compress=true)"""
+    filename = "serene-export.ndjson" + (".gz" if compress else "")
+    return StreamingResponse(
+        data_transfer.iter_ndjson(user_id, compress),
+        media_type="application/gzip" if compress else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@app.post("/import")
+async def import_data(
+    request: Request,
+    user_id: str = Depends(get_current_user_id)
+):
+    """Import an NDJSON export (plain or gzip) into the current account"""
+    gzipped = (
+        request.headers.get("content-encoding") == "gzip"
+        or request.headers.get("content-type", "").startswith("application/gzip")
+    )
+    counts = await data_transfer.import_ndjson(user_id, request.stream(), gzipped)
+    return {"message": "Import completed successfully", "imported": counts}
 
 # Goals & Progress Tracking Endpoints
 @app.post("/goals", response_model=GoalResponse)
@@ -763,12 +1205,17 @@ async def create_goal(
 
 @app.get("/goals")
 async def get_goals(
+    request: Request,
+    response: Response,
     status: Optional[str] = None,
     user_id: str = Depends(get_current_user_id)
 ):
     """Get user's goals, optionally filtered by status"""
+    not_modified = check_etag(request, response, user_id, "goals", status)
+    if not_modified:
+        return not_modified
     goals = GoalsDatabase.get_user_goals(user_id, status)
-    return {"goals": goals, "total": len(goals)}
+    return fast_response({"goals": goals, "total": len(goals)}, response)
 
 @app.get("/goals/statistics")
 async def get_goal_statistics(user_id: str = Depends(get_current_user_id)):
@@ -783,9 +1230,21 @@ async def update_goal_progress(
     user_id: str = Depends(get_current_user_id)
 ):
     """Update progress on a goal"""
-    GoalsDatabase.update_goal_progress(goal_id, user_id, progress.current_value)
+    if not GoalsDatabase.update_goal_progress(goal_id, user_id, progress.current_value):
+        raise HTTPException(status_code=404, detail="Goal not found")
     return {"message": "Goal progress updated successfully"}
 
+@app.get("/goals/{goal_id}/progress")
+async def get_goal_progress_history(
+    goal_id: int,
+    user_id: str = Depends(get_current_user_id)
+):
+    """Every recorded progress value of a goal, oldest first, for progress charts"""
+    history = GoalsDatabase.get_goal_progress_history(goal_id, user_id)
+    if history is None:
+        raise HTTPException(status_code=404, detail="Goal not found")
+    return {"goal_id": goal_id, "history": history}
+
 @app.put("/goals/{goal_id}")
 async def update_goal(
     goal_id: int,
@@ -812,4 +1271,19 @@ async def delete_goal(
     GoalsDatabase.delete_goal(goal_id, user_id)
     return {"message": "Goal deleted successfully"}
     results = Database.search_messages(user_id, q)
-    return results
\ No newline at end of file
+    return results
+
+# Offline Sync
+@app.post("/sync")
+async def sync_offline_operations(
+    batch: SyncRequest,
+    user_id: str = Depends(get_current_user_id)
+):
+    """Apply an ordered batch of queued offline writes in one transaction"""
+    if len(batch.operations) > offline_sync.SYNC_MAX_OPERATIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {offline_sync.SYNC_MAX_OPERATIONS} operations per sync"
+        )
+    results = await run_in_threadpool(offline_sync.apply_sync_batch, user_id, batch.operations)
+    return fast_response({"results": results})
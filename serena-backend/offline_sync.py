@@ -0,0 +1,144 @@
+"""Batched replay of writes the companion app queued while offline.
+
+POST /sync takes an ordered list of operations such as
+
+    {"op_id": "7f9c...", "type": "mood.create", "data": {"mood_level": 4, "mood_emoji": "🙂"}}
+    {"op_id": "81aa...", "type": "goal.progress", "data": {"ref": "7e01...", "current_value": 3}}
+
+`op_id` is generated by the client and makes retries safe: an operation that
+was already applied is answered from the ledger instead of running twice.
+Updates and deletes name their row by server `id`, or by `ref`, the op_id of
+the create that made it (in this batch or an earlier one). Each operation is
+validated on its own, so one bad entry does not fail the rest of the batch.
+"""
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from database import SyncDatabase
+
+SYNC_MAX_OPERATIONS = 500
+
+
+def _text(data: Dict, field: str, required: bool = False, max_length: int = 10000) -> Optional[str]:
+    value = data.get(field)
+    if value is None or (required and not str(value).strip()):
+        if required:
+            raise ValueError(f"{field} is required")
+        return None
+    if not isinstance(value, str):
+        raise ValueError(f"{field} must be a string")
+    if len(value) > max_length:
+        raise ValueError(f"{field} is too long")
+    return value
+
+
+def _integer(data: Dict, field: str, required: bool = False, low: Optional[int] = None, high: Optional[int] = None) -> Optional[int]:
+    value = data.get(field)
+    if value is None:
+        if required:
+            raise ValueError(f"{field} is required")
+        return None
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError(f"{field} must be an integer")
+    if (low is not None and value < low) or (high is not None and value > high):
+        raise ValueError(f"{field} must be between {low} and {high}" if high is not None else f"{field} must be at least {low}")
+    return value
+
+
+def _timestamp(data: Dict, field: str) -> Optional[str]:
+    """Client-side time of an offline write, stored like SQLite's CURRENT_TIMESTAMP (UTC)"""
+    value = _text(data, field, max_length=64)
+    if value is None:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError(f"{field} must be an ISO 8601 timestamp")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _values(kind: str, data: Dict) -> tuple:
+    """Statement parameters for SyncDatabase.STATEMENTS[kind], minus id/user_id"""
+    if kind == "mood.create":
+        return (
+            _integer(data, "mood_level", required=True, low=1, high=5),
+            _text(data, "mood_emoji", required=True, max_length=16),
+            _text(data, "notes"),
+            _timestamp(data, "created_at"),
+        )
+    if kind == "journal.create":
+        created_at = _timestamp(data, "created_at")
+        return (
+            _text(data, "title", max_length=200),
+            _text(data, "content", required=True),
+            _integer(data, "mood_level", low=1, high=5),
+            created_at,
+            created_at,
+        )
+    if kind == "journal.update":
+        return (
+            _text(data, "title", max_length=200),
+            _text(data, "content", required=True),
+            _integer(data, "mood_level", low=1, high=5),
+        )
+    if kind == "goal.create":
+        return (
+            _text(data, "title", required=True, max_length=200),
+            _text(data, "description"),
+            _text(data, "category", required=True, max_length=100),
+            _integer(data, "target_value", required=True, low=1),
+            _text(data, "unit", required=True, max_length=50),
+            _text(data, "target_date", required=True, max_length=32),
+        )
+    if kind == "goal.progress":
+        return (_integer(data, "current_value", required=True, low=0), datetime.now().isoformat())
+    # Deletes only need the target
+    return ()
+
+
+def normalize_operation(op) -> Dict:
+    """Validate one raw operation; raises ValueError with a client-facing message"""
+    if not isinstance(op, dict):
+        raise ValueError("Operation must be an object")
+    kind = op.get("type")
+    if kind not in SyncDatabase.STATEMENTS:
+        raise ValueError(f"Unknown operation type: {kind}")
+    data = op.get("data") or {}
+    if not isinstance(data, dict):
+        raise ValueError("data must be an object")
+
+    normalized = {"op_id": op["op_id"], "type": kind, "values": _values(kind, data)}
+    if not kind.endswith(".create"):
+        target = _integer(data, "id", low=1)
+        ref = _text(data, "ref", max_length=128)
+        if target is None and ref is None:
+            raise ValueError("id or ref is required")
+        normalized["id"] = target
+        normalized["ref"] = ref
+    return normalized
+
+
+def apply_sync_batch(user_id: str, operations: List) -> List[Dict]:
+    """Validate and apply a batch in order; one result per operation, in the same order"""
+    results: List[Optional[Dict]] = [None] * len(operations)
+    valid = []
+    for index, op in enumerate(operations):
+        if not isinstance(op, dict):
+            results[index] = {"op_id": None, "status": "invalid", "detail": "Operation must be an object"}
+            continue
+        op_id = op.get("op_id")
+        if not isinstance(op_id, str) or not op_id or len(op_id) > 128:
+            results[index] = {"op_id": op_id, "status": "invalid", "detail": "op_id must be a non-empty string"}
+            continue
+        try:
+            valid.append((index, normalize_operation(op)))
+        except ValueError as e:
+            results[index] = {"op_id": op_id, "type": op.get("type"), "status": "invalid", "detail": str(e)}
+
+    if valid:
+        applied = SyncDatabase.apply_operations(user_id, [op for _, op in valid])
+        for (index, _), result in zip(valid, applied):
+            results[index] = result
+    return results
@@ -0,0 +1,75 @@
+"""Post-training quantization of the intent model.
+
+Converts chatbot.keras into intent_quantized.npz, which the API serves with
+INTENT_MODEL_BACKEND=quantized:
+
+    python quantize.py                      # int8 embedding, float16 LSTM/Dense
+    python quantize.py --mode float16 --output-dir /tmp/candidate
+
+Before writing, the Keras and quantized models are both evaluated on the
+validation split train.py holds out of dataset.json (same seed), and the file
+is only written if the quantized model is at least as accurate; --force writes
+it anyway. The report also gives how often the two models agree and the
+largest probability difference between them.
+"""
+import argparse
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.layers import TextVectorization
+
+from intent_classifiers import KerasIntentClassifier, QuantizedIntentClassifier
+from train import load_examples, split_examples
+
+
+def evaluate(keras_classifier: KerasIntentClassifier, quantized: QuantizedIntentClassifier,
+             texts: list, labels: np.ndarray, class_names: np.ndarray) -> dict:
+    expected = class_names[labels].astype(str)
+    reference = keras_classifier.predict_proba(texts)
+    probabilities = quantized.predict_proba(texts)
+    return {
+        "keras_accuracy": float((keras_classifier.class_names[reference.argmax(axis=1)].astype(str) == expected).mean()),
+        "quantized_accuracy": float((quantized.class_names[probabilities.argmax(axis=1)].astype(str) == expected).mean()),
+        "agreement": float((reference.argmax(axis=1) == probabilities.argmax(axis=1)).mean()),
+        "max_probability_diff": float(np.abs(reference - probabilities).max()),
+        "keras_bytes": keras_classifier.weights_bytes(),
+        "quantized_bytes": quantized.weights_bytes(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Quantize chatbot.keras to int8 or float16 for INTENT_MODEL_BACKEND=quantized")
+    parser.add_argument("--mode", choices=["int8", "float16"], default="int8", help="Storage type of the embedding table")
+    parser.add_argument("--model", default="./models/chatbot.keras")
+    parser.add_argument("--classes", default="./models/classes.npy")
+    parser.add_argument("--dataset", default="./models/dataset.json")
+    parser.add_argument("--seed", type=int, default=42, help="Split seed; use the one the model was trained with")
+    parser.add_argument("--output-dir", default="./models")
+    parser.add_argument("--force", action="store_true", help="Write the model even if it loses validation accuracy")
+    args = parser.parse_args()
+
+    model = tf.keras.models.load_model(
+        args.model,
+        custom_objects={"TextVectorization": TextVectorization},
+        compile=False
+    )
+    keras_classifier = KerasIntentClassifier(model, np.load(args.classes, allow_pickle=True), jit_compile=False)
+    quantized = QuantizedIntentClassifier.from_keras(model, keras_classifier.class_names, args.mode)
+
+    texts, tags, _ = load_examples(args.dataset, [])
+    _, (val_texts, val_labels), class_names = split_examples(texts, tags, args.seed, 0.2)
+    report = evaluate(keras_classifier, quantized, list(val_texts), val_labels, class_names)
+
+    print(f"validation examples  {len(val_labels)}")
+    print(f"accuracy             keras {report['keras_accuracy']:.4f}  {args.mode} {report['quantized_accuracy']:.4f}")
+    print(f"agreement            {report['agreement']:.4f} (max probability diff {report['max_probability_diff']:.5f})")
+    print(f"weights              float32 {report['keras_bytes'] / 2**20:.2f} MB  {args.mode} "
+          f"{report['quantized_bytes'] / 2**20:.2f} MB ({report['keras_bytes'] / report['quantized_bytes']:.1f}x smaller)")
+
+    if report["quantized_accuracy"] < report["keras_accuracy"] and not args.force:
+        raise SystemExit("Quantized model is less accurate on the validation split; not written (use --force)")
+    print(f"saved {quantized.save(args.output_dir)}")
+
+
+if __name__ == "__main__":
+    main()
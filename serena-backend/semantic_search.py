@@ -0,0 +1,154 @@
+"""Semantic search over a user's messages and journal entries.
+
+Text is embedded with the intent model's own Embedding layer (see
+intent_model.EmbeddingEncoder) and stored as float16 vectors in the
+`embeddings` table. Each searching user gets an in-memory matrix of their
+vectors, searched by brute-force cosine similarity: even heavy users have a
+few thousand rows, which NumPy scans in well under a millisecond.
+
+The index is incremental. A user's cached matrix is reused until their
+conversation or journal version counter moves (see ResourceVersionDatabase);
+then only rows without a vector are embedded and appended, and the matrix is
+reloaded from the table only when something was deleted or re-embedded.
+Vectors are computed then, on the user's next search, rather than when the
+text is written, so chat and journal writes never wait on the encoder.
+Refreshes of different users run in parallel; only the cache itself is
+shared.
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from database import EmbeddingDatabase, ResourceVersionDatabase
+from intent_model import EmbeddingEncoder
+
+SEMANTIC_INDEX_MAX_USERS = int(os.getenv("SEMANTIC_INDEX_MAX_USERS", "1000"))
+SEMANTIC_MIN_SCORE = float(os.getenv("SEMANTIC_MIN_SCORE", "0.3"))
+EMBED_BATCH_SIZE = 2000
+# Users hash onto this many locks, so one user's refresh only holds up the few sharing its lock
+REFRESH_LOCKS = 64
+
+KINDS = ("message", "journal")
+
+
+class UserVectors:
+    """One user's vectors as parallel arrays"""
+
+    def __init__(self, versions: tuple, rows: List[tuple]):
+        self.versions = versions
+        self.kinds = np.array([KINDS.index(row[0]) for row in rows], dtype=np.int8)
+        self.ids = np.array([row[1] for row in rows], dtype=np.int64)
+        self.conversation_ids = np.array([row[2] or 0 for row in rows], dtype=np.int64)
+        self.vectors = np.array([np.frombuffer(row[3], dtype=np.float16) for row in rows], dtype=np.float16)
+
+    def append(self, rows: List[tuple]):
+        added = UserVectors(self.versions, rows)
+        self.kinds = np.concatenate([self.kinds, added.kinds])
+        self.ids = np.concatenate([self.ids, added.ids])
+        self.conversation_ids = np.concatenate([self.conversation_ids, added.conversation_ids])
+        self.vectors = np.concatenate([self.vectors.reshape(-1, added.vectors.shape[1]), added.vectors])
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+class SemanticIndex:
+    """Per-user vector matrices, least recently searched users evicted first"""
+
+    def __init__(self, encoder: EmbeddingEncoder, max_users: int = SEMANTIC_INDEX_MAX_USERS):
+        self.encoder = encoder
+        self.max_users = max_users
+        self._users: "OrderedDict[str, UserVectors]" = OrderedDict()
+        # Guards _users only; never held across database reads or embedding
+        self._lock = threading.Lock()
+        self._refresh_locks = [threading.Lock() for _ in range(REFRESH_LOCKS)]
+
+    @classmethod
+    def from_model(cls, model) -> Optional["SemanticIndex"]:
+        encoder = EmbeddingEncoder.from_model(model)
+        return cls(encoder) if encoder else None
+
+    def _embed_pending(self, user_id: str) -> List[tuple]:
+        """Embed and store everything the user wrote since the last refresh"""
+        added = []
+        while True:
+            pending = EmbeddingDatabase.get_pending(user_id, self.encoder.model_key, EMBED_BATCH_SIZE)
+            if not pending:
+                return added
+            vectors = self.encoder.encode([row[3] for row in pending])
+            rows = [
+                (kind, item_id, conversation_id, vector.tobytes())
+                for (kind, item_id, conversation_id, _), vector in zip(pending, vectors)
+            ]
+            EmbeddingDatabase.save_vectors(user_id, self.encoder.model_key, rows)
+            added += rows
+
+    def _refresh_lock(self, user_id: str) -> threading.Lock:
+        return self._refresh_locks[hash(user_id) % REFRESH_LOCKS]
+
+    def refresh(self, user_id: str) -> UserVectors:
+        """The user's vectors, brought up to date; call with the user's refresh lock held"""
+        versions = (
+            ResourceVersionDatabase.get_version(user_id, "conversations"),
+            ResourceVersionDatabase.get_version(user_id, "journal"),
+        )
+        with self._lock:
+            cached = self._users.get(user_id)
+            if cached is not None and cached.versions == versions:
+                self._users.move_to_end(user_id)
+                return cached
+
+        removed = EmbeddingDatabase.delete_orphans(user_id)
+        added = self._embed_pending(user_id)
+        # Edited journal entries replace their old vector, which an append would duplicate
+        replaced = cached is not None and any(
+            kind == "journal" and np.any((cached.kinds == 1) & (cached.ids == item_id))
+            for kind, item_id, _, _ in added
+        )
+        if cached is None or removed or replaced:
+            cached = UserVectors(versions, EmbeddingDatabase.get_vectors(user_id, self.encoder.model_key))
+        else:
+            if added:
+                cached.append(added)
+            cached.versions = versions
+
+        with self._lock:
+            self._users[user_id] = cached
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        return cached
+
+    def search(self, user_id: str, query: str, limit: int) -> List[Dict]:
+        """Best matches first, each record tagged with its kind and cosine score"""
+        query_vector = self.encoder.encode([query])[0].astype(np.float32)
+        if not query_vector.any():
+            # None of the query's words are in the model's vocabulary
+            return []
+
+        with self._refresh_lock(user_id):
+            user = self.refresh(user_id)
+            # Snapshot: a later refresh may append to this user's arrays
+            kinds, ids, conversation_ids, vectors = user.kinds, user.ids, user.conversation_ids, user.vectors
+        if not len(ids):
+            return []
+
+        scores = vectors.astype(np.float32) @ query_vector
+        k = min(limit, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        top = top[scores[top] >= SEMANTIC_MIN_SCORE]
+
+        messages = [(int(ids[i]), int(conversation_ids[i])) for i in top if kinds[i] == 0]
+        journal_ids = [int(ids[i]) for i in top if kinds[i] == 1]
+        items = EmbeddingDatabase.get_search_items(user_id, messages, journal_ids)
+
+        results = []
+        for i in top:
+            item = items.get((KINDS[kinds[i]], int(ids[i])))
+            if item is not None:
+                results.append({**item, "score": round(float(scores[i]), 4)})
+        return results
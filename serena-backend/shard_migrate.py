@@ -0,0 +1,242 @@
+"""Move user data between storage layouts: the single serene.db and N shards.
+
+    python shard_migrate.py --shards 8     # single file (or another shard count) -> 8 shards
+    python shard_migrate.py --shards 0     # shards -> back into serene.db
+
+Run it with the API stopped, then start the API with SERENE_DB_SHARDS set to
+the new count. The current layout is read from serene.db (storage_layout).
+Users are split by the same hash the API routes with (sharding.shard_for):
+
+  * tables with a user_id column by that column
+  * messages and conversation_archive through their conversation
+  * goal_progress_events through their goal
+
+Rows keep their ids; rows whose parent is gone (messages of a deleted
+conversation) are left behind. The new shards allocate ids from fresh ranges above
+every id copied, so ids stay unique. Derived tables (resource_versions,
+goal_stats, journal insights) are copied as they are, with triggers dropped
+during the copy, and row counts are checked before the new layout is
+recorded. Moving out of serene.db empties its user tables. Old shard files
+are left in place and listed for removal.
+"""
+import argparse
+import os
+import sqlite3
+import time
+
+
+def _recorded_shard_count() -> str:
+    """Shard count recorded in serene.db, read before database.py is imported"""
+    path = os.getenv("SERENE_DB_PATH", os.path.join(os.path.dirname(__file__), "serene.db"))
+    if not os.path.exists(path):
+        return "0"
+    conn = sqlite3.connect(path)
+    try:
+        row = conn.execute("SELECT value FROM storage_layout WHERE key = 'shards'").fetchone()
+    except sqlite3.OperationalError:
+        row = None
+    conn.close()
+    return str(row[0]) if row else "0"
+
+
+# Importing database checks the files against SERENE_DB_SHARDS and refuses a
+# mismatch; this tool changes the layout, so it opens whatever is recorded
+os.environ["SERENE_DB_SHARDS"] = _recorded_shard_count()
+
+from database import (  # noqa: E402
+    DB_PATH, SHARD_DIR, get_storage_layout, has_user_data, init_db, reserve_id_range, set_storage_layout
+)
+from sharding import SHARD_ID_RANGE, id_range_start, shard_for, shard_path  # noqa: E402
+
+# Account-level tables stay in serene.db; per-file job state is not carried over
+# (the analytics export starts over with --full after a layout change)
+DIRECTORY_TABLES = {"users", "account_purge_jobs", "storage_layout"}
+FILE_STATE_TABLES = {"maintenance_runs", "backfill_checkpoints", "analytics_changes"}
+# Owner of rows in tables without a user_id column: (column, parent table)
+OWNED_THROUGH = {
+    "conversation_id": "conversations",
+    "goal_id": "goals",
+}
+
+
+def layout_files(shard_count: int, shard_dir: str) -> list:
+    if not shard_count:
+        return [DB_PATH]
+    return [shard_path(shard_dir, shard, shard_count) for shard in range(shard_count)]
+
+
+def user_tables(conn: sqlite3.Connection, schema: str = "main") -> dict:
+    """table -> column list, for every table holding user data"""
+    tables = {}
+    names = conn.execute(
+        f"SELECT name FROM {schema}.sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+    ).fetchall()
+    for (table,) in names:
+        if table in DIRECTORY_TABLES or table in FILE_STATE_TABLES:
+            continue
+        tables[table] = [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({table})")]
+    return tables
+
+
+def owner_filter(table: str, columns: list) -> str:
+    """WHERE clause selecting the rows of `table` in src whose owner hashes to shard ?"""
+    if "user_id" in columns:
+        return "shard_of(user_id) = ?"
+    for column, parent in OWNED_THROUGH.items():
+        if column in columns:
+            return f"{column} IN (SELECT id FROM src.{parent} WHERE shard_of(user_id) = ?)"
+    raise RuntimeError(f"No rule for which user owns rows of {table}; add one to OWNED_THROUGH")
+
+
+def max_allocated_id(paths: list) -> int:
+    highest = 0
+    for path in paths:
+        conn = sqlite3.connect(path)
+        row = conn.execute("SELECT MAX(seq) FROM sqlite_sequence").fetchone()
+        conn.close()
+        highest = max(highest, row[0] or 0)
+    return highest
+
+
+def copy_into(target_path: str, sources: list, shard: int, shard_count: int) -> dict:
+    """Copy the rows of every source whose owner hashes to `shard` into target; returns rows per table"""
+    init_db(target_path)
+    conn = sqlite3.connect(target_path, isolation_level=None)
+    conn.create_function("shard_of", 1, lambda user_id: shard_for(user_id, shard_count) if shard_count else 0,
+                         deterministic=True)
+    triggers = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")]
+    for trigger in triggers:
+        conn.execute(f"DROP TRIGGER {trigger}")
+
+    copied = {}
+    tables = user_tables(conn)
+    for source in sources:
+        if os.path.abspath(source) == os.path.abspath(target_path):
+            continue
+        conn.execute("ATTACH DATABASE ? AS src", (source,))
+        conn.execute("BEGIN")
+        source_tables = user_tables(conn, "src")
+        for table, columns in tables.items():
+            if table not in source_tables:
+                continue
+            shared = ", ".join(column for column in columns if column in source_tables[table])
+            cursor = conn.execute(
+                f"INSERT INTO main.{table} ({shared}) SELECT {shared} FROM src.{table} WHERE {owner_filter(table, columns)}",
+                (shard,)
+            )
+            copied[table] = copied.get(table, 0) + cursor.rowcount
+        conn.execute("COMMIT")
+        conn.execute("DETACH DATABASE src")
+    conn.close()
+
+    # Triggers come back with the rest of the schema; the derived tables were copied as they are
+    init_db(target_path)
+    return copied
+
+
+def count_rows(paths: list) -> dict:
+    """Rows per table that have an owner; orphans (e.g. messages of a deleted conversation) are not copied"""
+    counts = {}
+    for path in paths:
+        conn = sqlite3.connect(path)
+        for table, columns in user_tables(conn).items():
+            owned = next((f"WHERE {column} IN (SELECT id FROM {parent})"
+                          for column, parent in OWNED_THROUGH.items() if column in columns and "user_id" not in columns), "")
+            counts[table] = counts.get(table, 0) + conn.execute(f"SELECT COUNT(*) FROM {table} {owned}").fetchone()[0]
+        conn.close()
+    return counts
+
+
+def empty_user_tables(path: str):
+    """Delete every user row from a file that no longer holds user data"""
+    conn = sqlite3.connect(path)
+    tables = list(user_tables(conn))
+    # The second pass clears rows the triggers wrote during the first
+    for _ in range(2):
+        for table in tables:
+            conn.execute(f"DELETE FROM {table}")
+    conn.execute("DELETE FROM analytics_changes")
+    conn.commit()
+    conn.executescript("PRAGMA incremental_vacuum")
+    conn.close()
+
+
+def migrate(shard_count: int, shard_dir: str = SHARD_DIR, force: bool = False) -> dict:
+    started = time.perf_counter()
+    init_db(DB_PATH)
+    layout = get_storage_layout()
+    current = layout.get("shards", 0)
+    if current == shard_count:
+        raise SystemExit(f"Already laid out as {shard_count or 'a single file'}")
+
+    sources = layout_files(current, shard_dir)
+    targets = layout_files(shard_count, shard_dir)
+    if shard_count:
+        os.makedirs(shard_dir, exist_ok=True)
+        for path in targets:
+            if os.path.exists(path) and has_user_data(path):
+                if not force:
+                    raise SystemExit(f"{path} already holds data; pass --force to replace it")
+                for suffix in ("", "-wal", "-shm"):
+                    if os.path.exists(path + suffix):
+                        os.remove(path + suffix)
+    elif has_user_data(DB_PATH):
+        raise SystemExit(f"{DB_PATH} already holds user data")
+
+    expected = count_rows(sources)
+    copied = {}
+    for shard, path in enumerate(targets):
+        for table, rows in copy_into(path, sources, shard, shard_count).items():
+            copied[table] = copied.get(table, 0) + rows
+        print(f"{os.path.basename(path)}: {sum(copied.values())} rows so far")
+    missing = {table: (rows, copied.get(table, 0)) for table, rows in expected.items() if copied.get(table, 0) != rows}
+    if missing:
+        raise SystemExit(f"Row counts differ (expected, copied): {missing}; the layout was not changed")
+
+    # New ids start above everything copied, in a separate range per shard
+    id_base = 0
+    if shard_count:
+        id_base = (max_allocated_id(sources) // SHARD_ID_RANGE + 1) * SHARD_ID_RANGE
+        for shard, path in enumerate(targets):
+            reserve_id_range(path, id_range_start(id_base, shard))
+    for path in targets:
+        conn = sqlite3.connect(path)
+        conn.execute("ANALYZE")
+        conn.close()
+
+    set_storage_layout({"shards": shard_count, "id_base": id_base})
+    if not current:
+        empty_user_tables(DB_PATH)
+    return {
+        "from_shards": current,
+        "to_shards": shard_count,
+        "rows": copied,
+        "id_base": id_base,
+        "seconds": round(time.perf_counter() - started, 3),
+        "old_files": [path for path in sources if path != DB_PATH],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move user data between serene.db and N shard files")
+    parser.add_argument("--shards", type=int, required=True, help="New shard count; 0 for the single serene.db")
+    parser.add_argument("--shard-dir", default=SHARD_DIR)
+    parser.add_argument("--force", action="store_true", help="Replace shard files left by an earlier, failed run")
+    args = parser.parse_args()
+    if args.shards < 0:
+        parser.error("--shards must be 0 or more")
+
+    result = migrate(args.shards, args.shard_dir, args.force)
+    print(f"moved {sum(result['rows'].values())} rows from {result['from_shards'] or 'serene.db'} "
+          f"to {result['to_shards'] or 'serene.db'} in {result['seconds']}s")
+    for table, rows in sorted(result["rows"].items()):
+        print(f"  {table:<24}{rows:>12,}")
+    if result["old_files"]:
+        print("old shard files, safe to remove once the API runs on the new layout:")
+        for path in result["old_files"]:
+            print(f"  {path}")
+    print(f"start the API with SERENE_DB_SHARDS={args.shards}")
+
+
+if __name__ == "__main__":
+    main()
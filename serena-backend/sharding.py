@@ -0,0 +1,79 @@
+"""Helpers for sharded storage: which file a user lives in, and per-file connection pools.
+
+With SERENE_DB_SHARDS=N every user's rows live in one of N SQLite files,
+picked by a stable hash of user_id. Account-level tables (users, purge
+jobs) stay in serene.db, the directory. Each file has its own write lock,
+so writes of users on different shards no longer queue behind one writer.
+Routing is done by Database.get_connection in database.py; moving data
+between layouts by shard_migrate.py.
+"""
+import os
+import queue
+import sqlite3
+import zlib
+
+# Every shard allocates AUTOINCREMENT ids from its own range, so ids stay unique
+# across files and shards can be merged or split without renumbering
+SHARD_ID_RANGE = 1 << 32
+
+
+def shard_for(user_id: str, shard_count: int) -> int:
+    """The shard holding user_id's rows; stable across processes and restarts"""
+    return zlib.crc32(user_id.encode("utf-8")) % shard_count
+
+
+def shard_path(shard_dir: str, index: int, shard_count: int) -> str:
+    # The count is part of the name, so a rebalance writes its files next to the old ones
+    return os.path.join(shard_dir, f"shard-{index:03d}-of-{shard_count:03d}.db")
+
+
+def id_range_start(id_base: int, index: int) -> int:
+    return id_base + index * SHARD_ID_RANGE
+
+
+class PooledConnection(sqlite3.Connection):
+    """A connection whose close() hands it back to its pool"""
+
+    pool = None
+
+    def close(self):
+        if self.pool is None:
+            super().close()
+            return
+        if self.in_transaction:
+            self.rollback()
+        self.pool.release(self)
+
+
+class ConnectionPool:
+    """Up to `size` idle connections to one database file, most recently used first.
+
+    acquire() never waits: when no idle connection is left it opens a new one,
+    and release() closes connections beyond `size`. Waiting for the file's write
+    lock is still left to SQLite's busy timeout.
+    """
+
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self.idle = queue.LifoQueue(maxsize=size)
+
+    def acquire(self) -> PooledConnection:
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            conn = sqlite3.connect(self.path, factory=PooledConnection, check_same_thread=False)
+            conn.pool = self
+            return conn
+
+    def release(self, conn: PooledConnection):
+        try:
+            self.idle.put_nowait(conn)
+        except queue.Full:
+            sqlite3.Connection.close(conn)
+
+    def close(self):
+        while True:
+            try:
+                sqlite3.Connection.close(self.idle.get_nowait())
+            except queue.Empty:
+                return
@@ -0,0 +1,254 @@
+"""Train the intent model and export everything the API loads, in one step.
+
+Replaces the manual steps in model.ipynb with the same preprocessing, split
+and architecture (TextVectorization -> Embedding -> BiLSTM -> Dense):
+
+    python train.py
+    python train.py --chat-logs mined/2025-06.jsonl --seed 7 --output-dir /tmp/candidate
+
+Chat logs are JSON Lines of {"text": ..., "tag": ...} (or "intent" instead of
+"tag"), e.g. user messages whose labels were reviewed; lines with a tag that
+is not in dataset.json are skipped. Text is tokenized inside the tf.data
+pipeline and the token ids are cached, so every epoch after the first only
+shuffles and batches in-memory tensors. Runs are reproducible for a given
+--seed and input.
+
+Writes chatbot.keras, classes.npy and manifest.json to --output-dir, each
+replaced only after training succeeded.
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras import Model
+from tensorflow.keras.callbacks import Callback, EarlyStopping
+from tensorflow.keras.layers import LSTM, Bidirectional, Dense, Dropout, Embedding, Input, TextVectorization
+
+from intent_model import weights_key
+
+MAX_VOCAB = 5_000
+MAX_LEN = 50
+EMBEDDING_DIM = 128
+LSTM_UNITS = 64
+
+
+def clean(text: str) -> str:
+    """Same normalization as the notebook: lowercase, keep only [a-z0-9] and whitespace"""
+    return re.sub(r"[^a-z0-9\s]", "", text.lower())
+
+
+def load_examples(dataset_path: str, chat_log_paths: list) -> tuple:
+    """(texts, tags, sources) from dataset.json patterns plus any chat logs"""
+    with open(dataset_path, "r") as f:
+        data = json.load(f)
+    texts, tags = [], []
+    for intent in data["intents"]:
+        for pattern in intent.get("patterns", []):
+            texts.append(pattern)
+            tags.append(intent["tag"])
+    known_tags = set(tags)
+    sources = {dataset_path: len(texts)}
+
+    for path in chat_log_paths:
+        added = skipped = 0
+        with open(path, "r") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                tag = record.get("tag") or record.get("intent")
+                text = record.get("text") or record.get("content")
+                if tag not in known_tags or not text:
+                    skipped += 1
+                    continue
+                texts.append(text)
+                tags.append(tag)
+                added += 1
+        if skipped:
+            print(f"{path}: skipped {skipped} lines without text or with an unknown tag")
+        sources[path] = added
+    return texts, tags, sources
+
+
+def split_examples(texts: list, tags: list, seed: int, validation_split: float) -> tuple:
+    """Shuffle, drop tags with <2 examples, and split stratified by tag"""
+    rng = np.random.default_rng(seed)
+    texts = np.array([clean(text) for text in texts], dtype=object)
+    tags = np.array(tags, dtype=object)
+    order = rng.permutation(len(texts))
+    texts, tags = texts[order], tags[order]
+
+    names, counts = np.unique(tags, return_counts=True)
+    rare = names[counts < 2]
+    if len(rare):
+        print(f"Dropping tags with <2 examples: {list(rare)}")
+        keep = ~np.isin(tags, rare)
+        texts, tags = texts[keep], tags[keep]
+
+    class_names = np.unique(tags)
+    labels = np.searchsorted(class_names, tags)
+    validation = np.zeros(len(labels), dtype=bool)
+    for label in range(len(class_names)):
+        members = np.flatnonzero(labels == label)
+        # At least one example of every tag on each side of the split
+        take = min(max(1, round(len(members) * validation_split)), len(members) - 1)
+        validation[members[:take]] = True
+    return (texts[~validation], labels[~validation]), (texts[validation], labels[validation]), class_names
+
+
+def make_dataset(vectorizer, texts, labels, batch_size: int, seed: int = None) -> tf.data.Dataset:
+    """Tokenize once, cache the ids, then (re)shuffle and batch from memory every epoch"""
+    ds = tf.data.Dataset.from_tensor_slices((texts.astype(str), labels))
+    ds = ds.batch(batch_size).map(lambda x, y: (vectorizer(x), y), num_parallel_calls=tf.data.AUTOTUNE).unbatch()
+    ds = ds.cache()
+    if seed is not None:
+        ds = ds.shuffle(len(labels), seed=seed, reshuffle_each_iteration=True)
+    return ds.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+
+def build_classifier(num_classes: int) -> Model:
+    """Everything after tokenization; trained on token ids"""
+    ids = Input(shape=(MAX_LEN,), dtype="int64")
+    x = Embedding(input_dim=MAX_VOCAB, output_dim=EMBEDDING_DIM)(ids)
+    x = Bidirectional(LSTM(LSTM_UNITS, return_sequences=False))(x)
+    x = Dropout(0.5)(x)
+    outputs = Dense(num_classes, activation="softmax")(x)
+    return Model(ids, outputs)
+
+
+class Throughput(Callback):
+    """Training examples per second for each epoch, excluding the validation pass"""
+
+    def __init__(self, examples: int):
+        super().__init__()
+        self.examples = examples
+        self.rates = []
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.started = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.last_step = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.rates.append(self.examples / (self.last_step - self.started))
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def train(dataset_path: str, chat_log_paths: list, output_dir: str, seed: int = 42, epochs: int = 30,
+          batch_size: int = 32, validation_split: float = 0.2, patience: int = 3, verbose: int = 2) -> dict:
+    started = time.perf_counter()
+    tf.keras.utils.set_random_seed(seed)
+    tf.config.experimental.enable_op_determinism()
+
+    texts, tags, sources = load_examples(dataset_path, chat_log_paths)
+    (train_texts, train_labels), (val_texts, val_labels), class_names = split_examples(texts, tags, seed, validation_split)
+    if verbose:
+        print(f"Train size: {len(train_labels)}, Val size: {len(val_labels)}, classes: {len(class_names)}")
+
+    vectorizer = TextVectorization(
+        max_tokens=MAX_VOCAB,
+        output_sequence_length=MAX_LEN,
+        standardize="lower_and_strip_punctuation",
+        split="whitespace"
+    )
+    vectorizer.adapt(train_texts.astype(str))
+    train_ds = make_dataset(vectorizer, train_texts, train_labels, batch_size, seed)
+    val_ds = make_dataset(vectorizer, val_texts, val_labels, batch_size)
+
+    classifier = build_classifier(len(class_names))
+    classifier.compile(
+        optimizer="adam",
+        loss="sparse_categorical_crossentropy",
+        metrics=["accuracy"]
+    )
+    throughput = Throughput(len(train_labels))
+    history = classifier.fit(
+        train_ds,
+        validation_data=val_ds,
+        epochs=epochs,
+        callbacks=[
+            # The BiLSTM sits on a loss plateau for its first epochs on small datasets
+            EarlyStopping(monitor="val_loss", patience=patience, start_from_epoch=10, restore_best_weights=True),
+            throughput,
+        ],
+        verbose=verbose
+    )
+    _, val_accuracy = classifier.evaluate(val_ds, verbose=0)
+
+    # The served model takes raw strings, as main.classify_intent passes them
+    inputs = Input(shape=(1,), dtype=tf.string)
+    model = Model(inputs, classifier(vectorizer(inputs)))
+
+    os.makedirs(output_dir, exist_ok=True)
+    model_path = os.path.join(output_dir, "chatbot.keras")
+    classes_path = os.path.join(output_dir, "classes.npy")
+    manifest_path = os.path.join(output_dir, "manifest.json")
+    # Written beside the targets first so a failed export never leaves a mismatched set
+    model.save(model_path + ".tmp.keras")
+    np.save(classes_path + ".tmp.npy", class_names.astype(object), allow_pickle=True)
+
+    # First epoch includes filling the cache and tracing the training step
+    steady = throughput.rates[1:] or throughput.rates
+    manifest = {
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "model_key": weights_key(model, class_names),
+        "seed": seed,
+        "tensorflow_version": tf.__version__,
+        "sources": {path: {"examples": count, "sha256": file_sha256(path)} for path, count in sources.items()},
+        "classes": [str(name) for name in class_names],
+        "train_examples": int(len(train_labels)),
+        "validation_examples": int(len(val_labels)),
+        "epochs_run": len(history.history["loss"]),
+        "val_accuracy": round(float(val_accuracy), 4),
+        "examples_per_second": round(float(np.median(steady))),
+        "hyperparameters": {
+            "max_vocab": MAX_VOCAB, "max_len": MAX_LEN, "embedding_dim": EMBEDDING_DIM,
+            "lstm_units": LSTM_UNITS, "batch_size": batch_size, "validation_split": validation_split,
+            "patience": patience,
+        },
+        "training_seconds": round(time.perf_counter() - started, 1),
+    }
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    os.replace(model_path + ".tmp.keras", model_path)
+    os.replace(classes_path + ".tmp.npy", classes_path)
+    os.replace(manifest_path + ".tmp", manifest_path)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the intent model and export chatbot.keras, classes.npy and manifest.json")
+    parser.add_argument("--dataset", default="./models/dataset.json")
+    parser.add_argument("--chat-logs", action="append", default=[], help="JSON Lines of {text, tag}; repeatable")
+    parser.add_argument("--output-dir", default="./models")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--epochs", type=int, default=30)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--validation-split", type=float, default=0.2)
+    parser.add_argument("--patience", type=int, default=3, help="Epochs without val_loss improvement before stopping")
+    args = parser.parse_args()
+
+    manifest = train(args.dataset, args.chat_logs, args.output_dir, args.seed, args.epochs,
+                     args.batch_size, args.validation_split, args.patience)
+    print(f"val_accuracy {manifest['val_accuracy']} after {manifest['epochs_run']} epochs, "
+          f"{manifest['examples_per_second']} examples/s, {manifest['training_seconds']}s total")
+    print(f"exported model {manifest['model_key']} to {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()